@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Account Registry
+多賬戶存儲 - Railway 接收端按賬戶保存數據、版本和匯總緩存
+
+- 每個賬戶一個 IngestStore（數據文件 + 差量日誌）和一個 SummaryCache
+- 合併視圖：某個賬戶更新時只減去該賬戶舊的貢獻、加入新的貢獻，
+  不需要重新遍歷其他賬戶；讀取時返回按版本緩存的結果
+- 'default' 賬戶使用原來的數據文件，兼容不帶賬戶的舊上傳端
+- 多個 worker 時（shared 為 SharedSnapshots）：接收後把文檔和匯總的 JSON 發布到共享內存，
+  任何 worker 都可以直接發送；寫入在跨進程鎖內進行，寫入前先載入其他 worker 的新版本
+"""
+
+import json
+import os
+import re
+import threading
+from contextlib import nullcontext
+from datetime import date, datetime
+from pathlib import Path
+
+import calc_engine
+import expiry_timeline
+from fx_service import FxService
+from ingest_store import IngestStore
+from portfolio_summary import SummaryCache, with_derived_fields
+
+DEFAULT_ACCOUNT = 'default'
+CONSOLIDATED = 'all'
+ACCOUNT_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+def encode(data):
+    """發布到共享內存的 JSON（與 API 響應一致）"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+class InvalidAccount(Exception):
+    """賬戶名稱不合法"""
+
+
+class ConsolidatedView:
+    """跨賬戶合併視圖（增量維護）"""
+
+    def __init__(self):
+        self.index = calc_engine.PositionIndex()
+        self.aggregates = calc_engine.Aggregates()
+        self.rows = {}  # (account, key) -> row
+        self.keys_by_account = {}
+        self.account_summaries = {}
+        self.fx_by_account = {}
+        self.underlying_by_account = {}
+        self.versions = {}
+        self.updated_at = {}  # account -> 更新時的合併視圖版本
+        self.version = 0
+        self._cache = None
+        self._cache_key = None
+        self._lock = threading.Lock()
+
+    def update_account(self, account, document, version):
+        """用某個賬戶的最新文檔替換它的貢獻，計算量與該賬戶的持倉數成正比"""
+        with self._lock:
+            for key in self.keys_by_account.pop(account, ()):
+                pos = self.index.remove(key)
+                self.aggregates.apply(pos, self.rows.pop(key), -1)
+
+            underlying_prices = document.get('underlying_prices') or {}
+            keys = []
+            for pos in document.get('positions', []):
+                key = (account, calc_engine.position_key(pos))
+                if key in self.rows:
+                    continue  # 同一文檔內重複的持倉（position_key 已包含 IB 賬戶）
+                tagged = dict(pos, account_id=account)
+                quote = underlying_prices.get(calc_engine.underlying_of(pos)) or {}
+                row = calc_engine.calculation_row(tagged, pos.get('underlying_price') or quote.get('price') or 0)
+                row['account_id'] = account
+                self.index.add(tagged, key)
+                self.rows[key] = row
+                self.aggregates.apply(tagged, row, 1)
+                keys.append(key)
+            if self.aggregates.rebuild_due():
+                self.aggregates = calc_engine.Aggregates.build(
+                    (self.index.get(key), row) for key, row in self.rows.items()
+                )
+
+            self.keys_by_account[account] = keys
+            self.account_summaries[account] = document.get('account_summary') or {}
+            self.fx_by_account[account] = FxService.from_dict(document.get('fx_rates'))
+            self.underlying_by_account[account] = underlying_prices
+            self.versions[account] = version
+            self.version += 1
+            self.updated_at[account] = self.version
+            self._cache = None
+
+    def _account_summary(self):
+        """各賬戶的摘要按各自的匯率換算為 USD 後加總"""
+        return calc_engine.combine_account_summaries(
+            [(summary, self.fx_by_account[account]) for account, summary in self.account_summaries.items()],
+            'USD'
+        )
+
+    def _underlying_prices(self):
+        """各賬戶的底層股票價格合併，同一股票使用最近更新的賬戶的價格"""
+        prices = {}
+        for account in sorted(self.underlying_by_account, key=lambda a: self.updated_at[a]):
+            prices.update(self.underlying_by_account[account])
+        return prices
+
+    def snapshot(self):
+        """合併後的文檔和匯總（按版本緩存，跨日後到期時間線重新計算）"""
+        with self._lock:
+            key = (self.version, date.today())
+            if self._cache is None or self._cache_key != key:
+                # 使用最近更新的賬戶的匯率
+                latest = max(self.updated_at, key=lambda a: self.updated_at[a], default=None)
+                fx = self.fx_by_account.get(latest) or FxService()
+                account_summary = self._account_summary()
+                positions = list(self.index.by_con_id.values())
+                underlying_prices = self._underlying_prices()
+                self._cache = {
+                    'version': self.version,
+                    'accounts': dict(self.versions),
+                    'positions': positions,
+                    'underlying_prices': underlying_prices,
+                    'summary': self.aggregates.summary(),
+                    'options_by_expiry': self.aggregates.options_by_expiry(self.index),
+                    'account_summary': account_summary,
+                    'calculations': self.aggregates.calculations(self.rows.values(), account_summary, fx),
+                    'expiry_timeline': expiry_timeline.build_timeline(positions, underlying_prices),
+                    'computed_at': datetime.now().isoformat()
+                }
+                self._cache_key = key
+            return self._cache
+
+
+class AccountRegistry:
+    """按賬戶管理 IngestStore 和匯總緩存"""
+
+    def __init__(self, default_file, accounts_dir, shared=None):
+        self.default_file = Path(default_file)
+        self.accounts_dir = Path(accounts_dir)
+        self.shared = shared
+        self.stores = {}
+        self.summaries = {}
+        self.consolidated = ConsolidatedView()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """載入已有賬戶並建立合併視圖"""
+        if self.default_file.exists():
+            self._open(DEFAULT_ACCOUNT)
+        if self.accounts_dir.exists():
+            for path in sorted(self.accounts_dir.glob('*.json')):
+                if ACCOUNT_PATTERN.match(path.stem):
+                    self._open(path.stem)
+        for account, store in self.stores.items():
+            if store.get() is not None:
+                self.consolidated.update_account(account, store.get(), store.version)
+                self._publish_loaded(account, store)
+
+    def _path(self, account):
+        if account == DEFAULT_ACCOUNT:
+            return self.default_file
+        return self.accounts_dir / f'{account}.json'
+
+    def _open(self, account):
+        store = self.stores.get(account)
+        if store is None:
+            if account != DEFAULT_ACCOUNT:
+                self.accounts_dir.mkdir(parents=True, exist_ok=True)
+            store = self.stores[account] = IngestStore(self._path(account), derive=with_derived_fields)
+            self.summaries[account] = SummaryCache()
+        return store
+
+    @staticmethod
+    def validate(account):
+        account = account or DEFAULT_ACCOUNT
+        if account == CONSOLIDATED or not ACCOUNT_PATTERN.match(account):
+            raise InvalidAccount(f"Invalid account: {account}")
+        return account
+
+    def resolve(self, account):
+        """讀取時的賬戶：未指定時依次使用 default、唯一的賬戶、合併視圖"""
+        if account:
+            return account
+        self.sync()
+        if DEFAULT_ACCOUNT in self.stores or not self.stores:
+            return DEFAULT_ACCOUNT
+        if len(self.stores) == 1:
+            return next(iter(self.stores))
+        return CONSOLIDATED
+
+    def store(self, account, create=False):
+        with self._lock:
+            if create:
+                return self._open(self.validate(account))
+            return self.stores.get(account)
+
+    def accounts(self):
+        """賬戶列表及各自的數據版本"""
+        self.sync()
+        result = []
+        for account, store in sorted(self.stores.items()):
+            document = store.get() or {}
+            result.append({
+                'account': account,
+                'version': store.version,
+                'last_update': document.get('last_update'),
+                'positions_count': len(document.get('positions', []))
+            })
+        return result
+
+    def ingest_full(self, account, document):
+        store = self.store(account, create=True)
+        with self._write_lock(account):
+            self._sync_store(account, store)
+            version, write_ms = store.replace(document)
+            self._after_ingest(account, store)
+        return version, write_ms
+
+    def ingest_delta(self, account, delta):
+        store = self.store(account, create=True)
+        with self._write_lock(account):
+            self._sync_store(account, store)
+            version, write_ms = store.apply(delta)
+            self._after_ingest(account, store)
+        return version, write_ms
+
+    def _after_ingest(self, account, store):
+        """增量更新合併視圖，並把新文檔發布到共享內存"""
+        self.consolidated.update_account(account, store.get(), store.version)
+        if self.shared is not None:
+            self._segment('portfolio', account).publish(encode(store.get()), store.version)
+
+    # ---- 多 worker 共享 ----
+
+    def _segment(self, kind, account):
+        return self.shared.segment(f'{kind}.{account}')
+
+    def _write_lock(self, account):
+        """寫入某個賬戶的跨進程鎖（未啟用共享時不加鎖）"""
+        if self.shared is None:
+            return nullcontext()
+        return self._segment('portfolio', account).lock()
+
+    def _publish_loaded(self, account, store):
+        """啟動時共享內存中還沒有該賬戶（第一個啟動的 worker）則發布從文件載入的版本"""
+        if self.shared is None:
+            return
+        segment = self._segment('portfolio', account)
+        if segment.version < store.version:
+            with segment.lock():
+                if segment.version < store.version:
+                    segment.publish(encode(store.get()), store.version)
+
+    def _sync_store(self, account, store):
+        """其他 worker 已寫入更新的版本時重新載入（在寫入鎖內調用）"""
+        if self.shared is None or self._segment('portfolio', account).version <= store.version:
+            return
+        store.reload()
+        if store.get() is not None:
+            self.consolidated.update_account(account, store.get(), store.version)
+
+    def sync(self, account=None):
+        """載入其他 worker 接收的新版本；account=None 時檢查所有賬戶（包括其他 worker 新建的賬戶）
+
+        只比較共享內存中的版本號，沒有變化時不讀取文件。
+        """
+        if self.shared is None:
+            return
+        if account is None:
+            names = [name.split('.', 1)[1] for name in self.shared.names('portfolio.')]
+        else:
+            names = [account]
+        for name in names:
+            store = self.stores.get(name)
+            if store is None and not (ACCOUNT_PATTERN.match(name) and self.shared.exists(f'portfolio.{name}')):
+                continue
+            segment = self._segment('portfolio', name)
+            if store is not None and segment.version <= store.version:
+                continue
+            if store is None and not segment.version:
+                continue
+            with segment.lock():
+                if store is None:
+                    store = self.store(name, create=True)
+                    if store.get() is not None:
+                        self.consolidated.update_account(name, store.get(), store.version)
+                self._sync_store(name, store)
+
+    def shared_versions(self):
+        """共享內存中各賬戶的最新版本"""
+        if self.shared is None:
+            return {}
+        return {name.split('.', 1)[1]: self.shared.segment(name).version
+                for name in self.shared.names('portfolio.')}
+
+    def shared_path(self, kind, account):
+        """共享內存中最新的 portfolio / summary JSON 文件，返回 (版本, 路徑)，沒有時返回 (0, None)
+
+        匯總的版本落後於文檔（還沒有 worker 計算新版本的匯總）或不是今天計算的時返回 (0, None)。
+        """
+        if self.shared is None or account == CONSOLIDATED:
+            return 0, None
+        self.sync(account)
+        if account not in self.stores:
+            return 0, None
+        version, path = self._segment(kind, account).current()
+        if path is not None and kind == 'summary':
+            try:
+                stale = (version < self._segment('portfolio', account).version
+                         or date.fromtimestamp(path.stat().st_mtime) != date.today())
+            except FileNotFoundError:
+                stale = True
+            if stale:
+                return 0, None
+        return version, path
+
+    def _publish_summary(self, account, summary, version):
+        segment = self._segment('summary', account)
+        if segment.version < version:
+            with segment.lock():
+                if segment.version < version:
+                    segment.publish(encode(summary), version)
+
+    # ---- 讀取 ----
+
+    def version(self, account):
+        """賬戶（或合併視圖）當前的數據版本，沒有數據時為 0"""
+        self.sync(None if account == CONSOLIDATED else account)
+        if account == CONSOLIDATED:
+            return self.consolidated.version
+        store = self.stores.get(account)
+        return store.version if store else 0
+
+    def document(self, account):
+        """賬戶文檔；account='all' 時返回合併視圖"""
+        self.sync(None if account == CONSOLIDATED else account)
+        if account == CONSOLIDATED:
+            return self.consolidated.snapshot() if self.stores else None
+        store = self.stores.get(account)
+        return store.get() if store else None
+
+    def summary(self, account):
+        """賬戶匯總（按版本緩存）；account='all' 時返回合併匯總"""
+        self.sync(None if account == CONSOLIDATED else account)
+        if account == CONSOLIDATED:
+            if not self.stores:
+                return None
+            snapshot = self.consolidated.snapshot()
+            return {
+                'version': snapshot['version'],
+                'accounts': snapshot['accounts'],
+                'summary': snapshot['summary'],
+                'calculations': snapshot['calculations'],
+                'expiry_timeline': snapshot['expiry_timeline'],
+                'computed_at': snapshot['computed_at']
+            }
+        store = self.stores.get(account)
+        if store is None:
+            return None
+        summary = self.summaries[account].get(store.get(), store.version)
+        if self.shared is not None and summary is not None:
+            self._publish_summary(account, summary, store.version)
+        return summary
@@ -5,24 +5,46 @@ IB 倉位監控系統 - 增強版（獲取所有可用數據）
 """
 
 
-from flask import Flask, jsonify, send_file, render_template_string, request, send_from_directory
+from flask import Flask, jsonify, send_file, render_template_string, request, send_from_directory, Response, stream_with_context
 import json
 import os
 import threading
 import time
 import logging
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
 from ibapi.order import Order
 import queue
 import atexit
-import requests
 import webbrowser
 from dotenv import load_dotenv
 
+import calc_engine
+import tick_ingest
+import margin_model
+import expiry_timeline
+from snapshot_store import SnapshotStore
+from cloud_uploader import CloudUploader
+from cloud_sync import CloudSyncWorker, load_sync_settings
+from upload_outbox import UploadOutbox
+from http_client import HttpClient
+from quote_cache import FmpQuotes, QuoteCache
+from portfolio_summary import SummaryCache
+from live_stream import LiveUpdates
+from ws_hub import STREAM_KEEPALIVE_SECONDS, WebSocketHub, sse_message
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+import update_vercel_data
+import vercel_publisher
+from dashboard_assets import DashboardAssets, initial_state
+from fx_service import FxService, fx_pair
+
 # 加載環境變量
 load_dotenv()
 
@@ -45,11 +67,18 @@ CONFIG = {
     'SERVER_PORT': int(os.environ.get('PORT', '8080')),  # Railway uses PORT env var
     'DATA_FILE': 'portfolio_data_enhanced.json',
     'DASHBOARD_FILE': 'dashboard_new.html',
+    'DASHBOARD_ASSETS': os.environ.get('DASHBOARD_ASSETS', 'on') != 'off',  # 拆分、精簡並預壓縮儀表板
     'AUTO_UPDATE_INTERVAL': int(os.environ.get('AUTO_UPDATE_INTERVAL', '300')),
     'FMP_API_KEY': os.environ.get('FMP_API_KEY', ''),  # API key should be set via environment variable
+    'QUOTE_TTL': int(os.environ.get('QUOTE_TTL', '30')),  # 股票報價緩存時間（秒）
     'CLOUD_CONFIG_FILE': 'cloud_upload_config.json',
+    'OUTBOX_FILE': 'upload_outbox.db',  # 待上傳快照的持久化隊列
     'ENVIRONMENT': os.environ.get('ENVIRONMENT', 'development'),
-    'TARGET_ACCOUNT': os.environ.get('TARGET_ACCOUNT', '')  # 目標賬戶，從環境變量讀取
+    'TARGET_ACCOUNT': os.environ.get('TARGET_ACCOUNT', ''),  # 主賬戶（whatIf 訂單、賬戶更新），從環境變量讀取
+    'ACCOUNTS': [a for a in os.environ.get('IB_ACCOUNTS', '').split(',') if a],  # 要匯總的賬戶，空 = 所有管理的賬戶
+    'FX_SUBSCRIBE': os.environ.get('FX_SUBSCRIBE', 'false').lower() == 'true',  # 是否訂閱 IDEALPRO 匯率
+    'CLOUD_AUTO_SYNC': os.environ.get('CLOUD_AUTO_SYNC', 'true').lower() == 'true',  # 保存後自動同步到雲端
+    'WHAT_IF_TIMEOUT': float(os.environ.get('WHAT_IF_TIMEOUT', '5'))  # 一次驗證請求中所有 whatIf 訂單共用的等待時間（秒）
 }
 
 # 全局變量
@@ -58,6 +87,17 @@ update_lock = threading.Lock()
 auto_update_thread = None
 stop_auto_update = threading.Event()
 cloud_config = None
+# 共享 HTTP 客戶端（FMP 和雲端上傳共用連接池）
+http_client = HttpClient(host_limits={'financialmodelingprep.com': 4})
+# 股票報價緩存（/api/stock-prices 和底層股票價格共用，後台刷新持倉中的股票）
+fmp_quotes = FmpQuotes(http_client, CONFIG['FMP_API_KEY'])  # 批次並發請求，整次獲取有截止時間
+quote_cache = QuoteCache(fmp_quotes.fetch, ttl=CONFIG['QUOTE_TTL'])
+quote_cache.add_listener(lambda quotes: ib_client.apply_quotes(quotes) if ib_client else None)
+cloud_uploader = None
+cloud_sync = None
+snapshot_store = SnapshotStore(CONFIG['DATA_FILE'])  # 數據文件的唯一讀寫入口
+margin_cache = {'version': None, 'model': None}  # 按快照版本緩存的保證金模型
+summary_cache = SummaryCache()  # 按快照版本緩存的匯總（與生產環境 /api/summary 一致）
 
 # 雲端上傳功能
 def load_cloud_config():
@@ -98,225 +138,11 @@ def save_cloud_config():
 def calculate_cloud_data():
     """計算所有需要上傳到雲端的數據，包含完整的計算邏輯"""
     try:
-        # 讀取當前數據文件
-        data_file = Path(CONFIG['DATA_FILE'])
-        if not data_file.exists():
+        portfolio_data = snapshot_store.get()
+        if portfolio_data is None:
             return None
-            
-        with open(data_file, 'r', encoding='utf-8') as f:
-            portfolio_data = json.load(f)
-        
-        # 常量定義
-        USD_TO_HKD = 7.8
-        
-        # 初始化計算結果
-        calculations = {
-            'us_options': {
-                'total_expiry_value': 0,
-                'actual_expiry_value': 0,
-                'max_capital_required': 0,
-                'total_pnl': 0,
-                'positions': []
-            },
-            'hk_options': {
-                'total_expiry_value': 0,
-                'actual_expiry_value': 0,
-                'positions': []
-            },
-            'stocks': {
-                'total_value': 0,
-                'total_pnl': 0,
-                'positions': []
-            },
-            'summary': {
-                'net_liquidation_usd': 0,
-                'net_liquidation_hkd': 0,
-                'available_funds_usd': 0,
-                'available_funds_hkd': 0,
-                'max_return_rate': 0,
-                'current_return_rate': 0
-            },
-            'expiry_groups': []
-        }
         
-        # 獲取賬戶摘要數據
-        if 'account_summary' in portfolio_data:
-            summary = portfolio_data['account_summary']
-            if 'NetLiquidation' in summary and summary.get('NetLiquidation', {}).get('value'):
-                # 假設從API收到的值是帳戶的基礎貨幣
-                net_liq_value = float(summary['NetLiquidation']['value'])
-                if summary['NetLiquidation'].get('currency') == 'USD':
-                    calculations['summary']['net_liquidation_usd'] = net_liq_value
-                    calculations['summary']['net_liquidation_hkd'] = net_liq_value * USD_TO_HKD
-                else: # 預設為 HKD
-                    calculations['summary']['net_liquidation_hkd'] = net_liq_value
-                    calculations['summary']['net_liquidation_usd'] = net_liq_value / USD_TO_HKD
-
-            if 'AvailableFunds' in summary and summary.get('AvailableFunds', {}).get('value'):
-                avail_funds_value = float(summary['AvailableFunds']['value'])
-                if summary['AvailableFunds'].get('currency') == 'USD':
-                    calculations['summary']['available_funds_usd'] = avail_funds_value
-                    calculations['summary']['available_funds_hkd'] = avail_funds_value * USD_TO_HKD
-                else: # 預設為 HKD
-                    calculations['summary']['available_funds_hkd'] = avail_funds_value
-                    calculations['summary']['available_funds_usd'] = avail_funds_value / USD_TO_HKD
-        
-        # 處理每個持倉
-        positions = portfolio_data.get('positions', [])
-        for pos in positions:
-            # 計算通用字段
-            pos_calc = {
-                'symbol': pos.get('symbol'),
-                'contract_type': pos.get('secType'),
-                'currency': pos.get('currency'),
-                'position': pos.get('position', 0),
-                'avg_cost': pos.get('avg_cost', 0),
-                'market_value': pos.get('market_value', 0),
-                'pnl': pos.get('pnl'),
-                'has_market_data': pos.get('has_market_data', False)
-            }
-            
-            # 期權特定計算
-            if pos.get('secType') == 'OPT':
-                strike = pos.get('strike', 0)
-                underlying_price = pos.get('underlying_price', 0)
-                right = pos.get('right', '')
-                expiry = pos.get('expiry', '')
-                days_to_expiry = pos.get('days_to_expiry', 0)
-                
-                pos_calc.update({
-                    'strike': strike,
-                    'right': right,
-                    'expiry': expiry,
-                    'days_to_expiry': days_to_expiry,
-                    'underlying_price': underlying_price
-                })
-                
-                # 計算距離幅度
-                if underlying_price > 0 and strike > 0:
-                    distance_percent = ((underlying_price - strike) / strike) * 100
-                    pos_calc['distance_percent'] = distance_percent
-                else:
-                    pos_calc['distance_percent'] = None
-                
-                # 計算實際到期價值
-                if right == 'P' and pos.get('position', 0) < 0:  # Short Put
-                    avg_cost = pos.get('avg_cost', pos.get('avgCost', 0))
-                    position_size = abs(pos.get('position', 0))
-                    
-                    if underlying_price > 0:
-                        if underlying_price >= strike:
-                            # 不會被行權，收取權利金
-                            actual_expiry_value = avg_cost * position_size * 100
-                        else:
-                            # 會被行權，計算損失
-                            loss = (strike - underlying_price - avg_cost) * position_size * 100
-                            actual_expiry_value = -loss
-                    else:
-                        # 沒有底層價格，保守估計
-                        actual_expiry_value = avg_cost * position_size * 100
-                    
-                    pos_calc['actual_expiry_value'] = actual_expiry_value
-                    
-                    # 計算接貨資金
-                    capital_required = (strike - avg_cost) * position_size * 100
-                    pos_calc['capital_required'] = capital_required
-                else:
-                    # 其他期權類型
-                    pos_calc['actual_expiry_value'] = abs(pos.get('market_value', 0))
-                    pos_calc['capital_required'] = 0
-                
-                # 分類統計
-                if pos.get('currency') == 'USD':
-                    calculations['us_options']['positions'].append(pos_calc)
-                    calculations['us_options']['total_expiry_value'] += abs(pos.get('market_value', 0))
-                    calculations['us_options']['actual_expiry_value'] += pos_calc['actual_expiry_value']
-                    calculations['us_options']['max_capital_required'] += pos_calc.get('capital_required', 0)
-                    if pos.get('pnl') is not None:
-                        calculations['us_options']['total_pnl'] += pos.get('pnl', 0)
-                elif pos.get('currency') == 'HKD':
-                    calculations['hk_options']['positions'].append(pos_calc)
-                    calculations['hk_options']['total_expiry_value'] += abs(pos.get('market_value', 0))
-                    calculations['hk_options']['actual_expiry_value'] += pos_calc.get('actual_expiry_value', 0)
-            
-            # 股票特定計算
-            elif pos.get('secType') == 'STK':
-                current_price = underlying_price if underlying_price > 0 else 0
-                
-                if current_price > 0:
-                    market_value = pos.get('position', 0) * current_price
-                    cost = pos.get('position', 0) * pos.get('avg_cost', 0)
-                    pnl = market_value - cost
-                    pnl_percent = (pnl / cost * 100) if cost > 0 else 0
-                    
-                    pos_calc.update({
-                        'current_price': current_price,
-                        'calculated_market_value': market_value,
-                        'calculated_pnl': pnl,
-                        'pnl_percent': pnl_percent
-                    })
-                else:
-                    pos_calc.update({
-                        'current_price': 0,
-                        'calculated_market_value': pos.get('market_value', 0),
-                        'calculated_pnl': 0,
-                        'pnl_percent': 0
-                    })
-                
-                calculations['stocks']['positions'].append(pos_calc)
-                calculations['stocks']['total_value'] += pos_calc.get('calculated_market_value', 0)
-                calculations['stocks']['total_pnl'] += pos_calc.get('calculated_pnl', 0)
-        
-        # 計算回報率
-        if calculations['us_options']['max_capital_required'] > 0:
-            calculations['summary']['max_return_rate'] = (
-                calculations['us_options']['actual_expiry_value'] / 
-                calculations['us_options']['max_capital_required'] * 100
-            )
-        
-        if calculations['summary']['net_liquidation_usd'] > 0:
-            calculations['summary']['current_return_rate'] = (
-                calculations['us_options']['actual_expiry_value'] / 
-                calculations['summary']['net_liquidation_usd'] * 100
-            )
-        
-        # 處理到期日分組
-        if 'options_by_expiry' in portfolio_data:
-            for expiry_group in portfolio_data['options_by_expiry']:
-                group_calc = {
-                    'expiry': expiry_group.get('expiry'),
-                    'expiry_formatted': expiry_group.get('expiry_formatted'),
-                    'days_to_expiry': expiry_group.get('days_to_expiry', 0),
-                    'us_options': {
-                        'count': 0,
-                        'total_value': 0,
-                        'total_pnl': 0,
-                        'capital_required': 0
-                    },
-                    'hk_options': {
-                        'count': 0,
-                        'total_value': 0
-                    }
-                }
-                
-                # 統計每個到期日的數據
-                for symbol in expiry_group.get('positions', []):
-                    pos = next((p for p in positions if p.get('symbol') == symbol and p.get('expiry') == expiry_group.get('expiry')), None)
-                    if pos:
-                        if pos.get('currency') == 'USD':
-                            group_calc['us_options']['count'] += 1
-                            group_calc['us_options']['total_value'] += abs(pos.get('market_value', 0))
-                            if pos.get('pnl') is not None:
-                                group_calc['us_options']['total_pnl'] += pos.get('pnl', 0)
-                            if pos.get('right') == 'P' and pos.get('position', 0) < 0:
-                                avg_cost = pos.get('avg_cost', pos.get('avgCost', 0))
-                                capital = (pos.get('strike', 0) - avg_cost) * abs(pos.get('position', 0)) * 100
-                                group_calc['us_options']['capital_required'] += capital
-                        elif pos.get('currency') == 'HKD':
-                            group_calc['hk_options']['count'] += 1
-                            group_calc['hk_options']['total_value'] += abs(pos.get('market_value', 0))
-                
-                calculations['expiry_groups'].append(group_calc)
+        calculations = calc_engine.calculate_cloud_data(portfolio_data)
         
         # 調試信息輸出
         print("\n" + "="*20 + " 收益率計算調試 (後端) " + "="*20)
@@ -347,86 +173,67 @@ def calculate_cloud_data():
         return None
 
 def upload_to_cloud(calculated_summary=None):
-    """上傳當前數據到雲端，包含完整的計算邏輯"""
-    global cloud_config
-    
-    if not cloud_config or not cloud_config.get('enabled'):
-        return {'success': False, 'message': '雲端上傳未啟用'}
-    
-    required_fields = ['api_url', 'api_key', 'account_number']
-    for field in required_fields:
-        if not cloud_config.get(field):
-            return {'success': False, 'message': f'雲端配置缺失: {field}'}
-    
-    try:
-        # 讀取當前數據文件
-        data_file = Path(CONFIG['DATA_FILE'])
-        if not data_file.exists():
-            return {'success': False, 'message': '找不到本地數據文件'}
-        
-        with open(data_file, 'r', encoding='utf-8') as f:
-            portfolio_data = json.load(f)
-        
-        # 準備上傳數據 - 直接上傳原始數據（簡化版）
-        upload_payload = {
-            'portfolio_data': portfolio_data
-        }
-        
-        # 如果有額外的計算汇總數據，也添加進去
-        if calculated_summary:
-            upload_payload['additional_summary'] = calculated_summary
-        
-        headers = {
-            'Authorization': f'Bearer {cloud_config["api_key"]}',
-            'Content-Type': 'application/json'
-        }
-        
-        logger.info(f"正在上傳完整數據到雲端: {cloud_config['api_url']}")
-        logger.info(f"上傳數據包含: {len(portfolio_data.get('positions', []))} 個持倉，{len(calculated_data['expiry_groups'])} 個到期組")
-        
-        # Debug: 打印上傳數據結構
-        if cloud_config.get('debug'):
-            logger.info(f"Upload payload keys: {list(upload_payload.keys())}")
-            logger.info(f"Portfolio data keys: {list(portfolio_data.keys())}")
-            logger.info(f"Positions count in payload: {len(upload_payload['portfolio_data'].get('positions', []))}")
-        
-        response = requests.post(
-            cloud_config['api_url'],
-            json=upload_payload,
-            headers=headers,
-            timeout=30
-        )
-        
-        logger.info(f"Railway upload response status: {response.status_code}")
-        logger.info(f"Railway upload response: {response.text}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            positions_count = len(portfolio_data.get('positions', []))
-            logger.info(f"雲端上傳成功: {positions_count} 個持倉及完整計算數據")
-            return {
-                'success': True, 
-                'message': f'成功上傳 {positions_count} 個持倉及完整計算邏輯到雲端',
-                'positions_count': positions_count,
-                'calculations_included': True
-            }
-        else:
-            error_msg = f"HTTP {response.status_code}"
-            try:
-                error_detail = response.json().get('detail', response.text)
-                error_msg += f": {error_detail}"
-            except:
-                error_msg += f": {response.text[:200]}"
-            
-            logger.error(f"雲端上傳失敗: {error_msg}")
-            return {'success': False, 'message': f'上傳失敗: {error_msg}'}
-            
-    except Exception as e:
-        logger.error(f"雲端上傳異常: {str(e)}")
-        return {'success': False, 'message': f'上傳異常: {str(e)}'}
+    """上傳當前快照到雲端，返回結構化結果"""
+    return cloud_uploader.upload(snapshot_store.get(), calculated_summary)
 
 # 初始化雲端配置
 load_cloud_config()
+cloud_uploader = CloudUploader(cloud_config, http_client)
+publisher = vercel_publisher.load_publisher(http_client)  # 配置了 "publish" 時的靜態數據發布
+cloud_sync = CloudSyncWorker(cloud_uploader, UploadOutbox(CONFIG['OUTBOX_FILE']), **load_sync_settings())
+snapshot_store.add_listener(cloud_sync.notify)
+
+def enrich_live_updates(updates):
+    """推送前加入計算引擎的現價、市值和盈虧"""
+    if ib_client is not None:
+        ib_client.enrich_live_updates(updates)
+
+def summarize_live_updates():
+    """tick 推送後的匯總事件內容"""
+    if ib_client is None:
+        return None
+    return ib_client.live_summary()
+
+# 實時推送（/api/stream）：tick 按 conId 合併，每 250ms 最多推送一次；匯總每 2 秒最多推送一次
+live_updates = LiveUpdates(enrich=enrich_live_updates, summarize=summarize_live_updates)
+
+def notify_snapshot(portfolio_data, version):
+    """快照保存後通知儀表板重新載入"""
+    live_updates.publish_event('snapshot', {
+        'version': version,
+        'last_update': portfolio_data.get('last_update')
+    })
+
+snapshot_store.add_listener(notify_snapshot)
+
+# WebSocket 推送（/ws）：按客戶端訂閱的賬戶、底層股票和字段分發
+ws_hub = WebSocketHub()
+
+def forward_to_hub(seq, event_type, payload):
+    """把實時更新轉發給 WebSocket 客戶端（ticks 按賬戶拆分為每個持倉一條）"""
+    if event_type != 'ticks':
+        ws_hub.publish_event(event_type, payload)
+        return
+    items = []
+    for con_id, fields in payload['updates'].items():
+        market = {k: v for k, v in fields.items() if k not in ('positions', 'underlying')}
+        for account_id, values in (fields.get('positions') or {None: {}}).items():
+            items.append({
+                'key': f"{account_id}:{con_id}",
+                'id': str(con_id),
+                'account': account_id,
+                'underlying': fields.get('underlying'),
+                'fields': dict(market, **values)
+            })
+    ws_hub.publish(items)
+
+live_updates.add_listener(forward_to_hub)
+
+def contract_key(contract):
+    """合約鍵 - 期權包含到期日、方向和行權價（行情數據按此鍵保存，各賬戶共用）"""
+    if contract.secType == 'OPT':
+        return f"{contract.symbol}_{contract.lastTradeDateOrContractMonth}_{contract.right}_{contract.strike}"
+    return contract.symbol
 
 class EnhancedIBClient(EWrapper, EClient):
     """增強版 IB API 客戶端 - 獲取所有可用數據"""
@@ -434,16 +241,26 @@ class EnhancedIBClient(EWrapper, EClient):
     def __init__(self):
         EClient.__init__(self, self)
         self.connected = False
-        self.positions = {}  # 使用字典存儲，key為symbol
-        self.contracts = {}  # 存儲完整的contract對象
-        self.market_data = {}  # 市場數據
-        self.account_summary = {}  # 賬戶摘要
+        
+        # 匯率服務（來自 ExchangeRate 賬戶值或 IDEALPRO 報價）
+        self.fx = FxService()
+        self.fx_req_map = {}  # reqId -> (symbol, currency)
+        self.fx_quotes = {}  # reqId -> {'bid', 'ask', 'last', 'close'}
+        
+        # 計算引擎持有持倉和行情輸入，回調寫入後調用 engine.touch() 標記變化
+        self.engine = calc_engine.CalcEngine(fx=self.fx)
+        self.positions = self.engine.positions  # key 為 (賬戶, 合約鍵)，每個賬戶一本持倉
+        self.contracts = {}  # 合約鍵 -> contract 對象（多個賬戶持有同一合約時只保存一份）
+        self.market_data = self.engine.market_data  # 市場數據，key 為合約鍵
+        self.account_summary = {}  # 主賬戶摘要
+        self.account_summaries = {}  # 賬戶 -> 賬戶摘要（所有匯總的賬戶）
         self.account_values = {}  # 賬戶價值
-        self.pnl_data = {}  # 盈虧數據 (renamed from self.pnl to avoid conflict)
-        self.options_data = {}  # 期權特定數據
-        self.historical_data = {}  # 歷史數據
+        self.pnl_data = self.engine.pnl_data  # 盈虧數據 (renamed from self.pnl to avoid conflict)
+        self.options_data = self.engine.options_data  # 期權特定數據
+        self.historical_data = self.engine.historical_data  # 歷史數據
         
         self.nextOrderId = 1
+        self.what_if_requests = {}  # orderId -> {'event', 'order_state'}
         self._thread = None
         self.update_complete = threading.Event()
         self.connection_ready = threading.Event()
@@ -452,16 +269,78 @@ class EnhancedIBClient(EWrapper, EClient):
         
         # 請求ID管理
         self.req_id_counter = 1000
-        self.req_id_map = {}  # reqId -> symbol mapping
+        self.req_id_map = {}  # reqId -> 合約鍵
+        self.subscriptions = {}  # conId -> 行情 reqId，同一合約只訂閱一次
+        self.con_id_keys = {}  # conId -> 合約鍵（實時推送按 conId）
+        
+        # 行情 tick 在 EReader 線程中只入隊，由後台線程批量寫入引擎
+        self.ticks = tick_ingest.TickIngest(self.engine, self.req_id_map, on_update=self.push_update)
         
         # 賬戶信息
-        self.account = None  # 將存儲主賬戶號
+        self.account = None  # 主賬戶號
+        self.accounts = []  # 匯總的所有賬戶
         
         # 錯誤追蹤
         self.errors = []  # 存儲所有錯誤信息
         
+        # 底層股票報價由報價緩存的後台刷新維護，保存快照時只讀取緩存，不等待網絡
+        self.quote_symbols = set()  # 當前持倉需要報價的股票
+        self.missing_quotes = set()  # 上次保存時還沒有報價的股票
+        self._save_lock = threading.Lock()  # IB 線程和報價刷新線程都可能保存快照
+        
         # 雲端功能已移除
         
+    def reset_data(self):
+        """清空舊數據（準備重新請求持倉）"""
+        self.update_complete.clear()  # 重新收集完成前，報價刷新不保存快照
+        self.engine.reset()
+        self.cancel_subscriptions()
+        self.contracts.clear()
+        self.con_id_keys.clear()
+        self.account_summary.clear()
+        self.account_summaries.clear()
+        self.errors = []
+    
+    def cancel_subscriptions(self):
+        """取消所有持倉的行情訂閱（重新請求持倉後按新的合約列表訂閱）"""
+        if self.isConnected():
+            for req_id in self.subscriptions.values():
+                self.cancelMktData(req_id)
+                self.req_id_map.pop(req_id, None)
+        self.subscriptions.clear()
+    
+    def push_update(self, symbol, fields):
+        """推送合約的字段更新（在 live_updates 中按 conId 合併）"""
+        contract = self.contracts.get(symbol)
+        if contract is not None and contract.conId:
+            live_updates.publish(contract.conId, fields)
+    
+    def enrich_live_updates(self, updates):
+        """為推送的更新加入重新計算後的現價，以及每個賬戶的市值和盈虧"""
+        self.engine.refresh()
+        for con_id, fields in updates.items():
+            symbol = self.con_id_keys.get(con_id)
+            records = self.engine.records_for(symbol) if symbol else []
+            if records:
+                fields['underlying'] = calc_engine.underlying_of(records[0])
+                fields['current_price'] = records[0].get('current_price')
+                fields['positions'] = {
+                    record.get('account_id'): {'market_value': record.get('market_value'), 'pnl': record.get('pnl')}
+                    for record in records
+                }
+    
+    def live_summary(self):
+        """當前計算結果的總計（不含持倉列表），儀表板收到後替換 calculations 中的總計"""
+        snapshot = self.engine.snapshot(self.consolidated_account_summary())
+        return {
+            'version': snapshot['version'],
+            'calculations': calc_engine.calculation_totals(snapshot['calculations'])
+        }
+    
+    def tracks(self, account):
+        """是否匯總該賬戶的數據"""
+        return not self.accounts or account in self.accounts
+        
     def nextReqId(self):
         """生成下一個請求ID"""
         self.req_id_counter += 1
@@ -505,6 +384,11 @@ class EnhancedIBClient(EWrapper, EClient):
         
         if errorCode in info_codes:
             return
+        
+        # 標記無法訂閱市場數據的持倉
+        if errorCode in calc_engine.SUBSCRIPTION_ERROR_CODES and reqId in self.req_id_map:
+            self.engine.mark_subscription_error(self.req_id_map[reqId])
+        
         elif errorCode in expected_errors:
             error_info['level'] = 'warning'
             self.errors.append(error_info)
@@ -522,7 +406,9 @@ class EnhancedIBClient(EWrapper, EClient):
         """連接確認"""
         super().connectAck()
         self.connected = True
+        live_updates.publish_event('status', {'tws_connected': True})
         logger.info("Connected to TWS")
+        self.ticks.start()
         if not self._thread or not self._thread.is_alive():
             self._thread = threading.Thread(target=self.run, daemon=True)
             self._thread.start()
@@ -531,7 +417,9 @@ class EnhancedIBClient(EWrapper, EClient):
         """連接關閉"""
         super().connectionClosed()
         self.connected = False
+        live_updates.publish_event('status', {'tws_connected': False})
         logger.info("Disconnected from TWS")
+        self.ticks.stop()
     
     def nextValidId(self, orderId: int):
         """接收下一個有效訂單ID"""
@@ -540,43 +428,90 @@ class EnhancedIBClient(EWrapper, EClient):
         logger.info(f"Next Valid Order ID: {orderId}")
         self.connection_ready.set()
     
+    def requestWhatIf(self, symbol, expiry, strike, right='P', quantity=-1, limit_price=0.0):
+        """提交 whatIf 訂單（不會真正下單），返回 orderId，結果在 openOrder 回調中"""
+        contract = Contract()
+        contract.symbol = symbol
+        contract.secType = 'OPT'
+        contract.exchange = 'SMART'
+        contract.currency = 'USD'
+        contract.lastTradeDateOrContractMonth = expiry
+        contract.strike = float(strike)
+        contract.right = right
+        contract.multiplier = '100'
+        
+        order = Order()
+        order.action = 'SELL' if quantity < 0 else 'BUY'
+        order.totalQuantity = abs(quantity)
+        order.orderType = 'LMT'
+        order.lmtPrice = limit_price
+        order.whatIf = True
+        if self.account:
+            order.account = self.account
+        
+        order_id = self.nextOrderId
+        self.nextOrderId += 1
+        self.what_if_requests[order_id] = {'event': threading.Event(), 'order_state': None}
+        self.placeOrder(order_id, contract, order)
+        logger.info(f"WhatIf order {order_id}: {order.action} {abs(quantity)} {symbol} {expiry} {strike}{right}")
+        return order_id
+    
+    def openOrder(self, orderId, contract, order, orderState):
+        """接收訂單狀態，whatIf 訂單的保證金變化在 orderState 中"""
+        request = self.what_if_requests.get(orderId)
+        if request is None:
+            return
+        request['order_state'] = {
+            'initMarginChange': orderState.initMarginChange,
+            'maintMarginChange': orderState.maintMarginChange,
+            'equityWithLoanChange': orderState.equityWithLoanChange,
+            'initMarginAfter': orderState.initMarginAfter,
+            'maintMarginAfter': orderState.maintMarginAfter,
+            'commission': orderState.commission,
+            'warningText': orderState.warningText
+        }
+        request['event'].set()
+    
     def managedAccounts(self, accountsList: str):
         """接收管理的賬戶列表"""
         super().managedAccounts(accountsList)
-        accounts = accountsList.split(",")
-        # 使用指定的目標賬戶（如果有）
+        accounts = [a for a in accountsList.split(",") if a]
+        # 匯總所有管理的賬戶（或 IB_ACCOUNTS 指定的賬戶）
+        if CONFIG['ACCOUNTS']:
+            accounts = [a for a in accounts if a in CONFIG['ACCOUNTS']]
+        if not accounts:
+            logger.warning(f"No valid accounts found in: {accountsList}")
+            return
+        self.accounts = accounts
+        logger.info(f"Managed accounts: {len(accounts)} aggregated")
+        
+        # 主賬戶：指定的目標賬戶（如果有），否則使用第一個賬戶
         target_account = CONFIG['TARGET_ACCOUNT']
         if target_account and target_account in accounts:
             self.account = target_account
-            logger.info(f"Managed accounts: {len(accounts)} available")
             logger.info(f"Using target account: {target_account[:2]}******")
-        elif accounts and accounts[0]:
-            # 如果沒有指定目標賬戶，使用第一個可用賬戶
+        else:
             self.account = accounts[0]
-            logger.info(f"Managed accounts: {len(accounts)} available")
             logger.info(f"Using first available account: {self.account[:2]}******")
-        else:
-            logger.warning(f"No valid accounts found in: {accountsList}")
         
     def position(self, account: str, contract: Contract, position: float, avgCost: float):
-        """接收持倉數據"""
-        # 只處理目標賬戶的持倉
-        if self.account and account != self.account:
+        """接收持倉數據（reqPositions 返回所有賬戶的持倉）"""
+        if not self.tracks(account):
             return
             
         if position != 0:
-            symbol = contract.symbol
+            # 期權的合約鍵包含更多信息來區分不同的期權合約
+            symbol = contract_key(contract)
             
-            # 如果是期權，需要包含更多信息來區分不同的期權合約
-            if contract.secType == 'OPT':
-                symbol = f"{contract.symbol}_{contract.lastTradeDateOrContractMonth}_{contract.right}_{contract.strike}"
-            
-            # 存儲完整的contract對象
-            self.contracts[symbol] = contract
+            # 存儲完整的contract對象（同一合約在多個賬戶中只保存一份）
+            contract = self.contracts.setdefault(symbol, contract)
+            if contract.conId:
+                self.con_id_keys[contract.conId] = symbol
             
             # 存儲持倉信息
-            self.positions[symbol] = {
+            pos = {
                 'account': account,
+                'account_id': calc_engine.account_alias(account),
                 'symbol': contract.symbol,  # 保持原始symbol
                 'secType': contract.secType,
                 'position': position,
@@ -591,7 +526,7 @@ class EnhancedIBClient(EWrapper, EClient):
             
             # 期權特定信息
             if contract.secType == 'OPT':
-                self.positions[symbol].update({
+                pos.update({
                     'strike': contract.strike,
                     'right': contract.right,
                     'expiry': contract.lastTradeDateOrContractMonth,
@@ -605,16 +540,19 @@ class EnhancedIBClient(EWrapper, EClient):
                         # 根據 tradingClass 設置正確的 symbol
                         if hasattr(contract, 'tradingClass') and contract.tradingClass:
                             # 對於香港期權，symbol 應該是 tradingClass
-                            self.positions[symbol]['underlying_symbol'] = contract.symbol
-                            self.positions[symbol]['hk_trading_class'] = contract.tradingClass
+                            pos['underlying_symbol'] = contract.symbol
+                            pos['hk_trading_class'] = contract.tradingClass
                     else:
                         contract.exchange = "SMART"  # 美國期權使用SMART
-                
-            logger.info(f"Received position: {symbol} {position}")
+            
+            # 持倉按 (賬戶, 合約鍵) 保存，行情按合約鍵共享
+            self.engine.set_position((account, symbol), pos, symbol)
+            logger.info(f"Received position: {account[:2]}****** {symbol} {position}")
             
     def positionEnd(self):
         """持倉數據接收完成"""
-        logger.info(f"Received {len(self.positions)} positions")
+        logger.info(f"Received {len(self.positions)} positions ({len(self.contracts)} contracts, "
+                    f"{len(self.accounts)} accounts)")
         # 請求額外數據
         self.requestAdditionalData()
         
@@ -630,9 +568,9 @@ class EnhancedIBClient(EWrapper, EClient):
         self.total_realized_pnl = 0
         self.total_daily_pnl = 0
         
-        # 1. 請求賬戶摘要 - 只請求目標賬戶
-        if self.account:
-            self.reqAccountSummary(9001, self.account, 
+        # 1. 請求所有賬戶的摘要（回調中按 IB_ACCOUNTS 過濾）
+        if self.accounts:
+            self.reqAccountSummary(9001, "All", 
                 "NetLiquidation,TotalCashValue,SettledCash,AccruedCash,BuyingPower,"
                 "EquityWithLoanValue,PreviousEquityWithLoanValue,GrossPositionValue,"
                 "InitMarginReq,MaintMarginReq,AvailableFunds,ExcessLiquidity,Cushion,"
@@ -640,15 +578,21 @@ class EnhancedIBClient(EWrapper, EClient):
         else:
             logger.warning("No target account available for account summary request")
         
-        # 2. 請求賬戶更新 - 只請求目標賬戶
+        # 2. 請求賬戶更新 - reqAccountUpdates 同時只能訂閱一個賬戶，使用主賬戶
         if self.account:
             self.reqAccountUpdates(True, self.account)
         else:
             logger.warning("Not requesting account updates - no target account available")
         
-        # 3. 為每個持倉請求市場數據
-        for symbol, pos_data in self.positions.items():
-            contract = self.contracts[symbol]
+        # 訂閱持倉貨幣的 IDEALPRO 匯率（可選，ExchangeRate 賬戶值已經足夠）
+        if CONFIG['FX_SUBSCRIBE'] and not self.fx_req_map:
+            self.requestFxRates()
+        
+        # 3. 為每個合約請求市場數據（按 conId 去重，多個賬戶持有的同一合約只佔一條行情線）
+        for symbol, contract in self.contracts.items():
+            sub_key = contract.conId or symbol
+            if sub_key in self.subscriptions:
+                continue
             req_id = self.nextReqId()
             self.req_id_map[req_id] = symbol
             
@@ -669,6 +613,7 @@ class EnhancedIBClient(EWrapper, EClient):
                         # 跳過這些合約的市場數據請求
                         continue
                     
+                    self.subscriptions[sub_key] = req_id
                     # 使用原合約請求數據
                     self.reqMktData(req_id, contract, 
                         "232",  # 使用 232 包括收盤價
@@ -678,11 +623,13 @@ class EnhancedIBClient(EWrapper, EClient):
                     # 非香港期權使用原合約
                     # 對於期權，優先嘗試使用延遲數據（免費）
                     # 使用 "232" 來獲取包括收盤價在內的快照數據
+                    self.subscriptions[sub_key] = req_id
                     self.reqMktData(req_id, contract, 
                         "232",  # 232 包括收盤價
                         False, False, [])  # 不使用監管快照
             else:
                 # 股票的標準tick類型
+                self.subscriptions[sub_key] = req_id
                 self.reqMktData(req_id, contract, "233", False, False, [])
             
             # 請求歷史數據
@@ -706,16 +653,37 @@ class EnhancedIBClient(EWrapper, EClient):
         # 設置超時，等待數據收集
         threading.Timer(10.0, self.dataCollectionComplete).start()
     
+    def requestFxRates(self):
+        """為所有持倉貨幣請求 IDEALPRO 匯率報價"""
+        currencies = {pos.get('currency') for pos in self.positions.values()} | {'USD', 'HKD'}
+        for currency in sorted(currencies - {self.fx.base_currency, None}):
+            symbol, quote_currency = fx_pair(currency, self.fx.base_currency)
+            contract = Contract()
+            contract.symbol = symbol
+            contract.secType = 'CASH'
+            contract.currency = quote_currency
+            contract.exchange = 'IDEALPRO'
+            
+            req_id = self.nextReqId()
+            self.fx_req_map[req_id] = (symbol, quote_currency)
+            self.reqMktData(req_id, contract, "", False, False, [])
+            logger.info(f"Requesting FX rate: {symbol}.{quote_currency}")
+    
     def accountSummary(self, reqId: int, account: str, tag: str, value: str, currency: str):
-        """接收賬戶摘要"""
-        # 只處理目標賬戶的數據
-        if self.account and account == self.account:
-            self.account_summary[tag] = {
-                'value': value,
-                'currency': currency,
-                'account': account
-            }
-            logger.info(f"Account Summary - {account} {tag}: {value} {currency}")
+        """接收賬戶摘要（所有匯總的賬戶）"""
+        if not self.tracks(account):
+            return
+        entry = {
+            'value': value,
+            'currency': currency,
+            'account': account
+        }
+        self.account_summaries.setdefault(account, {})[tag] = entry
+        if account == self.account:
+            self.account_summary[tag] = entry
+            if tag == 'Currency':
+                self.fx.set_base_currency(value)
+        logger.info(f"Account Summary - {account[:2]}****** {tag}: {value} {currency}")
     
     def accountSummaryEnd(self, reqId: int):
         """賬戶摘要結束"""
@@ -731,137 +699,68 @@ class EnhancedIBClient(EWrapper, EClient):
                 'currency': currency,
                 'account': accountName
             }
+            self.fx.update_from_account_value(key, val, currency)
         
     def updatePortfolio(self, contract: Contract, position: float, marketPrice: float, 
                        marketValue: float, averageCost: float, unrealizedPNL: float, 
                        realizedPNL: float, accountName: str):
-        """更新持倉組合（來自reqAccountUpdates）"""
-        # 只處理目標賬戶的數據
-        if self.account and accountName != self.account:
-            return
-            
-        symbol = contract.symbol
-        if symbol in self.positions:
-            self.positions[symbol].update({
+        """更新持倉組合（來自reqAccountUpdates，只有主賬戶）"""
+        key = (accountName, contract_key(contract))
+        if key in self.positions:
+            symbol = key[1]
+            self.positions[key].update({
                 'marketPrice': marketPrice,
                 'marketValue': marketValue,
                 'unrealizedPNL': unrealizedPNL,
                 'realizedPNL': realizedPNL,
                 'accountName': accountName
             })
+            self.engine.touch(key)
+            self.push_update(symbol, {'marketPrice': marketPrice, 'unrealizedPNL': unrealizedPNL})
             logger.info(f"Portfolio Update - {symbol}: Price={marketPrice}, PnL={unrealizedPNL}")
     
     def tickPrice(self, reqId, tickType, price, attrib):
-        """接收價格數據"""
-        if reqId in self.req_id_map:
-            symbol = self.req_id_map[reqId]
-            if symbol not in self.market_data:
-                self.market_data[symbol] = {}
-            
-            # 記錄不同類型的價格
-            price_types = {
-                1: 'bid',
-                2: 'ask',
-                4: 'last',
-                6: 'high',
-                7: 'low',
-                9: 'close',
-                14: 'open',
-                37: 'markPrice',
-                68: 'histVolatility',
-                72: 'indexFuturePremium'
-            }
-            
-            if tickType in price_types:
-                self.market_data[symbol][price_types[tickType]] = price
-                logger.info(f"Price Update - {symbol} {price_types[tickType]}: {price}")
-                
-                # 如果獲得了last或close價格，也設置為當前價格
-                if tickType in [4, 9]:  # last or close
-                    self.market_data[symbol]['currentPrice'] = price
-                    
-                # 對於期權，如果沒有收盤價但有平均成本，使用平均成本作為參考
-                if tickType == 1 and price == -1:  # bid 為 -1 表示市場關閉
-                    if symbol in self.positions and self.positions[symbol].get('secType') == 'OPT':
-                        avg_cost = self.positions[symbol].get('avg_cost', 0)
-                        if avg_cost > 0 and 'close' not in self.market_data[symbol]:
-                            # 使用平均成本作為參考收盤價
-                            self.market_data[symbol]['close'] = avg_cost
-                            logger.info(f"Using avg cost as close price for {symbol}: {avg_cost}")
+        """接收價格數據（只入隊，由 tick_ingest 應用線程批量寫入）"""
+        if reqId in self.fx_req_map:
+            self.fxTickPrice(reqId, tickType, price)
+        else:
+            field = tick_ingest.PRICE_FIELDS.get(tickType)
+            if field is not None:
+                self.ticks.put(reqId, field, price)
+    
+    def fxTickPrice(self, reqId, tickType, price):
+        """接收 IDEALPRO 匯率報價，優先使用買賣中間價"""
+        fx_fields = {1: 'bid', 2: 'ask', 4: 'last', 9: 'close'}
+        if tickType not in fx_fields or price <= 0:
+            return
+        quote = self.fx_quotes.setdefault(reqId, {})
+        quote[fx_fields[tickType]] = price
+        
+        if quote.get('bid') and quote.get('ask'):
+            rate = (quote['bid'] + quote['ask']) / 2
+        else:
+            rate = quote.get('last') or quote.get('close')
+        symbol, currency = self.fx_req_map[reqId]
+        self.fx.update_from_pair(symbol, currency, rate)
     
     def tickSize(self, reqId, tickType, size):
         """接收數量數據"""
-        if reqId in self.req_id_map:
-            symbol = self.req_id_map[reqId]
-            if symbol not in self.market_data:
-                self.market_data[symbol] = {}
-            
-            size_types = {
-                0: 'bidSize',
-                3: 'askSize',
-                5: 'lastSize',
-                8: 'volume',
-                21: 'avgVolume',
-                27: 'callOpenInterest',
-                28: 'putOpenInterest',
-                86: 'shortableShares'
-            }
-            
-            if tickType in size_types:
-                self.market_data[symbol][size_types[tickType]] = size
+        field = tick_ingest.SIZE_FIELDS.get(tickType)
+        if field is not None:
+            self.ticks.put(reqId, field, size)
     
     def tickGeneric(self, reqId, tickType, value):
         """接收通用tick數據"""
-        if reqId in self.req_id_map:
-            symbol = self.req_id_map[reqId]
-            if symbol not in self.market_data:
-                self.market_data[symbol] = {}
-            
-            generic_types = {
-                23: 'optionHistoricalVolatility',
-                24: 'optionImpliedVolatility',
-                31: 'indexFuturePremium',
-                49: 'halted',
-                54: 'tradeCount',
-                55: 'tradeRate',
-                56: 'volumeRate',
-                58: 'rtHistoricalVolatility'
-            }
-            
-            if tickType in generic_types:
-                self.market_data[symbol][generic_types[tickType]] = value
+        field = tick_ingest.GENERIC_FIELDS.get(tickType)
+        if field is not None:
+            self.ticks.put(reqId, field, value)
     
     def tickOptionComputation(self, reqId, tickType, tickAttrib, impliedVol, delta, 
                             optPrice, pvDividend, gamma, vega, theta, undPrice):
-        """接收期權計算數據（希臘值）"""
-        if reqId in self.req_id_map:
-            symbol = self.req_id_map[reqId]
-            if symbol not in self.options_data:
-                self.options_data[symbol] = {}
-            
-            # 存儲希臘值
-            greeks = {
-                'impliedVolatility': impliedVol,
-                'delta': delta,
-                'optionPrice': optPrice,
-                'pvDividend': pvDividend,
-                'gamma': gamma,
-                'vega': vega,
-                'theta': theta,
-                'underlyingPrice': undPrice
-            }
-            
-            # 根據tickType確定是哪種計算
-            if tickType == 10:  # BID
-                self.options_data[symbol]['bidGreeks'] = greeks
-            elif tickType == 11:  # ASK
-                self.options_data[symbol]['askGreeks'] = greeks
-            elif tickType == 12:  # LAST
-                self.options_data[symbol]['lastGreeks'] = greeks
-            elif tickType == 13:  # MODEL
-                self.options_data[symbol]['modelGreeks'] = greeks
-                
-            logger.info(f"Greeks Update - {symbol}: Delta={delta}, Gamma={gamma}, Theta={theta}, Vega={vega}")
+        """接收期權計算數據（希臘值），元組順序見 tick_ingest.GREEK_NAMES"""
+        field = tick_ingest.GREEK_FIELDS.get(tickType)
+        if field is not None:
+            self.ticks.put(reqId, field, (impliedVol, delta, optPrice, pvDividend, gamma, vega, theta, undPrice))
     
     def pnl(self, reqId: int, dailyPnL: float, unrealizedPnL: float, realizedPnL: float):
         """接收賬戶級別PnL"""
@@ -884,6 +783,8 @@ class EnhancedIBClient(EWrapper, EClient):
                 'realizedPnL': realizedPnL,
                 'marketValue': value
             }
+            self.engine.touch(symbol)
+            self.push_update(symbol, {'dailyPnL': dailyPnL, 'unrealizedPnL': unrealizedPnL})
             logger.info(f"Position PnL - {symbol}: Daily={dailyPnL}, Unrealized={unrealizedPnL}")
     
     def historicalData(self, reqId: int, bar):
@@ -919,6 +820,7 @@ class EnhancedIBClient(EWrapper, EClient):
                 # 保存收盤價
                 self.market_data[symbol]['close'] = latest_bar['close']
                 logger.info(f"Set close price for {symbol}: {latest_bar['close']}")
+            self.engine.touch(symbol)
     
     def dataCollectionComplete(self):
         """數據收集完成"""
@@ -928,179 +830,26 @@ class EnhancedIBClient(EWrapper, EClient):
         
     def save_all_data(self):
         """保存所有數據到文件"""
-        positions_data = []
+        with self._save_lock:
+            self._save_all_data()
+    
+    def _save_all_data(self):
+        # 先應用隊列中尚未寫入的 tick
+        self.ticks.flush()
         
-        for symbol, pos in self.positions.items():
-            position_data = pos.copy()
-            
-            # 隱藏真實賬戶號碼（用於公開版本）
-            if 'account' in position_data:
-                # 將賬戶號碼替換為匿名版本
-                account = position_data['account']
-                if account.startswith('U'):
-                    # 保留首字母U，其餘用星號替換
-                    position_data['account'] = 'U' + '*' * (len(account) - 1)
-                else:
-                    position_data['account'] = 'DEMO'
-            
-            # 添加市場數據
-            if symbol in self.market_data:
-                position_data['market_data'] = self.market_data[symbol]
-                position_data['has_market_data'] = True
-            else:
-                position_data['has_market_data'] = False
-            
-            # 添加PnL數據
-            if symbol in self.pnl_data:
-                position_data['pnl_data'] = self.pnl_data[symbol]
-                position_data['has_pnl_data'] = True
-            else:
-                position_data['has_pnl_data'] = False
-            
-            # 添加期權希臘值
-            if symbol in self.options_data:
-                position_data['options_data'] = self.options_data[symbol]
-                position_data['has_options_data'] = True
-            else:
-                position_data['has_options_data'] = False
-            
-            # 檢查是否為無法獲取數據的香港期權
-            position_data['data_unavailable'] = False
-            if pos['secType'] == 'OPT' and pos['currency'] == 'HKD':
-                # 檢查是否有市場數據訂閱錯誤
-                has_subscription_error = any(
-                    err['reqId'] in self.req_id_map and self.req_id_map[err['reqId']] == symbol 
-                    and err['errorCode'] in [200, 10090, 10091, 354]
-                    for err in self.errors
-                )
-                if has_subscription_error:
-                    position_data['data_unavailable'] = True
-            
-            # 添加歷史數據
-            if symbol in self.historical_data:
-                position_data['historical_data'] = self.historical_data[symbol]
-            
-            # 計算一些衍生數據
-            if pos['secType'] == 'OPT':
-                # 期權的市值計算
-                # HSI特殊處理
-                if pos['symbol'] == 'HSI':
-                    # HSI使用用戶指定的固定平均價格
-                    avg_cost = 169.3
-                else:
-                    avg_cost = pos['avgCost'] / 100  # 其他期權轉換為單位價格
-                position_data['avg_cost'] = avg_cost
-                
-                # 獲取當前市場價格
-                current_price = 0
-                if symbol in self.market_data:
-                    # 對於HSI，如果只有close價格而沒有實時價格，標記為數據不可用
-                    market_data = self.market_data[symbol]
-                    if (pos['symbol'] == 'HSI' and 
-                        market_data.get('bid', -1) == -1 and 
-                        market_data.get('ask', -1) == -1 and
-                        market_data.get('last') is None):
-                        position_data['data_unavailable'] = True
-                    
-                    current_price = (market_data.get('currentPrice') or 
-                                   market_data.get('last') or 
-                                   market_data.get('close') or 
-                                   market_data.get('markPrice') or 0)
-                position_data['current_price'] = current_price
-                
-                # 計算盈虧
-                if pos['position'] < 0:  # Short position
-                    if position_data.get('data_unavailable', False):
-                        # 如果數據不可用，設置pnl為None
-                        position_data['pnl'] = None
-                    elif current_price > 0:
-                        # 賣出期權的盈虧 = (收取的權利金 - 當前市值) * 數量
-                        position_data['pnl'] = (avg_cost - current_price) * abs(pos['position']) * 100
-                    else:
-                        position_data['pnl'] = 0
-                else:
-                    position_data['pnl'] = 0
-                
-                # 如果有市場價格，使用市場價格計算市值；否則使用成本價
-                multiplier = float(position_data.get('multiplier', '100'))
-                if current_price > 0:
-                    position_data['market_value'] = pos['position'] * current_price * multiplier
-                else:
-                    if pos['symbol'] == 'HSI':
-                        # HSI使用固定的平均價格 × 數量 × 乘數
-                        position_data['market_value'] = pos['position'] * 169.3 * multiplier
-                    else:
-                        position_data['market_value'] = pos['position'] * pos['avgCost']
-                
-                # 格式化到期日
-                expiry = pos['expiry']
-                position_data['expiry_formatted'] = f"{expiry[:4]}-{expiry[4:6]}-{expiry[6:8]}"
-                
-                # 計算到期天數
-                try:
-                    from datetime import date
-                    expiry_date = date(int(expiry[:4]), int(expiry[4:6]), int(expiry[6:8]))
-                    position_data['days_to_expiry'] = (expiry_date - date.today()).days
-                except:
-                    position_data['days_to_expiry'] = 0
-                    
-                # 添加行權價信息
-                position_data['strike'] = pos.get('strike', 0)
-            else:
-                # 股票的市值計算
-                current_price = 0
-                if symbol in self.market_data:
-                    current_price = (self.market_data[symbol].get('currentPrice') or 
-                                   self.market_data[symbol].get('last') or 
-                                   self.market_data[symbol].get('close') or 0)
-                position_data['current_price'] = current_price
-                
-                if current_price > 0:
-                    position_data['market_value'] = pos['position'] * current_price
-                else:
-                    position_data['market_value'] = pos['position'] * pos['avgCost']
-                
-            positions_data.append(position_data)
-        
-        # 計算統計數據
-        options_count = len([p for p in positions_data if p['secType'] == 'OPT'])
-        stocks_count = len([p for p in positions_data if p['secType'] == 'STK'])
-        total_market_value = sum(p.get('market_value', 0) for p in positions_data)
-        
-        # 準備 summary 字典
-        summary_data = {
-            'total_positions': len(positions_data),
-            'options_count': options_count,
-            'stocks_count': stocks_count,
-            'total_market_value': total_market_value
-        }
-
-        # 為了兼容前端，將關鍵帳戶數據同時寫入 summary 和 account_summary
-        if 'NetLiquidation' in self.account_summary:
-            summary_data['NetLiquidation'] = self.account_summary['NetLiquidation'].get('value')
-            summary_data['NetLiquidationCurrency'] = self.account_summary['NetLiquidation'].get('currency')
+        # 底層股票價格讀取報價緩存（不等待 FMP），引擎只重新計算價格有變化的持倉
+        underlying_prices, quotes_updated = self.cached_underlying_prices(list(self.positions.values()))
+        self.engine.set_underlying_prices(underlying_prices)
         
-        if 'AvailableFunds' in self.account_summary:
-            summary_data['AvailableFunds'] = self.account_summary['AvailableFunds'].get('value')
-            summary_data['AvailableFundsCurrency'] = self.account_summary['AvailableFunds'].get('currency')
-
-        # 按到期日計算期權價值
-        options_by_expiry = {}
-        for pos in positions_data:
-            if pos['secType'] == 'OPT':
-                expiry = pos['expiry']
-                if expiry not in options_by_expiry:
-                    options_by_expiry[expiry] = {
-                        'expiry': expiry,
-                        'expiry_formatted': pos['expiry_formatted'],
-                        'days_to_expiry': pos['days_to_expiry'],
-                        'total_value': 0,
-                        'count': 0,
-                        'positions': []
-                    }
-                options_by_expiry[expiry]['total_value'] += pos['market_value']
-                options_by_expiry[expiry]['count'] += 1
-                options_by_expiry[expiry]['positions'].append(pos['symbol'])
+        # 多個賬戶時使用合併的賬戶摘要，與合併的持倉對應
+        account_summary = self.consolidated_account_summary()
+        
+        # 衍生字段和匯總由計算引擎增量維護
+        snapshot = self.engine.snapshot(account_summary)
+        # 引擎內部按真實賬戶區分持倉，保存的數據文件只包含賬戶別名
+        positions_data = calc_engine.public_positions(snapshot['positions'])
+        # 為了兼容前端，將關鍵帳戶數據同時寫入 summary 和 account_summary
+        summary_data = calc_engine.document_summary(snapshot['summary'], account_summary)
         
         # 分析數據訂閱狀態
         subscription_errors = {}
@@ -1114,20 +863,23 @@ class EnhancedIBClient(EWrapper, EClient):
                         'error_string': error['errorString']
                     }
         
-        # 獲取底層股票價格（使用 FMP API）
-        underlying_prices = self.fetch_underlying_prices(positions_data)
-        
         # 組裝完整數據
         portfolio_data = {
             'timestamp': datetime.now().isoformat(),
             'last_update': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'positions': positions_data,
             'summary': summary_data,
-            'account_summary': self.account_summary,
+            'account_summary': account_summary,
+            'accounts': self.account_books(),  # 每個賬戶的摘要和持倉數量
             'account_values': self.account_values,
             'account_pnl': self.pnl_data.get('account', {}),
-            'options_by_expiry': list(options_by_expiry.values()),
+            'options_by_expiry': snapshot['options_by_expiry'],
+            'calculations': snapshot['calculations'],  # 計算引擎的匯總結果，雲端和儀表板直接使用
+            'snapshot_version': snapshot['version'],
+            'expiry_timeline': expiry_timeline.build_timeline(positions_data, underlying_prices),  # 到期接貨時間線
             'underlying_prices': underlying_prices,  # 新增：底層股票價格
+            'underlying_prices_update': quotes_updated,  # 最舊的一個報價的獲取時間
+            'fx_rates': self.fx.to_dict(),  # 匯率及其更新時間
             'source': 'ib_api_enhanced',
             'status': 'updated',
             'errors': self.errors[-20:],  # 只包含最近20個錯誤
@@ -1136,78 +888,77 @@ class EnhancedIBClient(EWrapper, EClient):
         
         # 保存到文件
         try:
-            temp_file = CONFIG['DATA_FILE'] + '.tmp'
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(portfolio_data, f, indent=2, ensure_ascii=False)
-            os.replace(temp_file, CONFIG['DATA_FILE'])
+            snapshot_store.save(portfolio_data)
             logger.info(f"Enhanced portfolio data saved to {CONFIG['DATA_FILE']}")
-            
-            # 保存成功
-            
         except Exception as e:
             logger.error(f"Failed to save portfolio data: {e}")
     
-    def fetch_underlying_prices(self, positions_data):
-        """獲取底層股票價格（使用 FMP API）"""
-        try:
-            # 收集所有需要獲取價格的股票符號
-            underlying_symbols = set()
-            
-            for pos in positions_data:
-                if pos['secType'] == 'OPT' and pos.get('tradingClass'):
-                    # 期權的底層股票
-                    underlying_symbols.add(pos['tradingClass'])
-                elif pos['secType'] == 'STK':
-                    # 股票持倉
-                    underlying_symbols.add(pos['symbol'])
-            
-            if not underlying_symbols:
-                return {}
-            
-            logger.info(f"正在獲取 {len(underlying_symbols)} 個股票的價格數據...")
-            
-            # 使用 FMP API 獲取價格
-            prices = {}
-            symbols_list = list(underlying_symbols)
-            batch_size = 50  # FMP API 批量限制
-            
-            for i in range(0, len(symbols_list), batch_size):
-                batch = symbols_list[i:i+batch_size]
-                symbols_str = ",".join(batch)
-                
-                url = f"https://financialmodelingprep.com/api/v3/quote/{symbols_str}?apikey={CONFIG['FMP_API_KEY']}"
-                
-                try:
-                    response = requests.get(url, timeout=10)
-                    if response.status_code == 200:
-                        quotes = response.json()
-                        logger.info(f"FMP API 返回 {len(quotes)} 個報價")
-                        for quote in quotes:
-                            symbol = quote.get('symbol')
-                            if symbol:
-                                logger.info(f"獲取到 {symbol} 的價格: ${quote.get('price', 0)}")
-                                prices[symbol] = {
-                                    'price': quote.get('price', 0),
-                                    'changesPercentage': quote.get('changesPercentage', 0),
-                                    'dayHigh': quote.get('dayHigh', 0),
-                                    'dayLow': quote.get('dayLow', 0),
-                                    'previousClose': quote.get('previousClose', 0),
-                                    'timestamp': quote.get('timestamp', 0)
-                                }
-                                logger.info(f"獲取到 {symbol} 價格: ${quote.get('price', 0):.2f}")
-                    else:
-                        logger.error(f"FMP API 錯誤: {response.status_code}")
-                except Exception as e:
-                    logger.error(f"獲取批量報價錯誤: {e}")
-            
-            logger.info(f"成功獲取 {len(prices)} 個股票的價格數據")
-            return prices
-            
-        except Exception as e:
-            logger.error(f"獲取底層股票價格時發生錯誤: {e}")
-            return {}
+    def consolidated_account_summary(self):
+        """所有匯總賬戶的摘要；只有一個賬戶時就是該賬戶的摘要"""
+        if len(self.account_summaries) <= 1:
+            return self.account_summary
+        return calc_engine.combine_account_summaries(
+            [(summary, self.fx) for summary in self.account_summaries.values()],
+            self.fx.base_currency
+        )
+    
+    def account_books(self):
+        """每個賬戶的摘要和持倉數量（按賬戶別名）"""
+        counts = {}
+        for account, _ in list(self.positions):
+            counts[account] = counts.get(account, 0) + 1
+        return {
+            calc_engine.account_alias(account): {
+                'account_summary': {tag: {'value': entry['value'], 'currency': entry['currency']}
+                                    for tag, entry in self.account_summaries.get(account, {}).items()},
+                'positions_count': counts.get(account, 0),
+                'primary': account == self.account
+            }
+            for account in self.accounts
+        }
+    
+    def cached_underlying_prices(self, positions_data):
+        """報價緩存中的底層股票價格，返回 (價格, 最舊報價的獲取時間)
+
+        只讀取內存，不請求 FMP；持倉中的股票交給報價緩存在後台刷新，
+        還沒有報價的股票到達後由 apply_quotes 更新引擎並重新保存。
+        """
+        symbols = underlying_symbols(positions_data)
+        self.quote_symbols = set(symbols)
+        quote_cache.watch(symbols)
+        cached = quote_cache.peek(symbols)
+        self.missing_quotes = self.quote_symbols - cached.keys()
+        if not cached:
+            if symbols:
+                logger.info(f"底層股票價格: 0/{len(symbols)} 個，等待報價緩存刷新")
+            return {}, None
+        oldest = max(age for _, age in cached.values())
+        logger.info(f"底層股票價格: {len(cached)}/{len(symbols)} 個（最舊 {oldest:.0f} 秒前）")
+        updated = (datetime.now() - timedelta(seconds=oldest)).strftime('%Y-%m-%d %H:%M:%S')
+        return {symbol: quote for symbol, (quote, _) in cached.items()}, updated
+    
+    def apply_quotes(self, quotes):
+        """報價緩存獲取到新報價（在獲取報價的線程中）：更新引擎中的底層股票價格；
+        上次保存時缺少的報價到達後重新保存快照（數據收集完成後才保存）"""
+        prices = {symbol: quote for symbol, quote in quotes.items() if symbol in self.quote_symbols}
+        if not prices:
+            return
+        self.engine.set_underlying_prices(prices)
+        if self.missing_quotes & prices.keys() and self.update_complete.is_set():
+            logger.info(f"收到 {len(self.missing_quotes & prices.keys())} 個缺少的底層股票報價，重新保存快照")
+            self.save_all_data()
     
 
+def underlying_symbols(positions_data):
+    """持倉需要報價的股票：期權的底層股票和股票持倉"""
+    symbols = set()
+    for pos in positions_data:
+        if pos.get('secType') == 'OPT' and pos.get('tradingClass'):
+            symbols.add(pos['tradingClass'])
+        elif pos.get('secType') == 'STK':
+            symbols.add(pos['symbol'])
+    return sorted(symbols)
+
 # Flask 路由
 @app.after_request
 def after_request(response):
@@ -1217,9 +968,45 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE')
     return response
 
+# 儀表板外殼 + 帶哈希的 JS / CSS（源文件修改後自動重新構建）
+dashboard = DashboardAssets(
+    'static/dashboard_new.html' if CONFIG['ENVIRONMENT'] == 'production' else CONFIG['DASHBOARD_FILE']
+) if CONFIG['DASHBOARD_ASSETS'] else None
+
+def asset_response(result):
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
+@app.route('/assets/<name>')
+def dashboard_asset(name):
+    """儀表板 JS / CSS（文件名包含內容哈希，永久緩存）"""
+    result = dashboard.asset(name, request.headers.get('Accept-Encoding'),
+                             request.headers.get('If-None-Match')) if dashboard is not None else None
+    if result is None:
+        return jsonify({"error": "Not found"}), 404
+    return asset_response(result)
+
+def dashboard_state(tws_connected):
+    """首頁內嵌的初始狀態（當前快照、後端匯總和 TWS 連接狀態），沒有數據時返回 None"""
+    try:
+        data = snapshot_store.get()
+        if data is None:
+            return None
+        summary = summary_cache.get(data, snapshot_store.version)
+        return initial_state(data, summary, status={'tws_connected': tws_connected})
+    except Exception as e:
+        logger.error(f"Error building dashboard state: {e}")
+        return None
+
 @app.route('/')
 def index():
-    """主頁 - 返回儀表板"""
+    """主頁 - 返回儀表板（內嵌初始數據，首次渲染無需再請求）"""
+    if dashboard is not None and dashboard.source.exists():
+        tws_connected = bool(ib_client and ib_client.isConnected())
+        tag = f"{snapshot_store.version}-{datetime.now().date()}-{tws_connected}"
+        return asset_response(dashboard.shell(request.headers.get('Accept-Encoding'),
+                                              request.headers.get('If-None-Match'),
+                                              state=lambda: dashboard_state(tws_connected), state_tag=tag))
     if CONFIG['ENVIRONMENT'] == 'production':
         # Railway 環境使用 static 目錄
         return send_from_directory('static', 'dashboard_new.html')
@@ -1254,10 +1041,8 @@ def test_page():
 def get_portfolio():
     """API: 獲取持倉數據"""
     try:
-        data_file = Path(CONFIG['DATA_FILE'])
-        if data_file.exists():
-            with open(data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+        data = snapshot_store.get()
+        if data is not None:
             return jsonify(data)
         else:
             return jsonify({
@@ -1273,6 +1058,21 @@ def get_portfolio():
         logger.error(f"Error reading portfolio data: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/summary')
+def get_summary():
+    """API: 後端計算的匯總、到期分組、到期時間線和保證金估算"""
+    try:
+        summary = summary_cache.get(snapshot_store.get(), snapshot_store.version)
+        if summary is None:
+            return jsonify({"error": "No data available"}), 404
+        response = jsonify(summary)
+        response.set_etag(f"{summary['version']}-{summary['computed_at']}")
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Error serving summary: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/update', methods=['POST'])
 def update_portfolio():
     """API: 更新持倉數據"""
@@ -1322,13 +1122,7 @@ def update_portfolio():
                 }), 503
             
             # 清空舊數據
-            ib_client.positions = {}
-            ib_client.contracts = {}
-            ib_client.market_data = {}
-            ib_client.account_summary = {}
-            ib_client.pnl = {}
-            ib_client.options_data = {}
-            ib_client.historical_data = {}
+            ib_client.reset_data()
             
             logger.info("Requesting positions...")
             ib_client.reqPositions()
@@ -1357,6 +1151,50 @@ def update_portfolio():
                 "message": "更新失敗"
             }), 500
 
+if Sock is not None:
+    sock = Sock(app)
+    
+    @sock.route('/ws')
+    def websocket_updates(ws):
+        """WebSocket: 按訂閱（賬戶、底層股票、字段）推送合併後的行情和盈虧更新"""
+        ws_hub.serve(ws)
+
+@app.route('/api/stream')
+def stream_updates():
+    """API: Server-Sent Events 實時推送
+
+    事件: status（連接狀態）、ticks（按 conId 合併的價格/希臘值/盈虧更新）、
+    summary（tick 之後的 calculations 總計）、snapshot（新的快照版本，重新載入完整數據）、resync（落後太多，重新載入完整數據）
+    """
+    # 斷線重連時從瀏覽器提供的最後事件序號繼續
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    seq = int(last_event_id) if last_event_id.isdigit() else live_updates.seq
+    
+    data = snapshot_store.get()
+    hello = {
+        'tws_connected': bool(ib_client and ib_client.isConnected()),
+        'snapshot_version': snapshot_store.version,
+        'last_update': data.get('last_update') if data else None
+    }
+    
+    def generate():
+        nonlocal seq
+        yield "retry: 3000\n"
+        yield sse_message(dict(hello, type='status'), seq)
+        while True:
+            events = live_updates.events_after(seq, timeout=STREAM_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event_seq, event_type, payload in events:
+                seq = event_seq
+                yield sse_message(dict(payload, type=event_type), event_seq)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/status')
 def get_status():
     """API: 獲取系統狀態"""
@@ -1364,17 +1202,15 @@ def get_status():
     
     tws_connected = ib_client and ib_client.isConnected()
     
-    data_file = Path(CONFIG['DATA_FILE'])
-    has_data = data_file.exists()
+    has_data = snapshot_store.exists()
     last_update = None
     source = None
     
     if has_data:
         try:
-            with open(data_file, 'r') as f:
-                data = json.load(f)
-                last_update = data.get('last_update')
-                source = data.get('source', 'unknown')
+            data = snapshot_store.get()
+            last_update = data.get('last_update')
+            source = data.get('source', 'unknown')
         except:
             pass
     
@@ -1384,6 +1220,12 @@ def get_status():
         "has_data": has_data,
         "last_update": last_update,
         "data_source": source,
+        "cloud_sync": cloud_sync.status(),
+        "publish": publisher.last_result if publisher is not None else None,
+        "websocket": ws_hub.stats(),
+        "ticks": ib_client.ticks.stats() if ib_client else None,
+        "http": http_client.stats(),
+        "quotes": quote_cache.status(),
         "server_time": datetime.now().isoformat(),
         "config": {
             "tws_host": CONFIG['TWS_HOST'],
@@ -1392,6 +1234,103 @@ def get_status():
         }
     })
 
+def get_margin_model():
+    """返回緩存的保證金模型，快照更新後才重新建立"""
+    portfolio_data = snapshot_store.get()
+    if portfolio_data is None:
+        return None
+    if margin_cache['version'] != snapshot_store.version:
+        margin_cache['model'] = margin_model.MarginModel(portfolio_data)
+        margin_cache['version'] = snapshot_store.version
+    return margin_cache['model']
+
+@app.route('/api/expiry-timeline')
+def get_expiry_timeline():
+    """API: 到期日曆、接貨資金時間線和轉倉候選"""
+    try:
+        portfolio_data = snapshot_store.get()
+        if portfolio_data is None:
+            return jsonify({"error": "No data available"}), 404
+        timeline = portfolio_data.get('expiry_timeline')
+        if not timeline or timeline.get('start') != datetime.now().date().isoformat():
+            # 舊數據文件或跨日後重新建立
+            timeline = expiry_timeline.build_timeline(
+                portfolio_data.get('positions', []), portfolio_data.get('underlying_prices')
+            )
+        return jsonify(timeline)
+    except Exception as e:
+        logger.error(f"Error building expiry timeline: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/margin')
+def get_margin():
+    """API: 當前持倉的保證金估算"""
+    try:
+        model = get_margin_model()
+        if model is None:
+            return jsonify({"error": "No data available"}), 404
+        return jsonify(model.current())
+    except Exception as e:
+        logger.error(f"Error estimating margin: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/margin/what-if', methods=['POST'])
+def margin_what_if():
+    """API: 估算新增候選持倉（預設賣出 Put）的保證金變化
+
+    請求: {"candidates": [{"symbol", "strike", "premium", "expiry", "quantity", "right"}],
+           "validate": false}
+    validate 為 true 時，對每個候選提交 IB whatIf 訂單並比較結果（需要 TWS 連接）；
+    先提交全部訂單，再在共用的截止時間（WHAT_IF_TIMEOUT）內等待結果。
+    """
+    try:
+        data = request.get_json() or {}
+        candidates = data.get('candidates', [])
+        if not candidates:
+            return jsonify({"error": "No candidates provided"}), 400
+        
+        model = get_margin_model()
+        if model is None:
+            return jsonify({"error": "No data available"}), 404
+        
+        start = time.perf_counter()
+        results = model.screen(candidates)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        if data.get('validate'):
+            if not (ib_client and ib_client.isConnected()):
+                return jsonify({"error": "TWS not connected, cannot validate"}), 503
+            # screen() 已驗證並轉換候選，直接使用結果中的字段
+            pending = []
+            for result in results:
+                if 'error' in result or not result.get('expiry'):
+                    continue
+                order_id = ib_client.requestWhatIf(
+                    result['symbol'], result['expiry'], result['strike'],
+                    result['right'], result['quantity'], result['premium']
+                )
+                pending.append((order_id, result))
+            deadline = time.monotonic() + CONFIG['WHAT_IF_TIMEOUT']
+            for order_id, result in pending:
+                what_if = ib_client.what_if_requests.pop(order_id)
+                if what_if['event'].wait(timeout=max(deadline - time.monotonic(), 0)):
+                    result['ib_what_if'] = what_if['order_state']
+                    result['validation'] = margin_model.compare_with_what_if(result, what_if['order_state'])
+                else:
+                    result['validation'] = None
+                    logger.warning(f"WhatIf order {order_id} timed out")
+        
+        return jsonify({
+            "success": True,
+            "version": model.version,
+            "results": results,
+            "elapsed_ms": round(elapsed_ms, 3),
+            "timestamp": datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Error in margin what-if: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # 雲端上傳相關路由
 
 @app.route('/api/cloud-config', methods=['GET'])
@@ -1452,62 +1391,36 @@ def update_cloud_config():
 
 @app.route('/api/upload-to-cloud', methods=['POST'])
 def api_upload_to_cloud():
-    """API: 使用測試腳本邏輯直接上傳到 Railway"""
+    """API: 上傳當前快照到 Railway，失敗時嘗試更新 Vercel"""
     try:
-        # 調用測試腳本
-        import subprocess
-        script_path = Path(__file__).parent / "test_cloud_upload.py"
-        
-        if script_path.exists():
-            process = subprocess.run(
-                ["python3", str(script_path)],
-                capture_output=True,
-                text=True,
-                cwd=str(Path(__file__).parent)
-            )
-            
-            if process.returncode == 0:
-                # 從輸出中提取持倉數量
-                output = process.stdout
-                if "持倉總數:" in output:
-                    positions_count = 45  # 默認值
-                    for line in output.split('\n'):
-                        if "持倉總數:" in line:
-                            try:
-                                positions_count = int(line.split(':')[1].strip())
-                            except:
-                                pass
-                    
-                return jsonify({
+        result = upload_to_cloud()
+        if result['success']:
+            return jsonify(result)
+        
+        logger.error(f"Railway 上傳失敗: {result['message']}")
+        # 放入發件箱，由後台同步在雲端恢復後重試
+        cloud_sync.notify(snapshot_store.get(), snapshot_store.version)
+        result['queued'] = True
+        # 備選 Vercel 方案：發布到對象存儲（已配置時），否則提交到前端倉庫
+        if publisher is not None:
+            published = publisher.publish(snapshot_store.get())
+            if published['success']:
+                result.update({
                     'success': True,
-                    'message': f'成功上傳 {positions_count} 個持倉到 Railway',
-                    'positions_count': positions_count,
-                    'timestamp': datetime.now().isoformat()
+                    'message': f"數據已發布到 Vercel 數據存儲 (Railway 失敗後的備選): {published['message']}",
+                    'target': 'vercel',
+                    'publish': published
                 })
-            else:
-                logger.error(f"測試腳本執行失敗: {process.stderr}")
-                # 備選 Vercel 方案
-                import subprocess
-                script_path = Path(__file__).parent / "update_vercel_data.py"
-                
-                if script_path.exists():
-                    process = subprocess.run(["python3", str(script_path)], capture_output=True, text=True)
-                    if process.returncode == 0:
-                        return jsonify({
-                            'success': True,
-                            'message': '數據已更新到 Vercel (Railway 失敗後的備選)',
-                            'positions_count': 45
-                        })
-                
-                return jsonify({
-                    'success': False,
-                    'message': f'上傳失敗: {process.stderr}'
-                }), 400
-        else:
-            return jsonify({
-                'success': False,
-                'message': '找不到上傳腳本'
-            }), 400
+                return jsonify(result)
+        elif update_vercel_data.update_vercel_data():
+            result.update({
+                'success': True,
+                'message': '數據已更新到 Vercel (Railway 失敗後的備選)',
+                'target': 'vercel'
+            })
+            return jsonify(result)
+        
+        return jsonify(result), 400
             
     except Exception as e:
         logger.error(f"API上傳到雲端錯誤: {e}")
@@ -1532,7 +1445,7 @@ def test_cloud_connection():
         # 測試健康檢查端點
         health_url = cloud_config['api_url'].replace('/api/portfolio/upload', '/health')
         
-        response = requests.get(health_url, timeout=10)
+        response = http_client.get(health_url, timeout=10)
         
         if response.status_code == 200:
             return jsonify({
@@ -1558,7 +1471,7 @@ def test_cloud_connection():
 
 @app.route('/api/stock-prices', methods=['POST'])
 def get_stock_prices():
-    """API: 獲取股票現價（使用 Financial Modeling Prep API）"""
+    """API: 獲取股票現價（Financial Modeling Prep 報價，經過緩存）"""
     try:
         # 獲取請求中的股票符號列表
         data = request.get_json()
@@ -1567,38 +1480,8 @@ def get_stock_prices():
         if not symbols:
             return jsonify({"error": "No symbols provided"}), 400
         
-        # 去重並過濾
-        symbols = list(set(symbols))
-        
-        # 使用 FMP API 獲取股票報價
-        prices = {}
-        batch_size = 50  # FMP API 批量限制
-        
-        for i in range(0, len(symbols), batch_size):
-            batch = symbols[i:i+batch_size]
-            symbols_str = ",".join(batch)
-            
-            url = f"https://financialmodelingprep.com/api/v3/quote/{symbols_str}?apikey={CONFIG['FMP_API_KEY']}"
-            
-            try:
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    quotes = response.json()
-                    for quote in quotes:
-                        symbol = quote.get('symbol')
-                        if symbol:
-                            prices[symbol] = {
-                                'price': quote.get('price', 0),
-                                'changesPercentage': quote.get('changesPercentage', 0),
-                                'dayHigh': quote.get('dayHigh', 0),
-                                'dayLow': quote.get('dayLow', 0),
-                                'previousClose': quote.get('previousClose', 0),
-                                'timestamp': quote.get('timestamp', 0)
-                            }
-                else:
-                    logger.error(f"FMP API error: {response.status_code}")
-            except Exception as e:
-                logger.error(f"Error fetching batch quotes: {e}")
+        # 從報價緩存返回：新鮮的報價不請求上游，並發的相同請求只獲取一次
+        prices = quote_cache.get_many(symbols)
         
         return jsonify({
             "success": True,
@@ -1630,15 +1513,8 @@ def auto_update_data():
                     logger.warning("IB client not connected, skipping auto update")
                     continue
                 
-                # 清空舊數據
-                ib_client.positions = {}
-                ib_client.contracts = {}
-                ib_client.market_data = {}
-                ib_client.account_summary = {}
-                ib_client.pnl_data = {}
-                ib_client.options_data = {}
-                ib_client.historical_data = {}
-                ib_client.errors = []  # 清空錯誤列表
+                # 清空舊數據（包括錯誤列表）
+                ib_client.reset_data()
                 
                 # 重置事件
                 ib_client.update_complete.clear()
@@ -1658,13 +1534,11 @@ def auto_update_data():
 def update_underlying_prices():
     """更新底層股票價格到數據文件"""
     try:
-        # 讀取現有數據
-        data_file = Path(CONFIG['DATA_FILE'])
-        if not data_file.exists():
+        # 讀取現有數據（複製一份，不修改共享快照）
+        snapshot = snapshot_store.get()
+        if snapshot is None:
             return
-            
-        with open(data_file, 'r', encoding='utf-8') as f:
-            portfolio_data = json.load(f)
+        portfolio_data = dict(snapshot)
         
         # 收集所有期權的底層股票符號
         underlying_symbols = set()
@@ -1677,41 +1551,19 @@ def update_underlying_prices():
         
         print(f"🔄 正在獲取 {len(underlying_symbols)} 個底層股票價格...")
         
-        # 使用 FMP API 獲取股票價格
-        prices = {}
-        batch_size = 50
-        symbols_list = list(underlying_symbols)
-        
-        for i in range(0, len(symbols_list), batch_size):
-            batch = symbols_list[i:i+batch_size]
-            symbols_str = ",".join(batch)
-            url = f"https://financialmodelingprep.com/api/v3/quote/{symbols_str}?apikey={CONFIG['FMP_API_KEY']}"
-            
-            try:
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    quotes = response.json()
-                    for quote in quotes:
-                        symbol = quote.get('symbol')
-                        if symbol:
-                            prices[symbol] = {
-                                'price': quote.get('price', 0),
-                                'changesPercentage': quote.get('changesPercentage', 0),
-                                'dayHigh': quote.get('dayHigh', 0),
-                                'dayLow': quote.get('dayLow', 0),
-                                'previousClose': quote.get('previousClose', 0),
-                                'timestamp': quote.get('timestamp', 0)
-                            }
-            except Exception as e:
-                logger.error(f"Error fetching batch quotes: {e}")
+        # 從報價緩存獲取股票價格，之後由後台刷新
+        quote_cache.watch(underlying_symbols)
+        prices = quote_cache.get_many(underlying_symbols)
         
         # 更新數據文件中的底層股票價格
         portfolio_data['underlying_prices'] = prices
         portfolio_data['underlying_prices_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        portfolio_data['expiry_timeline'] = expiry_timeline.build_timeline(portfolio_data.get('positions', []), prices)
+        # 內嵌的計算結果依賴底層股票價格（接貨資金、實際到期價值），按新價格重新計算
+        portfolio_data['calculations'] = calc_engine.calculate_cloud_data(portfolio_data, recompute=True)
         
         # 保存回文件
-        with open(data_file, 'w', encoding='utf-8') as f:
-            json.dump(portfolio_data, f, indent=2, ensure_ascii=False)
+        snapshot_store.save(portfolio_data)
         
         print(f"✅ 成功更新 {len(prices)} 個底層股票價格")
         
@@ -1794,6 +1646,17 @@ def main():
     
     print("=" * 60)
     
+    # 啟動實時推送
+    if CONFIG['ENVIRONMENT'] != 'production':
+        live_updates.start()
+    
+    # 啟動後台雲端同步（每次保存快照後自動上傳）
+    if CONFIG['CLOUD_AUTO_SYNC'] and CONFIG['ENVIRONMENT'] != 'production':
+        cloud_sync.start()
+    
+    # 後台刷新持倉中的股票報價
+    quote_cache.start()
+    
     # 嘗試初始化 IB 連接
     ib_connected = initialize_ib_connection()
     
@@ -1877,6 +1740,15 @@ def cleanup():
         auto_update_thread.join(timeout=5)
         print("✅ 自動更新已停止")
     
+    live_updates.stop()
+    quote_cache.stop()
+    fmp_quotes.close()
+    
+    # 停止雲端同步
+    if cloud_sync:
+        cloud_sync.stop()
+    http_client.close()
+    
     # 斷開 IB 連接
     if ib_client and ib_client.isConnected():
         try:
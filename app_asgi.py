@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Production Version (ASGI)
+app_production.py 的 asyncio 版本 - 路由和行為相同，用 uvicorn 運行
+
+- 上傳的解碼、寫入數據文件和匯總計算在線程池中執行，不阻塞事件循環；
+  慢速上傳只佔用一個協程，讀取請求體時不佔用線程
+- 所有 AccountRegistry 調用（賬戶解析、讀取持倉 / 匯總、狀態）都在線程池中執行，
+  它們可能等待跨進程鎖或重新計算合併視圖
+- 多個 worker 時持倉 / 匯總優先直接發送共享內存中的最新 JSON 文件（不解析、不重新序列化），
+  與 app_production.send_shared 相同
+- /ws 和 /api/stream 的每個連接是一個協程，空閒連接只佔用少量內存，
+  hub 有新內容時通過 call_soon_threadsafe 喚醒，不輪詢
+- 數據（AccountRegistry）和推送（WebSocketHub）與 app_production 共用同一套實現
+
+啟動: uvicorn app_asgi:app --host 0.0.0.0 --port $PORT
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import app_production as production
+import upload_codec
+from ws_hub import STREAM_KEEPALIVE_SECONDS, parse_subscription, sse_message
+
+logger = logging.getLogger(__name__)
+
+CONFIG = production.CONFIG
+accounts = production.accounts
+ws_hub = production.ws_hub
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization'),
+    (b'access-control-allow-methods', b'GET,PUT,POST,DELETE')
+]
+
+
+class CorsHeaders:
+    """為所有 HTTP 響應添加 CORS 頭（與 app_production.after_request 一致，流式響應也適用）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cors(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + CORS_HEADERS
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+def json_bytes(data):
+    return json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def json_response(data, status_code=200, headers=None):
+    return Response(json_bytes(data), status_code=status_code, headers=headers, media_type='application/json')
+
+
+def asset_response(result):
+    status, headers, body = result
+    return Response(body, status_code=status, headers=headers)
+
+
+async def send_shared(kind, account, request):
+    """直接發送共享內存中的最新 JSON 文件（不解析），沒有時返回 None"""
+    version, path = await run_in_threadpool(accounts.shared_path, kind, account)
+    if path is None:
+        return None
+    etag = f'"{account}-{kind}-{version}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        stat_result = await run_in_threadpool(os.stat, path)
+    except FileNotFoundError:
+        return None  # 剛好被更新的版本替換並清理
+    return FileResponse(path, stat_result=stat_result, headers=headers, media_type='application/json')
+
+
+async def index(request):
+    """主頁 - 返回儀表板（內嵌初始數據；渲染可能需要計算匯總，在線程池中執行）"""
+    if production.dashboard is not None:
+        return asset_response(await run_in_threadpool(
+            production.dashboard_shell, request.query_params.get('account'),
+            request.headers.get('accept-encoding'), request.headers.get('if-none-match')))
+    return FileResponse('static/dashboard_new.html')
+
+
+async def dashboard_asset(request):
+    """儀表板 JS / CSS（文件名包含內容哈希，永久緩存）"""
+    result = None
+    if production.dashboard is not None:
+        result = production.dashboard.asset(request.path_params['name'], request.headers.get('accept-encoding'),
+                                            request.headers.get('if-none-match'))
+    if result is None:
+        return json_response({"error": "Not found"}, 404)
+    return asset_response(result)
+
+
+async def test_page(request):
+    """測試頁面"""
+    return FileResponse('static/test_api_data.html')
+
+
+async def get_accounts(request):
+    """API: 賬戶列表"""
+    return json_response(await run_in_threadpool(production.accounts_payload))
+
+
+async def get_portfolio(request):
+    """API: 獲取持倉數據（?account=賬戶，account=all 為所有賬戶的合併視圖）"""
+    try:
+        account = await run_in_threadpool(accounts.resolve, request.query_params.get('account'))
+        shared = await send_shared('portfolio', account, request)
+        if shared is not None:
+            return shared
+        data = await run_in_threadpool(accounts.document, account)
+        if data is None:
+            data = {
+                "error": "No data available",
+                "timestamp": datetime.now().isoformat(),
+                "summary": {
+                    "total_positions": 0,
+                    "total_market_value": 0
+                },
+                "positions": []
+            }
+        body = await run_in_threadpool(json_bytes, data)
+        return Response(body, media_type='application/json')
+    except Exception as e:
+        logger.error(f"Error reading portfolio data: {e}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_summary(request):
+    """API: 服務器端計算的匯總（?account=，all 為合併匯總），支持 If-None-Match"""
+    try:
+        account = await run_in_threadpool(accounts.resolve, request.query_params.get('account'))
+        shared = await send_shared('summary', account, request)
+        if shared is not None:
+            return shared
+        summary = await run_in_threadpool(accounts.summary, account)
+        if summary is None:
+            return json_response({"error": "No data available"}, 404)
+        etag = f'"{summary["version"]}-{summary["computed_at"]}"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers=headers)
+        body = await run_in_threadpool(json_bytes, summary)
+        return Response(body, headers=headers, media_type='application/json')
+    except Exception as e:
+        logger.error(f"Error serving summary: {e}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def update_portfolio(request):
+    """API: 更新持倉數據（生產環境不支持）"""
+    return json_response({
+        "success": False,
+        "error": "Not available in production",
+        "message": "Railway 環境無法連接到 TWS。請在本地環境更新數據後上傳。"
+    }, 503)
+
+
+async def upload_portfolio(request):
+    """API: 接收並保存上傳的持倉數據（格式見 app_production.handle_upload）"""
+    try:
+        body = await request.body()
+        payload, status = await run_in_threadpool(production.handle_upload, body, request.headers)
+        return json_response(payload, status)
+    except Exception as e:
+        logger.error(f"Error uploading portfolio data: {e}")
+        return json_response({"success": False, "error": str(e)}, 500)
+
+
+def register_async_client():
+    """註冊一個由事件循環喚醒的 hub 客戶端，返回 (client, asyncio.Event)"""
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    client = ws_hub.register(waker=lambda: loop.call_soon_threadsafe(wake.set))
+    return client, wake
+
+
+async def stream_updates(request):
+    """API: Server-Sent Events 推送持倉變化和新版本通知（與 app_production 相同）"""
+    subscription = parse_subscription(request.query_params)
+
+    async def generate():
+        client, wake = register_async_client()
+        client.subscribe(subscription)
+        try:
+            yield "retry: 3000\n"
+            yield sse_message({'type': 'hello', 'client_id': client.client_id})
+            while True:
+                try:
+                    await asyncio.wait_for(wake.wait(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                wake.clear()
+                for outgoing in client.take(0):
+                    yield sse_message(outgoing)
+        finally:
+            ws_hub.unregister(client)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+async def websocket_updates(websocket):
+    """WebSocket: 按訂閱（賬戶、底層股票、字段）推送持倉變化和新版本通知"""
+    await websocket.accept()
+    client, wake = register_async_client()
+
+    async def receive_loop():
+        try:
+            while True:
+                ws_hub.handle_message(client, await websocket.receive_text())
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # 連接關閉，發送循環隨之結束
+
+    receiver = asyncio.ensure_future(receive_loop())
+    try:
+        await websocket.send_text(json.dumps({'type': 'hello', 'client_id': client.client_id}))
+        while not receiver.done():
+            waiter = asyncio.ensure_future(wake.wait())
+            await asyncio.wait((waiter, receiver), return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            wake.clear()
+            for outgoing in client.take(0):
+                await websocket.send_text(json.dumps(outgoing, ensure_ascii=False, default=str))
+    except (WebSocketDisconnect, RuntimeError) as e:
+        logger.debug(f"WebSocket client {client.client_id} closed: {e}")
+    finally:
+        receiver.cancel()
+        ws_hub.unregister(client)
+
+
+async def health_check(request):
+    """健康檢查端點"""
+    return json_response({
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "environment": CONFIG['ENVIRONMENT'],
+        "server": "asgi",
+        "accept": upload_codec.supported_formats()
+    })
+
+
+async def get_status(request):
+    """API: 獲取系統狀態"""
+    return json_response(await run_in_threadpool(production.status_payload))
+
+
+app = CorsHeaders(Starlette(routes=[
+    Route('/', index),
+    Route('/assets/{name}', dashboard_asset),
+    Route('/test', test_page),
+    Route('/api/accounts', get_accounts),
+    Route('/api/portfolio', get_portfolio),
+    Route('/api/summary', get_summary),
+    Route('/api/update', update_portfolio, methods=['POST']),
+    Route('/api/portfolio/upload', upload_portfolio, methods=['POST']),
+    Route('/api/stream', stream_updates),
+    WebSocketRoute('/ws', websocket_updates),
+    Route('/health', health_check),
+    Route('/api/status', get_status)
+]))
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    print("=" * 60)
+    print("IB Portfolio Monitor - Production Version (ASGI)")
+    print("=" * 60)
+    print(f"🌍 Environment: {CONFIG['ENVIRONMENT']}")
+    print(f"📊 Data File: {CONFIG['DATA_FILE']}")
+    print(f"🚀 Starting server on port {CONFIG['SERVER_PORT']}...")
+    print("=" * 60)
+
+    uvicorn.run(app, host='0.0.0.0', port=CONFIG['SERVER_PORT'], log_level='info')
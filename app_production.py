@@ -4,15 +4,30 @@ IB Portfolio Monitor - Production Version (No TWS Connection)
 用於 Railway 部署的生產版本
 """
 
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, jsonify, send_from_directory, send_file, request, Response
 import json
 import os
 import logging
+import threading
+import time
 from pathlib import Path
 from datetime import datetime
-import requests
 from dotenv import load_dotenv
 
+from ingest_store import VersionMismatch
+import upload_codec
+import calc_engine
+import portfolio_delta
+from account_registry import AccountRegistry, InvalidAccount
+from shared_snapshot import SharedSnapshots, default_directory
+from dashboard_assets import DashboardAssets, initial_state
+from ws_hub import WebSocketHub, parse_subscription
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
 # 加載環境變量
 load_dotenv()
 
@@ -30,11 +45,84 @@ app.config['JSON_AS_ASCII'] = False
 # 應用配置
 CONFIG = {
     'SERVER_PORT': int(os.environ.get('PORT', '8080')),
-    'DATA_FILE': 'portfolio_data_enhanced.json',
+    'DATA_FILE': os.environ.get('DATA_FILE', 'portfolio_data_enhanced.json'),  # default 賬戶（不帶賬戶的上傳）
+    'ACCOUNTS_DIR': os.environ.get('ACCOUNTS_DIR', 'accounts'),  # 其他賬戶的數據文件目錄
     'FMP_API_KEY': os.environ.get('FMP_API_KEY', ''),
+    # 多 worker 共享最新數據的目錄（默認在 /dev/shm），設為 off 時每個 worker 只使用自己的內存
+    'SHARED_SNAPSHOT_DIR': os.environ.get('SHARED_SNAPSHOT_DIR', ''),
+    'SHARED_POLL_SECONDS': 0.2,  # 檢查其他 worker 接收的新版本的間隔
+    'DASHBOARD_ASSETS': os.environ.get('DASHBOARD_ASSETS', 'on') != 'off',  # 拆分、精簡並預壓縮儀表板
     'ENVIRONMENT': 'production'
 }
 
+def open_shared_snapshots():
+    if CONFIG['SHARED_SNAPSHOT_DIR'] == 'off':
+        return None
+    try:
+        return SharedSnapshots(CONFIG['SHARED_SNAPSHOT_DIR'] or default_directory(CONFIG['DATA_FILE']))
+    except Exception as e:
+        logger.error(f"Shared snapshot directory unavailable, serving per-worker data: {e}")
+        return None
+
+# 按賬戶的上傳數據存儲（內存文檔 + 差量日誌 + 匯總緩存）和跨賬戶合併視圖
+accounts = AccountRegistry(CONFIG['DATA_FILE'], CONFIG['ACCOUNTS_DIR'], shared=open_shared_snapshots())
+
+# WebSocket 推送：每次上傳後把有變化的持倉分發給訂閱的儀表板
+ws_hub = WebSocketHub()
+# 已通知本 worker 的 WebSocket 客戶端的版本（其他 worker 接收的上傳由 watch_shared_versions 通知）
+notified_versions = {}
+LIVE_POSITION_FIELDS = ('position', 'current_price', 'market_value', 'pnl', 'market_data', 'days_to_expiry')
+
+def broadcast_changes(account, delta, version):
+    """把一次上傳的持倉變化和新版本分發給 WebSocket 客戶端"""
+    items = []
+    for pos in delta.get('positions_upsert', []):
+        key = portfolio_delta.delta_key(pos)
+        items.append({
+            'key': f"{account}:{key}",
+            'id': str(pos.get('conId') or key),
+            'holder': pos.get('account'),  # 持有該合約的 IB 賬戶（別名），同一合約可能在多個賬戶中
+            'account': account,
+            'underlying': calc_engine.underlying_of(pos),
+            'fields': {field: pos[field] for field in LIVE_POSITION_FIELDS if field in pos}
+        })
+    for key in delta.get('positions_removed', []):
+        items.append({'key': f"{account}:{key}", 'id': key, 'account': account,
+                      'underlying': None, 'fields': {'removed': True}})
+    ws_hub.publish(items)
+    ws_hub.publish_event('snapshot', {'account': account, 'version': version}, account=account)
+    notified_versions[account] = version
+
+def watch_shared_versions():
+    """其他 worker 接收了上傳時，通知本 worker 的客戶端重新載入（只讀取共享內存中的版本號）"""
+    notified_versions.update(accounts.shared_versions())
+    while True:
+        time.sleep(CONFIG['SHARED_POLL_SECONDS'])
+        try:
+            for account, version in accounts.shared_versions().items():
+                if version > notified_versions.get(account, 0):
+                    notified_versions[account] = version
+                    if len(ws_hub):
+                        ws_hub.publish_event('snapshot', {'account': account, 'version': version}, account=account)
+        except Exception as e:
+            logger.error(f"Error watching shared versions: {e}")
+
+if accounts.shared is not None:
+    threading.Thread(target=watch_shared_versions, name='shared-versions', daemon=True).start()
+
+def send_shared(kind, account):
+    """直接發送共享內存中的最新 JSON（sendfile，不解析），沒有時返回 None"""
+    version, path = accounts.shared_path(kind, account)
+    if path is None:
+        return None
+    try:
+        response = send_file(path, mimetype='application/json', etag=f"{account}-{kind}-{version}",
+                             conditional=True, max_age=0)
+    except FileNotFoundError:
+        return None  # 剛好被更新的版本替換並清理
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.after_request
 def after_request(response):
     """添加 CORS 支持"""
@@ -43,24 +131,79 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE')
     return response
 
+# 儀表板外殼 + 帶哈希的 JS / CSS（關閉時直接發送單文件 HTML）
+dashboard = DashboardAssets('static/dashboard_new.html') if CONFIG['DASHBOARD_ASSETS'] else None
+
+def asset_response(result):
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
+def dashboard_state(account):
+    """首頁內嵌的初始狀態（當前快照的可見字段和服務器計算的匯總），沒有數據時返回 None"""
+    try:
+        data = accounts.document(account)
+        if data is None:
+            return None
+        return initial_state(data, accounts.summary(account), account=account)
+    except Exception as e:
+        logger.error(f"Error building dashboard state: {e}")
+        return None
+
+def dashboard_shell(account, accept_encoding, if_none_match):
+    """儀表板外殼，內嵌當前數據版本的初始狀態（Flask 和 ASGI 版本共用）
+
+    同一賬戶、同一數據版本和日期的外殼只渲染一次；瀏覽器用 ETag 重新驗證。
+    """
+    account = accounts.resolve(account)
+    tag = f"{account}-{accounts.version(account)}-{datetime.now().date()}"
+    return dashboard.shell(accept_encoding, if_none_match,
+                           state=lambda: dashboard_state(account), state_tag=tag)
+
 @app.route('/')
 def index():
-    """主頁 - 返回儀表板"""
+    """主頁 - 返回儀表板（內嵌初始數據，首次渲染無需再請求）"""
+    if dashboard is not None:
+        return asset_response(dashboard_shell(request.args.get('account'),
+                                              request.headers.get('Accept-Encoding'),
+                                              request.headers.get('If-None-Match')))
     return send_from_directory('static', 'dashboard_new.html')
 
+@app.route('/assets/<name>')
+def dashboard_asset(name):
+    """儀表板 JS / CSS（文件名包含內容哈希，永久緩存）"""
+    result = dashboard.asset(name, request.headers.get('Accept-Encoding'),
+                             request.headers.get('If-None-Match')) if dashboard is not None else None
+    if result is None:
+        return jsonify({"error": "Not found"}), 404
+    return asset_response(result)
+
 @app.route('/test')
 def test_page():
     """測試頁面"""
     return send_from_directory('static', 'test_api_data.html')
 
+def accounts_payload():
+    """賬戶列表（Flask 和 ASGI 版本共用）"""
+    return {
+        "accounts": accounts.accounts(),
+        "consolidated_version": accounts.consolidated.version
+    }
+
+@app.route('/api/accounts')
+def get_accounts():
+    """API: 賬戶列表"""
+    return jsonify(accounts_payload())
+
 @app.route('/api/portfolio')
 def get_portfolio():
-    """API: 獲取持倉數據"""
+    """API: 獲取持倉數據（?account=賬戶，account=all 為所有賬戶的合併視圖）"""
     try:
-        data_file = Path(CONFIG['DATA_FILE'])
-        if data_file.exists():
-            with open(data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+        account = accounts.resolve(request.args.get('account'))
+        shared = send_shared('portfolio', account)
+        if shared is not None:
+            return shared
+        data = accounts.document(account)
+        if data is not None:
             return jsonify(data)
         else:
             return jsonify({
@@ -76,6 +219,25 @@ def get_portfolio():
         logger.error(f"Error reading portfolio data: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/summary')
+def get_summary():
+    """API: 服務器端計算的匯總、到期分組、到期時間線和保證金估算（?account=，all 為合併匯總）"""
+    try:
+        account = accounts.resolve(request.args.get('account'))
+        shared = send_shared('summary', account)
+        if shared is not None:
+            return shared
+        summary = accounts.summary(account)
+        if summary is None:
+            return jsonify({"error": "No data available"}), 404
+        response = jsonify(summary)
+        response.set_etag(f"{summary['version']}-{summary['computed_at']}")
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Error serving summary: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/update', methods=['POST'])
 def update_portfolio():
     """API: 更新持倉數據（生產環境不支持）"""
@@ -85,76 +247,157 @@ def update_portfolio():
         "message": "Railway 環境無法連接到 TWS。請在本地環境更新數據後上傳。"
     }), 503
 
-@app.route('/api/portfolio/upload', methods=['POST'])
-def upload_portfolio():
-    """API: 接收並保存上傳的持倉數據"""
+def handle_upload(body, headers):
+    """處理一次上傳，返回 (響應內容, HTTP 狀態碼)（Flask 和 ASGI 版本共用）
+
+    完整上傳: {"account": "...", "portfolio_data": {...}}
+    差量上傳: {"account": "...", "delta": {"base_version": N, ...}}，版本不一致時返回 409，客戶端改為完整上傳
+    不帶 account 時保存到 default 賬戶（原來的數據文件）。
+    請求體可以是 JSON 或 MessagePack，並可用 gzip / zstd 壓縮（見 upload_codec）。
+    """
+    # 按 Content-Encoding / Content-Type 解碼
     try:
-        # 獲取JSON數據
-        data = request.get_json()
-        if not data:
-            return jsonify({"success": False, "error": "No data provided"}), 400
-        
-        # 驗證基本的數據結構
-        if 'portfolio_data' not in data:
-            return jsonify({"success": False, "error": "Missing portfolio_data"}), 400
-        
+        data = upload_codec.decode(body, headers.get('Content-Encoding'), headers.get('Content-Type'))
+    except upload_codec.UnsupportedFormat as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "accept": upload_codec.supported_formats()
+        }, 415
+    except upload_codec.PayloadTooLarge as e:
+        return {"success": False, "error": str(e)}, 413
+    except ValueError as e:
+        return {"success": False, "error": f"Invalid payload: {e}"}, 400
+    if not data:
+        return {"success": False, "error": "No data provided"}, 400
+    if not isinstance(data, dict):
+        return {"success": False, "error": "Payload must be an object"}, 400
+    
+    try:
+        account = accounts.validate(data.get('account') or headers.get('X-Account'))
+    except InvalidAccount as e:
+        return {"success": False, "error": str(e)}, 400
+    
+    now = datetime.now().isoformat()
+    
+    if 'delta' in data:
+        delta = data['delta']
+        if not isinstance(delta, dict) or not isinstance(delta.get('fields') or {}, dict):
+            return {"success": False, "error": "delta must be an object"}, 400
+        delta['fields'] = dict(delta.get('fields') or {}, last_update=now, upload_source='remote_upload')
+        try:
+            version, write_ms = accounts.ingest_delta(account, delta)
+        except VersionMismatch as e:
+            logger.warning(f"Delta upload rejected: {e}")
+            return {
+                "success": False,
+                "error": "version_mismatch",
+                "version": e.expected
+            }, 409
+        mode = 'delta'
+    elif 'portfolio_data' in data:
         portfolio_data = data['portfolio_data']
+        if not isinstance(portfolio_data, dict):
+            return {"success": False, "error": "portfolio_data must be an object"}, 400
         
         # 更新時間戳
-        portfolio_data['last_update'] = datetime.now().isoformat()
+        portfolio_data['last_update'] = now
         portfolio_data['upload_source'] = 'remote_upload'
-        
-        # 保存到數據文件
-        data_file = Path(CONFIG['DATA_FILE'])
-        with open(data_file, 'w', encoding='utf-8') as f:
-            json.dump(portfolio_data, f, ensure_ascii=False, indent=2)
-        
-        logger.info(f"Portfolio data uploaded successfully - {len(portfolio_data.get('positions', []))} positions")
-        
-        return jsonify({
-            "success": True,
-            "message": "Portfolio data uploaded successfully",
-            "positions_count": len(portfolio_data.get('positions', [])),
-            "timestamp": portfolio_data['last_update']
-        })
-        
+        previous = accounts.document(account) or {}
+        version, write_ms = accounts.ingest_full(account, portfolio_data)
+        # 完整上傳時只在有 WebSocket 客戶端時計算變化
+        delta = portfolio_delta.build_delta(previous, portfolio_data, version) if len(ws_hub) else {}
+        mode = 'full'
+    else:
+        return {"success": False, "error": "Missing portfolio_data"}, 400
+    
+    try:
+        broadcast_changes(account, delta, version)
+    except Exception as e:
+        logger.error(f"Error broadcasting changes for {account}: {e}")
+    
+    # 每次接收後計算一次該賬戶的匯總，/api/summary 直接返回緩存
+    try:
+        accounts.summary(account)
+    except Exception as e:
+        logger.error(f"Error computing summary for {account}: {e}")
+    
+    positions_count = len(accounts.document(account).get('positions', []))
+    logger.info(f"Portfolio data uploaded successfully ({mode}) - account {account}, "
+                f"{positions_count} positions, version {version}")
+    
+    return {
+        "success": True,
+        "message": "Portfolio data uploaded successfully",
+        "mode": mode,
+        "account": account,
+        "version": version,
+        "write_ms": round(write_ms, 2),
+        "accept": upload_codec.supported_formats(),
+        "positions_count": positions_count,
+        "timestamp": now
+    }, 200
+
+@app.route('/api/portfolio/upload', methods=['POST'])
+def upload_portfolio():
+    """API: 接收並保存上傳的持倉數據（格式見 handle_upload）"""
+    try:
+        payload, status = handle_upload(request.get_data(), request.headers)
+        return jsonify(payload), status
     except Exception as e:
         logger.error(f"Error uploading portfolio data: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/stream')
+def stream_updates():
+    """API: Server-Sent Events 推送持倉變化和新版本通知（消息與 /ws 相同，訂閱見 ws_hub.parse_subscription）"""
+    return Response(ws_hub.stream(parse_subscription(request.args)), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+if Sock is not None:
+    sock = Sock(app)
+    
+    @sock.route('/ws')
+    def websocket_updates(ws):
+        """WebSocket: 按訂閱（賬戶、底層股票、字段）推送持倉變化和新版本通知"""
+        ws_hub.serve(ws)
+else:
+    logger.warning("flask-sock is not installed, /ws is disabled")
+
 @app.route('/health')
 def health_check():
     """健康檢查端點"""
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "environment": CONFIG['ENVIRONMENT']
+        "environment": CONFIG['ENVIRONMENT'],
+        "accept": upload_codec.supported_formats()
     })
 
-@app.route('/api/status')
-def get_status():
-    """API: 獲取系統狀態"""
-    data_file = Path(CONFIG['DATA_FILE'])
-    has_data = data_file.exists()
-    last_update = None
-    
-    if has_data:
-        try:
-            with open(data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                last_update = data.get('last_update')
-        except:
-            pass
+def status_payload():
+    """系統狀態（Flask 和 ASGI 版本共用）"""
+    account_list = accounts.accounts()
+    has_data = bool(account_list)
+    last_update = max((a['last_update'] for a in account_list if a['last_update']), default=None)
     
-    return jsonify({
+    return {
         "status": "running",
         "environment": CONFIG['ENVIRONMENT'],
         "tws_connected": False,
         "has_data": has_data,
         "last_update": last_update,
+        "accounts": account_list,
+        "websocket": ws_hub.stats(),
         "source": "production",
         "message": "生產環境 - 使用靜態數據文件"
-    })
+    }
+
+@app.route('/api/status')
+def get_status():
+    """API: 獲取系統狀態"""
+    return jsonify(status_payload())
 
 # Railway 部署時會使用 gunicorn，開發時使用 Flask 內建服務器
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+基準測試：calculate_cloud_data 的到期日分組計算
+比較舊版逐個 symbol 線性查找（O(N·M)）與新版索引分組（O(N)）
+"""
+
+import random
+import time
+
+import calc_engine
+
+SYMBOLS = ['SPY', 'QQQ', 'IWM', 'NVDA', 'AMD', 'TSLA', 'META', 'AMZN', 'MSFT', 'AAPL',
+           'COIN', 'MSTR', 'PLTR', 'HOOD', 'AVGO', 'NFLX', 'UBER', 'ORCL', 'JPM', 'BA']
+
+
+def generate_portfolio(n, expiries=52, seed=42):
+    """生成 n 個持倉的測試數據（多個行權價共享 symbol 和到期日）"""
+    rng = random.Random(seed)
+    expiry_list = [f"2026{(i // 4) % 12 + 1:02d}{(i % 4) * 7 + 1:02d}" for i in range(expiries)]
+    positions = []
+    options_by_expiry = {}
+
+    for i in range(n):
+        symbol = rng.choice(SYMBOLS)
+        expiry = rng.choice(expiry_list)
+        strike = rng.randint(50, 600)
+        avg_cost = round(rng.uniform(0.5, 20), 2)
+        current_price = round(rng.uniform(0.1, 20), 2)
+        position = -rng.randint(1, 20)
+        pos = {
+            'symbol': symbol,
+            'secType': 'OPT',
+            'currency': 'USD',
+            'conId': 100000 + i,
+            'tradingClass': symbol,
+            'strike': float(strike),
+            'right': 'P',
+            'expiry': expiry,
+            'position': position,
+            'avg_cost': avg_cost,
+            'current_price': current_price,
+            'market_value': position * current_price * 100,
+            'pnl': (avg_cost - current_price) * abs(position) * 100,
+            'days_to_expiry': 30,
+            'has_market_data': True
+        }
+        positions.append(pos)
+        group = options_by_expiry.setdefault(expiry, {
+            'expiry': expiry,
+            'expiry_formatted': f"{expiry[:4]}-{expiry[4:6]}-{expiry[6:8]}",
+            'days_to_expiry': 30,
+            'total_value': 0,
+            'count': 0,
+            'positions': []
+        })
+        group['total_value'] += pos['market_value']
+        group['count'] += 1
+        group['positions'].append(symbol)
+
+    return {
+        'positions': positions,
+        'options_by_expiry': list(options_by_expiry.values()),
+        'account_summary': {'NetLiquidation': {'value': '1000000', 'currency': 'USD'}},
+        'underlying_prices': {s: {'price': rng.uniform(50, 600)} for s in SYMBOLS}
+    }
+
+
+def legacy_expiry_groups(portfolio_data):
+    """舊版實現：每個到期組的每個 symbol 都線性掃描全部持倉"""
+    positions = portfolio_data.get('positions', [])
+    groups = []
+    for expiry_group in portfolio_data['options_by_expiry']:
+        group_calc = calc_engine.new_expiry_group(expiry_group.get('expiry'))
+        for symbol in expiry_group.get('positions', []):
+            pos = next((p for p in positions if p.get('symbol') == symbol and p.get('expiry') == expiry_group.get('expiry')), None)
+            if pos and pos.get('currency') == 'USD':
+                group_calc['us_options']['count'] += 1
+                group_calc['us_options']['total_value'] += abs(pos.get('market_value', 0))
+        groups.append(group_calc)
+    return groups
+
+
+def measure(func, data, repeat=3):
+    """返回多次執行中的最短耗時（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print("=" * 72)
+    print("calculate_cloud_data 基準測試")
+    print("=" * 72)
+    print(f"{'持倉數':>8} {'舊版分組 (ms)':>16} {'新版完整計算 (ms)':>20} {'新版 μs/持倉':>16}")
+
+    for n in (625, 1250, 2500, 5000):
+        data = generate_portfolio(n)
+        legacy = measure(legacy_expiry_groups, data, repeat=1)
+        indexed = measure(calc_engine.calculate_cloud_data, data)
+        print(f"{n:>8} {legacy * 1000:>16.1f} {indexed * 1000:>20.1f} {indexed / n * 1e6:>16.2f}")
+
+    # 正確性：同一 symbol 和到期日下的多個行權價應全部計入
+    data = generate_portfolio(5000)
+    result = calc_engine.calculate_cloud_data(data)
+    counted = sum(g['us_options']['count'] for g in result['expiry_groups'])
+    group_value = sum(
+        abs(g['us_options']['total_value']) for g in result['expiry_groups']
+    )
+    expected = sum(abs(p['market_value']) for p in data['positions'])
+    print("-" * 72)
+    print(f"到期組持倉計數: {counted} / {len(data['positions'])}")
+    print(f"到期組總價值: {group_value:.2f} / {expected:.2f}")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
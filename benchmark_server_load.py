@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+負載測試：生產服務器（gunicorn + gevent 的 app_production 對比 uvicorn 的 app_asgi）
+
+對每種服務器:
+1. 建立大量空閒的 SSE（/api/stream）和 WebSocket（/ws）連接，統計成功數
+2. 空閒連接保持期間測量 /health 和 /api/summary 的延遲
+3. 一個客戶端緩慢發送上傳請求體期間，再次測量 /health 延遲
+4. 完整上傳一次快照，測量上傳耗時，以及所有連接收到 snapshot 事件的時間
+5. 服務器進程（含子進程）的內存佔用
+
+服務器使用臨時目錄中的數據文件，不會修改倉庫中的數據。
+用法: python benchmark_server_load.py [數據文件] [--sse N] [--ws N] [--servers gunicorn,asgi]
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+DEFAULT_DATA_FILE = 'portfolio_data_enhanced.json'
+CONNECT_CONCURRENCY = 200  # 同時進行中的連接握手數
+LATENCY_SAMPLES = 200
+EVENT_TIMEOUT = 30
+
+
+def procfile_command():
+    """Procfile 中的 gunicorn 啟動命令（當前的生產配置）"""
+    line = Path('Procfile').read_text(encoding='utf-8').strip()
+    return line.split(':', 1)[1].strip()
+
+
+SERVERS = {
+    'gunicorn': {
+        'modules': ('gunicorn', 'gevent', 'flask'),
+        'command': lambda port: procfile_command().replace('0.0.0.0:$PORT', f'127.0.0.1:{port}').split()
+    },
+    'asgi': {
+        'modules': ('uvicorn', 'starlette'),
+        'command': lambda port: ['uvicorn', 'app_asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                                 '--log-level', 'warning', '--no-access-log']
+    }
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def rss_mb(pid):
+    """進程及其子進程的常駐內存（MB，讀取 /proc）"""
+    total_kb = 0
+    pids = {pid}
+    for stat in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            fields = stat.read_text().rsplit(')', 1)[1].split()
+            if int(fields[1]) == pid:
+                pids.add(int(stat.parent.name))
+        except (OSError, ValueError, IndexError):
+            continue
+    for p in pids:
+        try:
+            for line in Path(f'/proc/{p}/status').read_text().splitlines():
+                if line.startswith('VmRSS:'):
+                    total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def start_server(name, port, workdir, data_file):
+    env = dict(os.environ, PORT=str(port),
+               DATA_FILE=str(workdir / 'portfolio_data_enhanced.json'),
+               ACCOUNTS_DIR=str(workdir / 'accounts'))
+    shutil.copy(data_file, env['DATA_FILE'])
+    process = subprocess.Popen(SERVERS[name]['command'](port), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1).read()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{name} did not start')
+
+
+class IdleConnection:
+    """一個空閒的 SSE 或 WebSocket 連接，記錄收到 snapshot 事件的時間"""
+
+    def __init__(self):
+        self.ready = asyncio.Event()
+        self.snapshot_at = None
+        self.writer = None
+
+    async def open(self, port, kind):
+        reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        if kind == 'sse':
+            request = f'GET /api/stream HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n'
+        else:
+            key = base64.b64encode(os.urandom(16)).decode()
+            request = (f'GET /ws HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                       f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n')
+        self.writer.write(request.encode())
+        await self.writer.drain()
+        return asyncio.ensure_future(self._read(reader))
+
+    async def _read(self, reader):
+        buffer = b''
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                buffer = (buffer + chunk)[-256:]
+                if not self.ready.is_set() and b'hello' in buffer:
+                    self.ready.set()
+                if b'"snapshot"' in buffer or b'event: snapshot' in buffer:
+                    self.snapshot_at = time.perf_counter()
+                    return
+        except (ConnectionError, OSError):
+            return
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+
+async def open_idle_connections(port, kind, count):
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    connections, readers = [], []
+
+    async def open_one():
+        async with semaphore:
+            conn = IdleConnection()
+            try:
+                readers.append(await conn.open(port, kind))
+                await asyncio.wait_for(conn.ready.wait(), 10)
+                connections.append(conn)
+            except (OSError, asyncio.TimeoutError):
+                conn.close()
+
+    await asyncio.gather(*(open_one() for _ in range(count)))
+    return connections, readers
+
+
+async def http_request(port, method, path, body=b'', headers=None):
+    """發送一個請求（Connection: close），返回 (狀態碼, 耗時 ms)"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    lines = [f'{method} {path} HTTP/1.1', 'Host: 127.0.0.1', 'Connection: close',
+             f'Content-Length: {len(body)}']
+    lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b' ', 2)[1]) if response else 0
+    return status, (time.perf_counter() - start) * 1000
+
+
+async def latency(port, path, samples=LATENCY_SAMPLES):
+    times = []
+    for _ in range(samples):
+        status, elapsed = await http_request(port, 'GET', path)
+        if status == 200:
+            times.append(elapsed)
+    if not times:
+        return float('nan'), float('nan')
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.99) - 1]
+
+
+async def latency_during_slow_upload(port):
+    """一個客戶端只發送一半請求體後停住，期間測量 /health 延遲"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'POST /api/portfolio/upload HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                 b'Content-Type: application/json\r\nContent-Length: 1000000\r\n\r\n' + b' ' * 1000)
+    await writer.drain()
+    try:
+        return await latency(port, '/health', samples=50)
+    finally:
+        writer.close()
+
+
+async def run_load(name, port, pid, body, sse_count, ws_count):
+    sse, sse_readers = await open_idle_connections(port, 'sse', sse_count)
+    ws, ws_readers = await open_idle_connections(port, 'ws', ws_count)
+    connections = sse + ws
+    result = {'sse': len(sse), 'ws': len(ws)}
+
+    result['health'] = await latency(port, '/health')
+    result['summary'] = await latency(port, '/api/summary')
+    result['slow_upload_health'] = await latency_during_slow_upload(port)
+
+    start = time.perf_counter()
+    status, result['upload_ms'] = await http_request(port, 'POST', '/api/portfolio/upload', body,
+                                                     {'Content-Type': 'application/json'})
+    await asyncio.wait(sse_readers + ws_readers, timeout=EVENT_TIMEOUT)
+    received = [c.snapshot_at - start for c in connections if c.snapshot_at]
+    result['upload_status'] = status
+    result['fanout'] = (len(received), max(received) * 1000 if received else float('nan'))
+    result['rss_mb'] = rss_mb(pid)
+
+    for conn in connections:
+        conn.close()
+    for task in sse_readers + ws_readers:
+        task.cancel()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生產服務器負載測試')
+    parser.add_argument('data_file', nargs='?', default=DEFAULT_DATA_FILE)
+    parser.add_argument('--sse', type=int, default=2000, help='空閒 SSE 連接數')
+    parser.add_argument('--ws', type=int, default=1000, help='空閒 WebSocket 連接數')
+    parser.add_argument('--servers', default='gunicorn,asgi')
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    with open(Path(args.data_file), 'r', encoding='utf-8') as f:
+        body = json.dumps({'portfolio_data': json.load(f)}).encode('utf-8')
+
+    print("=" * 96)
+    print(f"生產服務器負載測試 - {args.sse} 個 SSE + {args.ws} 個 WebSocket 空閒連接，"
+          f"上傳 {len(body):,} 字節（fd 上限 {fd_limit}）")
+    print("=" * 96)
+    print(f"{'服務器':<10} {'SSE':>6} {'WS':>6} {'health p50/p99':>16} {'summary p50/p99':>17} "
+          f"{'慢上傳時 health':>16} {'上傳 ms':>9} {'推送完成 ms':>14} {'RSS MB':>8}")
+
+    for name in args.servers.split(','):
+        missing = [m for m in SERVERS[name]['modules'] if importlib.util.find_spec(m) is None]
+        if missing:
+            print(f"{name:<10} 未安裝 {', '.join(missing)}，跳過")
+            continue
+        port = free_port()
+        with tempfile.TemporaryDirectory() as tmp:
+            process = start_server(name, port, Path(tmp), args.data_file)
+            try:
+                r = asyncio.run(run_load(name, port, process.pid, body, args.sse, args.ws))
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    # gunicorn 優雅退出時會等待仍未結束的流式響應
+                    process.kill()
+                    process.wait()
+        delivered, fanout_ms = r['fanout']
+        print(f"{name:<10} {r['sse']:>6} {r['ws']:>6} "
+              f"{r['health'][0]:>7.1f}/{r['health'][1]:<8.1f} {r['summary'][0]:>7.1f}/{r['summary'][1]:<9.1f} "
+              f"{r['slow_upload_health'][0]:>7.1f}/{r['slow_upload_health'][1]:<8.1f} "
+              f"{r['upload_ms']:>9.1f} {fanout_ms:>8.0f} ({delivered}) {r['rss_mb']:>8.1f}")
+
+    print("-" * 96)
+    print("延遲單位為 ms；推送完成為上傳開始到最後一個連接收到 snapshot 事件的時間（括號內為收到的連接數）")
+    print("=" * 96)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
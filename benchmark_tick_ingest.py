@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+基準測試：行情 tick 接收
+比較舊版回調（在 EReader 線程中查表、寫入、標記、推送並逐個記錄 INFO 日誌）
+與 tick_ingest（回調只入隊，後台線程批量應用）的每秒處理 tick 數
+
+用法: python benchmark_tick_ingest.py [--ticks N] [--contracts N]
+"""
+
+import argparse
+import logging
+import os
+import random
+import time
+
+import calc_engine
+import tick_ingest
+from live_stream import LiveUpdates
+
+logger = logging.getLogger('benchmark_tick_ingest')
+
+
+class LegacyTickHandler:
+    """舊版實現：每個回調創建字段表、逐個 tick 標記引擎、推送並記錄 INFO 日誌"""
+
+    def __init__(self, engine, req_id_map, contracts, live):
+        self.engine = engine
+        self.req_id_map = req_id_map
+        self.market_data = engine.market_data
+        self.options_data = engine.options_data
+        self.contracts = contracts
+        self.live = live
+
+    def push_update(self, symbol, fields):
+        con_id = self.contracts.get(symbol)
+        if con_id:
+            self.live.publish(con_id, fields)
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        if reqId in self.req_id_map:
+            symbol = self.req_id_map[reqId]
+            if symbol not in self.market_data:
+                self.market_data[symbol] = {}
+            price_types = {1: 'bid', 2: 'ask', 4: 'last', 6: 'high', 7: 'low', 9: 'close',
+                           14: 'open', 37: 'markPrice', 68: 'histVolatility', 72: 'indexFuturePremium'}
+            if tickType in price_types:
+                self.market_data[symbol][price_types[tickType]] = price
+                self.engine.touch(symbol)
+                self.push_update(symbol, {price_types[tickType]: price})
+                logger.info(f"Price Update - {symbol} {price_types[tickType]}: {price}")
+                if tickType in [4, 9]:
+                    self.market_data[symbol]['currentPrice'] = price
+
+    def tickSize(self, reqId, tickType, size):
+        if reqId in self.req_id_map:
+            symbol = self.req_id_map[reqId]
+            if symbol not in self.market_data:
+                self.market_data[symbol] = {}
+            size_types = {0: 'bidSize', 3: 'askSize', 5: 'lastSize', 8: 'volume', 21: 'avgVolume',
+                          27: 'callOpenInterest', 28: 'putOpenInterest', 86: 'shortableShares'}
+            if tickType in size_types:
+                self.market_data[symbol][size_types[tickType]] = size
+                self.engine.touch(symbol)
+
+    def tickOptionComputation(self, reqId, tickType, tickAttrib, impliedVol, delta,
+                              optPrice, pvDividend, gamma, vega, theta, undPrice):
+        if reqId in self.req_id_map:
+            symbol = self.req_id_map[reqId]
+            if symbol not in self.options_data:
+                self.options_data[symbol] = {}
+            greeks = {'impliedVolatility': impliedVol, 'delta': delta, 'optionPrice': optPrice,
+                      'pvDividend': pvDividend, 'gamma': gamma, 'vega': vega, 'theta': theta,
+                      'underlyingPrice': undPrice}
+            if tickType == 13:
+                self.options_data[symbol]['modelGreeks'] = greeks
+                self.push_update(symbol, {'delta': delta, 'gamma': gamma, 'theta': theta, 'vega': vega,
+                                          'impliedVolatility': impliedVol, 'underlyingPrice': undPrice})
+            self.engine.touch(symbol)
+            logger.info(f"Greeks Update - {symbol}: Delta={delta}, Gamma={gamma}, Theta={theta}, Vega={vega}")
+
+
+class QueuedTickHandler:
+    """新版回調：與 app.py 相同，只查模塊常量表並入隊"""
+
+    def __init__(self, ticks):
+        self.ticks = ticks
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        field = tick_ingest.PRICE_FIELDS.get(tickType)
+        if field is not None:
+            self.ticks.put(reqId, field, price)
+
+    def tickSize(self, reqId, tickType, size):
+        field = tick_ingest.SIZE_FIELDS.get(tickType)
+        if field is not None:
+            self.ticks.put(reqId, field, size)
+
+    def tickOptionComputation(self, reqId, tickType, tickAttrib, impliedVol, delta,
+                              optPrice, pvDividend, gamma, vega, theta, undPrice):
+        field = tick_ingest.GREEK_FIELDS.get(tickType)
+        if field is not None:
+            self.ticks.put(reqId, field, (impliedVol, delta, optPrice, pvDividend, gamma, vega, theta, undPrice))
+
+
+def build_book(contracts):
+    """建立持倉和訂閱：返回 (引擎, reqId -> 合約鍵, 合約鍵 -> conId)"""
+    engine = calc_engine.CalcEngine()
+    req_id_map, con_ids = {}, {}
+    for i in range(contracts):
+        key = f"SYM{i % 50}_20261218_P_{100 + i}"
+        engine.set_position(('U1', key), {
+            'symbol': f"SYM{i % 50}", 'secType': 'OPT', 'currency': 'USD', 'position': -1,
+            'avg_cost': 120.0, 'multiplier': 100, 'expiry': '20261218', 'strike': 100 + i, 'right': 'P'
+        }, key)
+        req_id_map[1000 + i] = key
+        con_ids[key] = 500000 + i
+    return engine, req_id_map, con_ids
+
+
+def generate_ticks(count, contracts, seed=7):
+    """模擬開盤時的 tick 流：價格 55%、數量 30%、希臘值 15%"""
+    rng = random.Random(seed)
+    ticks = []
+    for _ in range(count):
+        req_id = 1000 + rng.randrange(contracts)
+        r = rng.random()
+        if r < 0.55:
+            ticks.append(('price', req_id, rng.choice((1, 2, 4, 6, 7, 9)), round(rng.uniform(0.5, 20), 2)))
+        elif r < 0.85:
+            ticks.append(('size', req_id, rng.choice((0, 3, 5, 8)), rng.randrange(1, 500)))
+        else:
+            ticks.append(('greeks', req_id, 13, (0.3, -0.25, 3.2, 0.0, 0.01, 0.12, -0.05, 410.0)))
+    return ticks
+
+
+def replay(handler, ticks):
+    """在當前線程中依次調用回調，返回耗時（秒）"""
+    start = time.perf_counter()
+    for kind, req_id, tick_type, value in ticks:
+        if kind == 'price':
+            handler.tickPrice(req_id, tick_type, value, None)
+        elif kind == 'size':
+            handler.tickSize(req_id, tick_type, value)
+        else:
+            handler.tickOptionComputation(req_id, tick_type, None, *value)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='行情 tick 接收基準測試')
+    parser.add_argument('--ticks', type=int, default=200000)
+    parser.add_argument('--contracts', type=int, default=1000)
+    args = parser.parse_args()
+
+    # 與 app.py 相同的日誌格式，輸出到 /dev/null（保留格式化和寫入的開銷）
+    devnull = open(os.devnull, 'w')
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+
+    ticks = generate_ticks(args.ticks, args.contracts)
+
+    print("=" * 72)
+    print(f"行情 tick 接收基準測試 - {args.ticks:,} 個 tick，{args.contracts} 個合約")
+    print("=" * 72)
+    print(f"{'實現':<36} {'耗時 (ms)':>12} {'tick/s':>14}")
+
+    engine, req_id_map, con_ids = build_book(args.contracts)
+    legacy = LegacyTickHandler(engine, req_id_map, con_ids, LiveUpdates())
+    legacy_seconds = replay(legacy, ticks)
+    print(f"{'舊版回調（EReader 線程）':<36} {legacy_seconds * 1000:>12.1f} {args.ticks / legacy_seconds:>14,.0f}")
+
+    engine, req_id_map, con_ids = build_book(args.contracts)
+    live = LiveUpdates()
+    ingest = tick_ingest.TickIngest(engine, req_id_map,
+                                    on_update=lambda symbol, fields: live.publish(con_ids[symbol], fields))
+    enqueue_seconds = replay(QueuedTickHandler(ingest), ticks)
+    print(f"{'新版回調 - 只入隊（EReader 線程）':<36} {enqueue_seconds * 1000:>12.1f} "
+          f"{args.ticks / enqueue_seconds:>14,.0f}")
+
+    start = time.perf_counter()
+    applied = ingest.flush()
+    apply_seconds = time.perf_counter() - start
+    print(f"{'新版批量應用（應用線程）':<36} {apply_seconds * 1000:>12.1f} {applied / apply_seconds:>14,.0f}")
+
+    total = enqueue_seconds + apply_seconds
+    print(f"{'新版合計（入隊 + 應用）':<36} {total * 1000:>12.1f} {args.ticks / total:>14,.0f}")
+
+    # 正確性：兩種實現寫入的最終行情應一致
+    expected_engine, expected_map, expected_ids = build_book(args.contracts)
+    replay(LegacyTickHandler(expected_engine, expected_map, expected_ids, LiveUpdates()), ticks)
+    logging.disable(logging.INFO)
+    same = (expected_engine.market_data == engine.market_data
+            and all(expected_engine.options_data[k]['modelGreeks'] == engine.options_data[k]['modelGreeks']
+                    for k in expected_engine.options_data))
+    print("-" * 72)
+    print(f"EReader 線程加速: {legacy_seconds / enqueue_seconds:.1f}x，"
+          f"端到端加速: {legacy_seconds / total:.1f}x，批次數: {ingest.batches}")
+    print(f"最終行情一致: {'是' if same else '否'}")
+    print("=" * 72)
+    devnull.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+基準測試：上傳傳輸格式
+對本地替身服務器上傳同一個快照，比較各格式的傳輸字節數、編碼耗時和往返時間
+
+用法: python benchmark_upload_transport.py [數據文件] [--repeat N]
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import upload_codec
+from http_client import HttpClient
+
+DEFAULT_DATA_FILE = 'portfolio_data_enhanced.json'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """模擬 /api/portfolio/upload：解碼請求體後返回持倉數量"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive，與 Railway 一致
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            data = upload_codec.decode(body, self.headers.get('Content-Encoding'),
+                                       self.headers.get('Content-Type'))
+            status = 200
+            reply = {'success': True,
+                     'positions_count': len(data['portfolio_data'].get('positions', []))}
+        except upload_codec.UnsupportedFormat as e:
+            status, reply = 415, {'success': False, 'error': str(e)}
+        payload = json.dumps(reply).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure_format(client, url, payload, encoding, content_type, repeat):
+    """返回 (傳輸字節數, 編碼耗時 ms, 往返時間中位數 ms)"""
+    encode_times, round_trips = [], []
+    body = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body, headers = upload_codec.encode(payload, encoding, content_type)
+        encode_times.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        response = client.post(url, data=body, headers=headers, timeout=30)
+        round_trips.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return len(body), statistics.median(encode_times), statistics.median(round_trips)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上傳傳輸格式基準測試')
+    parser.add_argument('data_file', nargs='?', default=DEFAULT_DATA_FILE)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(Path(args.data_file), 'r', encoding='utf-8') as f:
+        payload = {'portfolio_data': json.load(f)}
+
+    server = start_stand_in_server()
+    url = f"http://127.0.0.1:{server.server_port}/api/portfolio/upload"
+    client = HttpClient()
+    formats = upload_codec.supported_formats()
+
+    print("=" * 84)
+    print(f"上傳傳輸格式基準測試 - {args.data_file}，每種格式 {args.repeat} 次")
+    print("=" * 84)
+    print(f"{'Content-Type':<22} {'Encoding':<10} {'傳輸字節':>12} {'壓縮比':>8} {'編碼 (ms)':>12} {'往返 (ms)':>12}")
+
+    baseline = None
+    for content_type in reversed(formats['content_types']):
+        for encoding in reversed(formats['encodings']):
+            wire_bytes, encode_ms, rtt_ms = measure_format(
+                client, url, payload, encoding, content_type, args.repeat
+            )
+            baseline = baseline or wire_bytes
+            print(f"{content_type:<22} {encoding:<10} {wire_bytes:>12,} {baseline / wire_bytes:>7.1f}x "
+                  f"{encode_ms:>12.2f} {rtt_ms:>12.2f}")
+
+    missing = [name for name, module in (('zstandard', upload_codec.zstandard),
+                                         ('msgpack', upload_codec.msgpack)) if module is None]
+    if missing:
+        print("-" * 84)
+        print(f"未安裝 {', '.join(missing)}，相應格式未測試")
+    print(f"連接復用: {client.stats()}")
+    print("=" * 84)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
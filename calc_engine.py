@@ -0,0 +1,820 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Calculation Engine
+持倉計算引擎 - 市值、盈虧、到期價值、接貨資金和到期天數的唯一實現
+
+- derive_position / calculation_row: 單個持倉的衍生字段
+- CalcEngine: 增量引擎，只重新計算輸入有變化的持倉，並增量維護匯總
+- calculate_cloud_data: 對已保存的數據文件做一次性計算（兼容舊數據）
+"""
+
+import threading
+from collections import defaultdict
+from datetime import date
+
+from fx_service import FxService
+
+# 常量定義
+HSI_FIXED_AVG_COST = 169.3  # HSI 使用用戶指定的固定平均價格
+SUBSCRIPTION_ERROR_CODES = (200, 10090, 10091, 354)
+AGGREGATE_REBUILD_EVERY = 10000  # 增量加減這麼多次貢獻後從頭重建匯總，消除浮點累積誤差
+# 多賬戶合併時按金額加總的賬戶摘要字段（Cushion、Leverage 等比率不能相加）
+SUMMABLE_ACCOUNT_TAGS = (
+    'NetLiquidation', 'TotalCashValue', 'SettledCash', 'AccruedCash', 'BuyingPower',
+    'EquityWithLoanValue', 'PreviousEquityWithLoanValue', 'GrossPositionValue',
+    'InitMarginReq', 'MaintMarginReq', 'AvailableFunds', 'ExcessLiquidity'
+)
+
+
+def position_key(pos):
+    """持倉唯一鍵 - (賬戶, 合約)，合約優先使用 conId，否則使用合約描述
+
+    多個賬戶持有同一合約時是不同的持倉，不能只按合約去重。
+    """
+    con_id = pos.get('conId')
+    if con_id:
+        return (pos.get('account'), con_id)
+    return (pos.get('account'), (pos.get('symbol'), pos.get('secType'), pos.get('expiry'),
+                                 pos.get('right'), pos.get('strike')))
+
+
+def underlying_of(pos):
+    """獲取持倉的底層股票符號（與 FMP 報價的鍵一致）"""
+    if pos.get('secType') == 'OPT':
+        return pos.get('tradingClass') or pos.get('symbol')
+    return pos.get('symbol')
+
+
+class PositionIndex:
+    """持倉索引 - 按 conId（或調用方提供的鍵）、(symbol, expiry) 和底層股票預先建立"""
+
+    def __init__(self, positions=None):
+        self.by_con_id = {}
+        self.by_symbol_expiry = {}
+        self.by_expiry = {}
+        self.by_underlying = {}
+        for pos in positions or []:
+            self.add(pos)
+
+    def add(self, pos, key=None):
+        """加入一個持倉到所有索引"""
+        if key is None:
+            key = position_key(pos)
+        if key in self.by_con_id:
+            self.remove(key)
+        self.by_con_id[key] = pos
+
+        if pos.get('secType') == 'OPT':
+            expiry = pos.get('expiry')
+            self.by_symbol_expiry.setdefault((pos.get('symbol'), expiry), []).append(pos)
+            self.by_expiry.setdefault(expiry, []).append(pos)
+
+        self.by_underlying.setdefault(underlying_of(pos), []).append(pos)
+        return key
+
+    def remove(self, key):
+        """從所有索引中移除持倉"""
+        pos = self.by_con_id.pop(key, None)
+        if pos is None:
+            return None
+
+        if pos.get('secType') == 'OPT':
+            expiry = pos.get('expiry')
+            _discard(self.by_symbol_expiry, (pos.get('symbol'), expiry), pos)
+            _discard(self.by_expiry, expiry, pos)
+
+        _discard(self.by_underlying, underlying_of(pos), pos)
+        return pos
+
+    def get(self, key):
+        return self.by_con_id.get(key)
+
+    def find(self, symbol, expiry):
+        """查找某個 symbol 在指定到期日的所有持倉（包括不同行權價）"""
+        return self.by_symbol_expiry.get((symbol, expiry), [])
+
+    def __len__(self):
+        return len(self.by_con_id)
+
+
+def _discard(buckets, bucket_key, pos):
+    """從分桶索引中移除持倉，桶為空時刪除"""
+    bucket = buckets.get(bucket_key)
+    if not bucket:
+        return
+    for i, item in enumerate(bucket):
+        if item is pos:
+            del bucket[i]
+            break
+    if not bucket:
+        del buckets[bucket_key]
+
+
+def account_alias(account):
+    """多賬戶時區分賬戶的別名（只保留最後三位）"""
+    if not account or len(account) <= 3:
+        return 'DEMO'
+    return account[0] + '*' * (len(account) - 4) + account[-3:]
+
+
+def public_positions(records):
+    """保存到數據文件 / 顯示的持倉：真實賬戶號碼替換為賬戶別名
+
+    引擎內部保留真實賬戶（持倉按賬戶區分），只在離開引擎時隱藏；已經是別名的不再處理。
+    """
+    positions = []
+    for record in records:
+        account = record.get('account')
+        if account and '*' not in account and account != 'DEMO':
+            record = dict(record, account=account_alias(account))
+        positions.append(record)
+    return positions
+
+
+def option_unit_cost(pos):
+    """期權的單位平均成本：IB 的 avgCost 是每張合約的成本（已乘合約乘數），HSI 使用固定價格"""
+    if pos['symbol'] == 'HSI':
+        return HSI_FIXED_AVG_COST
+    return pos['avgCost'] / 100
+
+
+def days_until(expiry, today=None):
+    """計算到期天數"""
+    try:
+        expiry_date = date(int(expiry[:4]), int(expiry[4:6]), int(expiry[6:8]))
+        return (expiry_date - (today or date.today())).days
+    except Exception:
+        return 0
+
+
+def derive_position(pos, market_data=None, pnl_data=None, options_data=None,
+                    historical_data=None, subscription_error=False, today=None):
+    """由原始持倉和行情數據生成完整的持倉記錄（保存時由 public_positions 隱藏賬戶號碼）"""
+    position_data = pos.copy()
+
+    # 添加市場數據
+    if market_data is not None:
+        position_data['market_data'] = dict(market_data)
+        position_data['has_market_data'] = True
+    else:
+        position_data['has_market_data'] = False
+
+    # 添加PnL數據
+    if pnl_data is not None:
+        position_data['pnl_data'] = pnl_data
+        position_data['has_pnl_data'] = True
+    else:
+        position_data['has_pnl_data'] = False
+
+    # 添加期權希臘值
+    if options_data is not None:
+        position_data['options_data'] = dict(options_data)
+        position_data['has_options_data'] = True
+    else:
+        position_data['has_options_data'] = False
+
+    # 檢查是否為無法獲取數據的香港期權
+    position_data['data_unavailable'] = (
+        pos['secType'] == 'OPT' and pos['currency'] == 'HKD' and subscription_error
+    )
+
+    # 添加歷史數據
+    if historical_data is not None:
+        position_data['historical_data'] = list(historical_data)
+
+    market_data = market_data or {}
+
+    if pos['secType'] == 'OPT':
+        # 期權的市值計算，HSI特殊處理
+        avg_cost = option_unit_cost(pos)
+        position_data['avg_cost'] = avg_cost
+
+        # 對於HSI，如果只有close價格而沒有實時價格，標記為數據不可用
+        if (market_data and pos['symbol'] == 'HSI' and
+                market_data.get('bid', -1) == -1 and
+                market_data.get('ask', -1) == -1 and
+                market_data.get('last') is None):
+            position_data['data_unavailable'] = True
+
+        current_price = (market_data.get('currentPrice') or
+                         market_data.get('last') or
+                         market_data.get('close') or
+                         market_data.get('markPrice') or 0)
+        position_data['current_price'] = current_price
+
+        # 計算盈虧
+        if pos['position'] < 0:  # Short position
+            if position_data['data_unavailable']:
+                position_data['pnl'] = None
+            elif current_price > 0:
+                # 賣出期權的盈虧 = (收取的權利金 - 當前市值) * 數量
+                position_data['pnl'] = (avg_cost - current_price) * abs(pos['position']) * 100
+            else:
+                position_data['pnl'] = 0
+        else:
+            position_data['pnl'] = 0
+
+        # 如果有市場價格，使用市場價格計算市值；否則使用成本價
+        multiplier = float(position_data.get('multiplier', '100'))
+        if current_price > 0:
+            position_data['market_value'] = pos['position'] * current_price * multiplier
+        elif pos['symbol'] == 'HSI':
+            position_data['market_value'] = pos['position'] * HSI_FIXED_AVG_COST * multiplier
+        else:
+            position_data['market_value'] = pos['position'] * pos['avgCost']
+
+        expiry = pos['expiry']
+        position_data['expiry_formatted'] = f"{expiry[:4]}-{expiry[4:6]}-{expiry[6:8]}"
+        position_data['days_to_expiry'] = days_until(expiry, today)
+        position_data['strike'] = pos.get('strike', 0)
+    else:
+        # 股票的市值計算
+        current_price = (market_data.get('currentPrice') or
+                         market_data.get('last') or
+                         market_data.get('close') or 0)
+        position_data['current_price'] = current_price
+
+        if current_price > 0:
+            position_data['market_value'] = pos['position'] * current_price
+        else:
+            position_data['market_value'] = pos['position'] * pos['avgCost']
+
+    return position_data
+
+
+def calculate_option(pos, underlying_price):
+    """計算單個期權持倉的到期價值和接貨資金"""
+    strike = pos.get('strike', 0)
+    right = pos.get('right', '')
+    position = pos.get('position', 0)
+
+    pos_calc = {
+        'strike': strike,
+        'right': right,
+        'expiry': pos.get('expiry', ''),
+        'days_to_expiry': pos.get('days_to_expiry', 0),
+        'underlying_price': underlying_price
+    }
+
+    # 計算距離幅度
+    if underlying_price > 0 and strike > 0:
+        pos_calc['distance_percent'] = ((underlying_price - strike) / strike) * 100
+    else:
+        pos_calc['distance_percent'] = None
+
+    # 計算實際到期價值
+    if right == 'P' and position < 0:  # Short Put
+        avg_cost = pos.get('avg_cost', pos.get('avgCost', 0))
+        position_size = abs(position)
+
+        if underlying_price > 0 and underlying_price < strike:
+            # 會被行權，計算損失
+            loss = (strike - underlying_price - avg_cost) * position_size * 100
+            actual_expiry_value = -loss
+        else:
+            # 不會被行權或沒有底層價格（保守估計），收取權利金
+            actual_expiry_value = avg_cost * position_size * 100
+
+        pos_calc['actual_expiry_value'] = actual_expiry_value
+        # 計算接貨資金
+        pos_calc['capital_required'] = (strike - avg_cost) * position_size * 100
+    else:
+        # 其他期權類型
+        pos_calc['actual_expiry_value'] = abs(pos.get('market_value', 0))
+        pos_calc['capital_required'] = 0
+
+    return pos_calc
+
+
+def calculate_stock(pos, current_price):
+    """計算單個股票持倉的市值和盈虧"""
+    if current_price > 0:
+        market_value = pos.get('position', 0) * current_price
+        cost = pos.get('position', 0) * pos.get('avg_cost', pos.get('avgCost', 0))
+        pnl = market_value - cost
+        return {
+            'current_price': current_price,
+            'calculated_market_value': market_value,
+            'calculated_pnl': pnl,
+            'pnl_percent': (pnl / cost * 100) if cost > 0 else 0
+        }
+    return {
+        'current_price': 0,
+        'calculated_market_value': pos.get('market_value', 0),
+        'calculated_pnl': 0,
+        'pnl_percent': 0
+    }
+
+
+def calculation_row(pos, underlying_price):
+    """生成單個持倉的雲端計算行"""
+    row = {
+        'symbol': pos.get('symbol'),
+        'contract_type': pos.get('secType'),
+        'currency': pos.get('currency'),
+        'position': pos.get('position', 0),
+        'avg_cost': pos.get('avg_cost', 0),
+        'market_value': pos.get('market_value', 0),
+        'pnl': pos.get('pnl'),
+        'has_market_data': pos.get('has_market_data', False)
+    }
+    if pos.get('secType') == 'OPT':
+        row.update(calculate_option(pos, underlying_price))
+    elif pos.get('secType') == 'STK':
+        row.update(calculate_stock(pos, pos.get('current_price') or underlying_price))
+    return row
+
+
+def new_expiry_group(expiry, expiry_formatted=None, days_to_expiry=0):
+    """建立空的到期日分組"""
+    return {
+        'expiry': expiry,
+        'expiry_formatted': expiry_formatted,
+        'days_to_expiry': days_to_expiry,
+        'us_options': {
+            'count': 0,
+            'total_value': 0,
+            'total_pnl': 0,
+            'capital_required': 0
+        },
+        'hk_options': {
+            'count': 0,
+            'total_value': 0
+        }
+    }
+
+
+def convert_account_summary(account_summary, fx):
+    """將淨清算價值和可用資金換算為 USD 和 HKD"""
+    result = {
+        'net_liquidation_usd': 0,
+        'net_liquidation_hkd': 0,
+        'available_funds_usd': 0,
+        'available_funds_hkd': 0
+    }
+    for tag, field in (('NetLiquidation', 'net_liquidation'), ('AvailableFunds', 'available_funds')):
+        entry = (account_summary or {}).get(tag) or {}
+        if not entry.get('value'):
+            continue
+        currency = entry.get('currency') or 'HKD'  # 預設為 HKD
+        if currency == 'BASE':
+            currency = fx.base_currency
+        totals = fx.convert_totals({currency: float(entry['value'])})
+        result[f'{field}_usd'] = totals['USD']
+        result[f'{field}_hkd'] = totals['HKD']
+    return result
+
+
+def combine_account_summaries(entries, currency):
+    """多個賬戶的摘要換算為同一貨幣後加總
+
+    entries: [(account_summary, fx), ...]，每個賬戶使用自己的匯率
+    """
+    totals = {}
+    for account_summary, fx in entries:
+        for tag in SUMMABLE_ACCOUNT_TAGS:
+            entry = (account_summary or {}).get(tag) or {}
+            if not entry.get('value'):
+                continue
+            from_currency = entry.get('currency') or fx.base_currency
+            if from_currency == 'BASE':
+                from_currency = fx.base_currency
+            try:
+                value = fx.convert(float(entry['value']), from_currency, currency)
+            except (KeyError, ValueError):
+                continue
+            totals[tag] = totals.get(tag, 0.0) + value
+    return {tag: {'value': str(value), 'currency': currency} for tag, value in totals.items()}
+
+
+class Aggregates:
+    """匯總數據 - 每個持倉的貢獻可以加入或減去，無需重新遍歷全部持倉"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.expiries = {}  # expiry -> {'expiry_formatted', 'days_to_expiry', 'refs'}
+        self.applied = 0  # 建立以來增量加減的次數
+
+    @classmethod
+    def build(cls, items):
+        """從 (持倉, 計算行) 從頭建立匯總"""
+        aggregates = cls()
+        for pos, row in items:
+            aggregates.apply(pos, row, 1)
+        aggregates.applied = 0
+        return aggregates
+
+    def rebuild_due(self):
+        """增量加減的次數已達到 AGGREGATE_REBUILD_EVERY，應該從頭重建"""
+        return self.applied >= AGGREGATE_REBUILD_EVERY
+
+    def apply(self, pos, row, sign=1):
+        """加入（sign=1）或移除（sign=-1）一個持倉的貢獻"""
+        t = self.totals
+        self.applied += 1
+        market_value = pos.get('market_value', 0)
+        pnl = pos.get('pnl')
+
+        t['total_positions'] += sign
+        t['total_market_value'] += sign * market_value
+        t[('currency', pos.get('currency') or 'USD')] += sign * market_value
+
+        if pos.get('secType') == 'OPT':
+            t['options_count'] += sign
+            expiry = pos.get('expiry')
+            meta = self.expiries.get(expiry)
+            if meta is None:
+                meta = self.expiries[expiry] = {'refs': 0}
+            if sign > 0:
+                # 每次加入時更新：跨日後持倉逐個重新加入，refs 不會歸零，到期天數需要跟隨最新的記錄
+                meta['expiry_formatted'] = pos.get('expiry_formatted')
+                meta['days_to_expiry'] = pos.get('days_to_expiry', 0)
+            meta['refs'] += sign
+            if meta['refs'] <= 0:
+                del self.expiries[expiry]
+
+            t[('expiry', expiry, 'total_value')] += sign * market_value
+            t[('expiry', expiry, 'count')] += sign
+
+            if pos.get('currency') == 'USD':
+                t['us_total_expiry_value'] += sign * abs(market_value)
+                t['us_actual_expiry_value'] += sign * row['actual_expiry_value']
+                t['us_max_capital_required'] += sign * row['capital_required']
+                t[('expiry', expiry, 'us_count')] += sign
+                t[('expiry', expiry, 'us_total_value')] += sign * abs(market_value)
+                t[('expiry', expiry, 'us_capital_required')] += sign * row['capital_required']
+                if pnl is not None:
+                    t['us_total_pnl'] += sign * pnl
+                    t[('expiry', expiry, 'us_total_pnl')] += sign * pnl
+            elif pos.get('currency') == 'HKD':
+                t['hk_total_expiry_value'] += sign * abs(market_value)
+                t['hk_actual_expiry_value'] += sign * row['actual_expiry_value']
+                t[('expiry', expiry, 'hk_count')] += sign
+                t[('expiry', expiry, 'hk_total_value')] += sign * abs(market_value)
+
+        elif pos.get('secType') == 'STK':
+            t['stocks_count'] += sign
+            t['stocks_total_value'] += sign * row['calculated_market_value']
+            t['stocks_total_pnl'] += sign * row['calculated_pnl']
+
+    def summary(self):
+        """持倉統計（數據文件中的 summary）"""
+        t = self.totals
+        return {
+            'total_positions': int(round(t['total_positions'])),
+            'options_count': int(round(t['options_count'])),
+            'stocks_count': int(round(t['stocks_count'])),
+            'total_market_value': t['total_market_value']
+        }
+
+    def options_by_expiry(self, index):
+        """按到期日的期權價值（數據文件中的 options_by_expiry）"""
+        t = self.totals
+        groups = []
+        for expiry, meta in self.expiries.items():
+            groups.append({
+                'expiry': expiry,
+                'expiry_formatted': meta['expiry_formatted'],
+                'days_to_expiry': meta['days_to_expiry'],
+                'total_value': t[('expiry', expiry, 'total_value')],
+                'count': int(round(t[('expiry', expiry, 'count')])),
+                'positions': [p['symbol'] for p in index.by_expiry.get(expiry, [])]
+            })
+        return groups
+
+    def market_value_by_currency(self):
+        """各貨幣的持倉市值"""
+        return {key[1]: value for key, value in self.totals.items()
+                if isinstance(key, tuple) and key[0] == 'currency'}
+
+    def sections(self, rows):
+        """雲端計算結果中只取決於持倉的部分：各分類的總計和持倉列表、到期日分組"""
+        t = self.totals
+        us_rows, hk_rows, stock_rows = [], [], []
+        for row in rows:
+            if row['contract_type'] == 'OPT':
+                if row['currency'] == 'USD':
+                    us_rows.append(row)
+                elif row['currency'] == 'HKD':
+                    hk_rows.append(row)
+            elif row['contract_type'] == 'STK':
+                stock_rows.append(row)
+
+        expiry_groups = []
+        for expiry, meta in self.expiries.items():
+            group = new_expiry_group(expiry, meta['expiry_formatted'], meta['days_to_expiry'])
+            group['us_options'].update({
+                'count': int(round(t[('expiry', expiry, 'us_count')])),
+                'total_value': t[('expiry', expiry, 'us_total_value')],
+                'total_pnl': t[('expiry', expiry, 'us_total_pnl')],
+                'capital_required': t[('expiry', expiry, 'us_capital_required')]
+            })
+            group['hk_options'].update({
+                'count': int(round(t[('expiry', expiry, 'hk_count')])),
+                'total_value': t[('expiry', expiry, 'hk_total_value')]
+            })
+            expiry_groups.append(group)
+
+        return {
+            'us_options': {
+                'total_expiry_value': t['us_total_expiry_value'],
+                'actual_expiry_value': t['us_actual_expiry_value'],
+                'max_capital_required': t['us_max_capital_required'],
+                'total_pnl': t['us_total_pnl'],
+                'positions': us_rows
+            },
+            'hk_options': {
+                'total_expiry_value': t['hk_total_expiry_value'],
+                'actual_expiry_value': t['hk_actual_expiry_value'],
+                'positions': hk_rows
+            },
+            'stocks': {
+                'total_value': t['stocks_total_value'],
+                'total_pnl': t['stocks_total_pnl'],
+                'positions': stock_rows
+            },
+            'expiry_groups': expiry_groups
+        }
+
+    def calculations(self, rows, account_summary=None, fx=None, sections=None):
+        """雲端計算結果（calculate_cloud_data 的輸出格式）
+
+        sections 為 sections(rows) 的結果，持倉沒有變化時調用方可以重用；
+        賬戶摘要、匯率和匯率是否過期每次重新計算（與持倉版本無關）。
+        """
+        t = self.totals
+        fx = fx or FxService()
+        if sections is None:
+            sections = self.sections(rows)
+
+        summary = convert_account_summary(account_summary, fx)
+
+        # 所有持倉貨幣一次性換算為 USD 和 HKD
+        by_currency = self.market_value_by_currency()
+        converted = fx.convert_totals(by_currency)
+        summary['market_value_by_currency'] = by_currency
+        summary['total_market_value_usd'] = converted['USD']
+        summary['total_market_value_hkd'] = converted['HKD']
+        summary['usd_to_hkd'] = fx.rate('USD', 'HKD')
+        summary['fx_stale'] = sorted(ccy for ccy in set(by_currency) | {'USD', 'HKD'} if fx.is_stale(ccy))
+        summary['max_return_rate'] = 0
+        summary['current_return_rate'] = 0
+        actual_expiry_value = t['us_actual_expiry_value']
+        if t['us_max_capital_required'] > 0:
+            summary['max_return_rate'] = actual_expiry_value / t['us_max_capital_required'] * 100
+        if summary['net_liquidation_usd'] > 0:
+            summary['current_return_rate'] = actual_expiry_value / summary['net_liquidation_usd'] * 100
+
+        return {
+            'us_options': sections['us_options'],
+            'hk_options': sections['hk_options'],
+            'stocks': sections['stocks'],
+            'summary': summary,
+            'expiry_groups': sections['expiry_groups']
+        }
+
+
+def calculation_totals(calculations):
+    """去掉各分類的持倉列表，只保留總計、匯總和到期日分組（實時推送用）"""
+    return {
+        name: {k: v for k, v in value.items() if k != 'positions'} if isinstance(value, dict) else value
+        for name, value in calculations.items()
+    }
+
+
+class CalcEngine:
+    """增量計算引擎
+
+    IB 回調直接寫入引擎持有的輸入字典，然後調用 touch() 標記該持倉。
+    refresh() 只重新計算被標記的持倉，並通過減去舊貢獻、加入新貢獻來更新匯總，
+    同一輪中每個持倉最多計算一次。
+
+    持倉可以通過 set_position() 指定行情鍵：多個賬戶持有同一合約時共享一份行情輸入，
+    touch(行情鍵) 會標記所有共享該行情的持倉。
+    """
+
+    def __init__(self, fx=None):
+        self.fx = fx or FxService()
+
+        # 輸入數據（key 與 EnhancedIBClient.positions 的鍵一致）
+        self.positions = {}
+        self.market_data = {}
+        self.options_data = {}
+        self.pnl_data = {}
+        self.historical_data = {}
+        self.subscription_errors = set()
+        self.underlying_prices = {}
+        self.quote_keys = {}  # 持倉鍵 -> 行情鍵（未設置時兩者相同）
+        self._keys_by_quote = defaultdict(set)
+
+        # 衍生數據
+        self.records = {}
+        self.rows = {}
+        self.index = PositionIndex()
+        self.aggregates = Aggregates()
+        self._keys_by_underlying = defaultdict(set)
+
+        self.version = 0
+        self._dirty = {}  # 有序集合，新持倉按回調順序加入
+        self._today = date.today()
+        self._snapshot = None
+        self._sections = None
+        self._lock = threading.RLock()
+
+    def reset(self):
+        """清空所有輸入和衍生數據（原地清空，外部對輸入字典的引用仍然有效）"""
+        with self._lock:
+            for store in (self.positions, self.market_data, self.options_data,
+                          self.pnl_data, self.historical_data, self.subscription_errors,
+                          self.records, self.rows, self._keys_by_underlying, self._dirty,
+                          self.quote_keys, self._keys_by_quote):
+                store.clear()
+            self.index = PositionIndex()
+            self.aggregates = Aggregates()
+            self._snapshot = None
+            self.version += 1
+
+    def set_position(self, key, pos, quote_key=None):
+        """加入或替換持倉，quote_key 為該持倉讀取行情輸入的鍵"""
+        with self._lock:
+            quote_key = key if quote_key is None else quote_key
+            old_quote_key = self.quote_keys.get(key)
+            if old_quote_key is not None and old_quote_key != quote_key:
+                self._keys_by_quote[old_quote_key].discard(key)
+            self.positions[key] = pos
+            self.quote_keys[key] = quote_key
+            self._keys_by_quote[quote_key].add(key)
+            self._dirty[key] = None
+
+    def positions_for(self, quote_key):
+        """共享某個行情鍵的所有持倉"""
+        with self._lock:
+            keys = self._keys_by_quote.get(quote_key) or (quote_key,)
+            return [self.positions[key] for key in keys if key in self.positions]
+
+    def records_for(self, quote_key):
+        """共享某個行情鍵的持倉的衍生記錄（上一次 refresh 的結果）"""
+        with self._lock:
+            keys = self._keys_by_quote.get(quote_key) or (quote_key,)
+            return [self.records[key] for key in keys if key in self.records]
+
+    def touch(self, key):
+        """標記輸入已變化（價格、希臘值或持倉變動）；key 為行情鍵時標記所有共享該行情的持倉"""
+        with self._lock:
+            self._dirty.update(dict.fromkeys(self._keys_by_quote.get(key) or (key,)))
+
+    def touch_many(self, keys):
+        """批量標記多個行情鍵（tick 批量應用時每批只加鎖一次）"""
+        with self._lock:
+            for key in keys:
+                self._dirty.update(dict.fromkeys(self._keys_by_quote.get(key) or (key,)))
+
+    def mark_subscription_error(self, key):
+        """記錄行情鍵的市場數據訂閱錯誤"""
+        with self._lock:
+            self.subscription_errors.add(key)
+            self._dirty.update(dict.fromkeys(self._keys_by_quote.get(key) or (key,)))
+
+    def set_underlying_prices(self, prices):
+        """更新底層股票價格，只標記價格有變化的底層股票的持倉"""
+        with self._lock:
+            for underlying, quote in (prices or {}).items():
+                old = self.underlying_prices.get(underlying)
+                self.underlying_prices[underlying] = quote
+                if old is not None and old.get('price') == quote.get('price'):
+                    continue
+                self._dirty.update(dict.fromkeys(self._keys_by_underlying.get(underlying, ())))
+
+    def refresh(self):
+        """重新計算所有被標記的持倉，返回本輪重新計算的數量"""
+        with self._lock:
+            today = date.today()
+            if today != self._today:
+                # 跨日後到期天數全部變化
+                self._today = today
+                self._dirty.update(dict.fromkeys(self.positions))
+                self._dirty.update(dict.fromkeys(self.records))
+
+            dirty, self._dirty = self._dirty, {}
+            for key in dirty:
+                self._recompute(key)
+            if self.aggregates.rebuild_due():
+                self.aggregates = Aggregates.build((self.records[key], self.rows[key]) for key in self.records)
+
+            if dirty:
+                self.version += 1
+                self._snapshot = None
+            return len(dirty)
+
+    def _recompute(self, key):
+        old_record = self.records.get(key)
+        if old_record is not None:
+            self.aggregates.apply(old_record, self.rows[key], -1)
+            self.index.remove(key)
+            self._keys_by_underlying[underlying_of(old_record)].discard(key)
+
+        pos = self.positions.get(key)
+        if pos is None:
+            if old_record is not None:
+                del self.records[key]
+                del self.rows[key]
+            return
+
+        quote_key = self.quote_keys.get(key, key)
+        record = derive_position(
+            pos,
+            market_data=self.market_data.get(quote_key),
+            pnl_data=self.pnl_data.get(quote_key),
+            options_data=self.options_data.get(quote_key),
+            historical_data=self.historical_data.get(quote_key),
+            subscription_error=quote_key in self.subscription_errors,
+            today=self._today
+        )
+        underlying = underlying_of(record)
+        quote = self.underlying_prices.get(underlying) or {}
+        row = calculation_row(record, quote.get('price') or 0)
+
+        self.records[key] = record
+        self.rows[key] = row
+        self.index.add(record, key)
+        self._keys_by_underlying[underlying].add(key)
+        self.aggregates.apply(record, row, 1)
+
+    def snapshot(self, account_summary=None):
+        """返回最新的衍生快照（服務器、雲端上傳和儀表板共用）
+
+        持倉記錄是共享對象，調用方不應修改。
+        """
+        with self._lock:
+            self.refresh()
+            if self._snapshot is None:
+                self._snapshot = {
+                    'version': self.version,
+                    'positions': list(self.records.values()),
+                    'summary': self.aggregates.summary(),
+                    'options_by_expiry': self.aggregates.options_by_expiry(self.index)
+                }
+                self._sections = self.aggregates.sections(self.rows.values())
+            snapshot = dict(self._snapshot)
+            # 持倉部分按版本緩存，只有賬戶摘要和匯率部分每次重新計算
+            snapshot['calculations'] = self.aggregates.calculations(
+                self.rows.values(), account_summary, self.fx, self._sections
+            )
+            return snapshot
+
+
+def _aggregate(portfolio_data):
+    """單次遍歷數據文件中的持倉，返回 (持倉索引, 匯總, 計算行)"""
+    underlying_prices = portfolio_data.get('underlying_prices') or {}
+    index = PositionIndex()
+    aggregates = Aggregates()
+    rows = {}
+
+    for pos in portfolio_data.get('positions', []):
+        key = position_key(pos)
+        if key in rows:
+            aggregates.apply(index.get(key), rows[key], -1)
+        index.add(pos, key)
+        quote = underlying_prices.get(underlying_of(pos)) or {}
+        rows[key] = calculation_row(pos, pos.get('underlying_price') or quote.get('price') or 0)
+        aggregates.apply(pos, rows[key], 1)
+    return index, aggregates, rows
+
+
+def calculate_cloud_data(portfolio_data, fx=None, recompute=False):
+    """計算所有需要上傳到雲端的數據
+
+    數據文件已包含 CalcEngine 生成的 calculations 時直接使用（recompute=True 時忽略）；
+    否則建立持倉索引後單次遍歷計算，計算量與持倉數量成線性關係。
+    """
+    if portfolio_data.get('calculations') and not recompute:
+        return portfolio_data['calculations']
+
+    _, aggregates, rows = _aggregate(portfolio_data)
+    fx = fx or FxService.from_dict(portfolio_data.get('fx_rates'))
+    return aggregates.calculations(rows.values(), portfolio_data.get('account_summary'), fx)
+
+
+def document_summary(summary, account_summary):
+    """數據文件中的 summary：持倉統計加上關鍵賬戶數據（兼容前端）"""
+    summary = dict(summary)
+    for tag in ('NetLiquidation', 'AvailableFunds'):
+        if tag in (account_summary or {}):
+            summary[tag] = account_summary[tag].get('value')
+            summary[f'{tag}Currency'] = account_summary[tag].get('currency')
+    return summary
+
+
+def derived_fields(portfolio_data, fx=None):
+    """由持倉重新計算數據文件中的衍生字段（summary、options_by_expiry、calculations）
+
+    差量上傳不包含這些字段，接收端應用差量後用此函數重新生成，計算量與持倉數量成線性關係。
+    """
+    index, aggregates, rows = _aggregate(portfolio_data)
+    account_summary = portfolio_data.get('account_summary')
+    fx = fx or FxService.from_dict(portfolio_data.get('fx_rates'))
+    return {
+        'summary': document_summary(aggregates.summary(), account_summary),
+        'options_by_expiry': aggregates.options_by_expiry(index),
+        'calculations': aggregates.calculations(rows.values(), account_summary, fx)
+    }
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Cloud Sync
+雲端自動同步 - 快照保存後在後台上傳到 Railway
+
+- 防抖：連續保存只上傳最後一個快照
+- 內容哈希未變化時跳過上傳（時間戳等每次保存都會變的字段不計入）
+- 快照先寫入持久化發件箱（upload_outbox），雲端不可用時不會丟失
+- 失敗時按 cloud_config.json 的 retry_count / timeout 指數退避重試
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SYNC_CONFIG_FILE = 'cloud_config.json'
+DEFAULT_RETRY_COUNT = 3
+DEFAULT_TIMEOUT = 30
+DEBOUNCE_SECONDS = 2.0
+MAX_DEBOUNCE_SECONDS = 10.0  # 持續保存時最多延遲多久
+BACKOFF_BASE_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 300.0  # 超過 retry_count 次後的重試間隔
+IDLE_WAIT_SECONDS = 60.0
+
+# 每次保存都會變化、不代表內容變化的字段
+VOLATILE_KEYS = ('timestamp', 'last_update', 'snapshot_version', 'underlying_prices_update', 'fx_rates')
+
+
+def load_sync_settings(config_file=SYNC_CONFIG_FILE):
+    """讀取 cloud_config.json 中的重試次數和超時"""
+    settings = {'retry_count': DEFAULT_RETRY_COUNT, 'timeout': DEFAULT_TIMEOUT}
+    path = Path(config_file)
+    if path.exists():
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            for key in settings:
+                if key in saved:
+                    settings[key] = int(saved[key])
+        except Exception as e:
+            logger.error(f"載入同步配置失敗: {e}")
+    return settings
+
+
+def content_hash(portfolio_data):
+    """快照內容哈希（忽略時間戳等易變字段，匯率只取匯率值）"""
+    content = {k: v for k, v in portfolio_data.items() if k not in VOLATILE_KEYS}
+    rates = (portfolio_data.get('fx_rates') or {}).get('rates') or {}
+    content['fx_rates'] = {ccy: entry.get('rate') for ccy, entry in rates.items()}
+    encoded = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class CloudSyncWorker:
+    """後台雲端同步線程，註冊為 SnapshotStore 的監聽器
+
+    防抖後的快照先寫入持久化發件箱（UploadOutbox），再由同一線程發送；
+    發送失敗時快照保留在發件箱中，按退避時間重試，重啟後繼續。
+    """
+
+    def __init__(self, uploader, outbox, retry_count=DEFAULT_RETRY_COUNT, timeout=DEFAULT_TIMEOUT,
+                 debounce=DEBOUNCE_SECONDS, max_debounce=MAX_DEBOUNCE_SECONDS):
+        self.uploader = uploader
+        self.outbox = outbox
+        self.retry_count = retry_count
+        self.timeout = timeout
+        self.debounce = debounce
+        self.max_debounce = max_debounce
+
+        self._pending = None  # (portfolio_data, version)
+        self._first_pending_at = None
+        self._last_notify_at = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {
+            'uploads': 0,
+            'skipped_unchanged': 0,
+            'coalesced': 0,  # 防抖合併和發件箱替換的快照數（只在這裡計數）
+            'failures': 0,
+            'last_sync': None,
+            'last_version': None,
+            'last_result': None
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='cloud-sync')
+        self._thread.start()
+        logger.info("Cloud sync worker started")
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def notify(self, portfolio_data, version):
+        """SnapshotStore 監聽器：記錄最新快照，由後台線程防抖後放入發件箱"""
+        now = time.monotonic()
+        with self._condition:
+            if self._pending is not None:
+                self.stats['coalesced'] += 1
+            else:
+                self._first_pending_at = now
+            self._pending = (portfolio_data, version)
+            self._last_notify_at = now
+            self._condition.notify()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                wait = self._step()
+            except Exception as e:
+                logger.error(f"Cloud sync error: {e}")
+                wait = BACKOFF_BASE_SECONDS
+            if wait > 0:
+                with self._condition:
+                    if not self._stop.is_set():
+                        self._condition.wait(wait)
+
+    def _step(self):
+        """處理一次：防抖完成的快照入隊，到期的發件箱快照發送；返回下次需要等待的秒數"""
+        waits = [IDLE_WAIT_SECONDS]
+
+        with self._condition:
+            pending = None
+            if self._pending is not None:
+                ready_at = min(self._last_notify_at + self.debounce,
+                               self._first_pending_at + self.max_debounce)
+                remaining = ready_at - time.monotonic()
+                if remaining <= 0:
+                    pending, self._pending = self._pending, None
+                else:
+                    waits.append(remaining)
+
+        enabled = not self.uploader.validate_config()
+        if pending is not None and enabled:
+            self._enqueue(*pending)
+
+        entry = self.outbox.next_entry()
+        if entry is None or not enabled:
+            return min(waits)
+        retry_in = entry['next_attempt_at'] - time.time()
+        if retry_in > 0:
+            waits.append(retry_in)
+            return min(waits)
+
+        self._send(entry)
+        return 0
+
+    def _enqueue(self, portfolio_data, version):
+        digest = content_hash(portfolio_data)
+        newest = self.outbox.next_entry()
+        last_hash = newest['content_hash'] if newest else self.outbox.last_sent_hash()
+        if digest == last_hash:
+            self.stats['skipped_unchanged'] += 1
+            logger.info(f"Cloud sync skipped: snapshot {version} unchanged")
+            return
+        self.stats['coalesced'] += self.outbox.enqueue(portfolio_data, version, digest)
+
+    def _send(self, entry):
+        result = self.uploader.upload(self.outbox.load_payload(entry), timeout=self.timeout)
+        self.stats['last_result'] = result
+        if result['success']:
+            self.outbox.mark_sent(entry)
+            self.stats['uploads'] += 1
+            self.stats['last_sync'] = datetime.now().isoformat()
+            self.stats['last_version'] = entry['snapshot_version']
+            return
+
+        self.stats['failures'] += 1
+        attempts = entry['attempts'] + 1
+        # 前 retry_count 次按指數退避，之後每 MAX_BACKOFF_SECONDS 重試一次
+        if attempts <= self.retry_count:
+            delay = BACKOFF_BASE_SECONDS * (2 ** (attempts - 1))
+        else:
+            delay = MAX_BACKOFF_SECONDS
+        self.outbox.mark_failed(entry, result.get('message'), delay)
+        logger.warning(f"Cloud sync attempt {attempts} failed, retrying in {delay:.0f}s")
+
+    def status(self):
+        with self._condition:
+            pending = self._pending is not None
+        return dict(self.stats, pending=pending, outbox=self.outbox.status(),
+                    running=bool(self._thread and self._thread.is_alive()))
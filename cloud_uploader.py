@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Cloud Uploader
+雲端上傳服務 - 在應用進程內上傳快照到 Railway
+
+使用共享的 HttpClient（連接池和 keep-alive），
+直接上傳內存中的快照，返回結構化結果，不再啟動子進程和解析輸出。
+服務器確認過版本後只上傳相對於該版本的差量（見 portfolio_delta），
+並按服務器公佈的格式壓縮（見 upload_codec）。
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+import portfolio_delta
+import upload_codec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+# 傳輸格式偏好（只使用服務器公佈支持、且本地已安裝的格式）
+DEFAULT_ENCODINGS = ['zstd', 'gzip']
+DEFAULT_CONTENT_TYPES = [upload_codec.JSON_TYPE]
+
+
+class CloudUploader:
+    """雲端上傳服務"""
+
+    def __init__(self, config, http):
+        self.config = config  # cloud_upload_config.json 的內容（共享同一個字典）
+        self.http = http  # 共享的 HttpClient
+        self.last_result = None
+        self.acked = None  # 服務器最後確認的 {'version', 'document'}
+        self.server_formats = None  # 服務器公佈的 {'encodings', 'content_types'}
+        # 後台同步線程和手動上傳路由共用一個上傳器：上傳串行進行，差量總是基於最新確認的版本
+        self._lock = threading.Lock()
+
+    def validate_config(self):
+        """檢查配置，返回錯誤信息或 None"""
+        if not self.config or not self.config.get('enabled'):
+            return '雲端上傳未啟用'
+        for field in ('api_url', 'api_key', 'account_number'):
+            if not self.config.get(field):
+                return f'雲端配置缺失: {field}'
+        return None
+
+    def upload(self, portfolio_data, additional_summary=None, timeout=None):
+        """上傳一個快照，返回結構化結果
+
+        服務器已確認過某個版本時只上傳差量；服務器版本不一致或不支持差量時改為完整上傳。
+        同時只進行一次上傳，其他調用等待前一次完成。
+        """
+        with self._lock:
+            return self._upload(portfolio_data, additional_summary, timeout)
+
+    def _upload(self, portfolio_data, additional_summary, timeout):
+        error = self.validate_config()
+        if error:
+            return self._finish({'success': False, 'message': error})
+        if not portfolio_data:
+            return self._finish({'success': False, 'message': '找不到本地數據'})
+
+        acked = self.acked
+        if acked and self.config.get('delta_upload', True) and not additional_summary:
+            delta = portfolio_delta.build_delta(acked['document'], portfolio_data, acked['version'])
+            if portfolio_delta.is_empty(delta):
+                return self._finish({
+                    'success': True,
+                    'mode': 'unchanged',
+                    'message': '數據沒有變化，無需上傳',
+                    'bytes_sent': 0,
+                    'server_version': acked['version']
+                })
+            result = self._post({'account': self.config['account_number'], 'delta': delta},
+                                portfolio_data, 'delta', timeout)
+            if result['success'] or 'status_code' not in result:
+                return self._finish(result)
+            logger.warning(f"差量上傳被拒絕 ({result['status_code']})，改為完整上傳")
+            self.acked = None
+
+        upload_payload = {'account': self.config['account_number'], 'portfolio_data': portfolio_data}
+        if additional_summary:
+            upload_payload['additional_summary'] = additional_summary
+        return self._finish(self._post(upload_payload, portfolio_data, 'full', timeout))
+
+    def transport_format(self):
+        """協商後的 (Content-Encoding, Content-Type)"""
+        return upload_codec.negotiate(
+            self.config.get('encodings', DEFAULT_ENCODINGS),
+            self.config.get('content_types', DEFAULT_CONTENT_TYPES),
+            self.server_formats
+        )
+
+    def _post(self, payload, portfolio_data, mode, timeout):
+        """發送一次上傳請求，成功時記錄服務器確認的版本"""
+        encoding, content_type = self.transport_format()
+        body, headers = upload_codec.encode(payload, encoding, content_type)
+        headers['Authorization'] = f'Bearer {self.config["api_key"]}'
+
+        positions_count = len(portfolio_data.get('positions', []))
+        expiry_groups = (portfolio_data.get('calculations') or {}).get('expiry_groups', [])
+        logger.info(f"正在上傳{'差量' if mode == 'delta' else '完整'}數據到雲端: {self.config['api_url']}")
+        logger.info(f"上傳數據包含: {positions_count} 個持倉，{len(expiry_groups)} 個到期組，"
+                    f"{len(body)} bytes ({content_type}, {encoding})")
+
+        start = time.perf_counter()
+        try:
+            response = self.http.post(
+                self.config['api_url'],
+                data=body,
+                headers=headers,
+                timeout=timeout or self.config.get('timeout', DEFAULT_TIMEOUT)
+            )
+        except requests.RequestException as e:
+            logger.error(f"雲端上傳異常: {e}")
+            return {
+                'success': False,
+                'mode': mode,
+                'format': f'{content_type}+{encoding}',
+                'message': f'上傳異常: {e}',
+                'bytes_sent': len(body),
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)
+            }
+
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        if self.config.get('debug'):
+            logger.info(f"Railway upload response: {response.status_code} {response.text[:500]}")
+
+        result = {
+            'status_code': response.status_code,
+            'mode': mode,
+            'format': f'{content_type}+{encoding}',
+            'bytes_sent': len(body),
+            'elapsed_ms': elapsed_ms,
+            'positions_count': positions_count,
+            'snapshot_version': portfolio_data.get('snapshot_version')
+        }
+        if response.status_code == 200:
+            try:
+                server = response.json()
+            except ValueError:
+                server = {}
+            result.update({
+                'success': True,
+                'message': f'成功上傳 {positions_count} 個持倉到雲端',
+                'server_positions_count': server.get('positions_count'),
+                'server_version': server.get('version'),
+                'server_write_ms': server.get('write_ms'),
+                'server_timestamp': server.get('timestamp')
+            })
+            self.server_formats = server.get('accept') or self.server_formats
+            # 舊版服務器不返回版本號，此時下次仍然完整上傳
+            self.acked = {'version': server['version'], 'document': portfolio_data} if server.get('version') else None
+            logger.info(f"雲端上傳成功: {positions_count} 個持倉 ({mode}, {len(body)} bytes, {elapsed_ms} ms)")
+        else:
+            error_msg = f"HTTP {response.status_code}"
+            try:
+                error_msg += f": {response.json().get('error', response.text)}"
+            except ValueError:
+                error_msg += f": {response.text[:200]}"
+            logger.error(f"雲端上傳失敗: {error_msg}")
+            if response.status_code == 415:
+                self.server_formats = None  # 服務器不再支持協商的格式，下次使用未壓縮 JSON
+            result.update({'success': False, 'message': f'上傳失敗: {error_msg}'})
+        return result
+
+    def _finish(self, result):
+        result['timestamp'] = datetime.now().isoformat()
+        self.last_result = result
+        return result
@@ -0,0 +1,41 @@
+"""
+pytest fixtures：假 FMP 報價服務器和儀表板資源
+"""
+
+import pytest
+
+from testing_helpers import DASHBOARD_SOURCES, FakeFmp, load_dashboard, local_server
+
+
+@pytest.fixture(scope='session')
+def fmp_server():
+    with local_server(FakeFmp) as server:
+        yield server
+
+
+@pytest.fixture
+def base_url(fmp_server):
+    """假 FMP 報價接口的 URL，每個測試開始時清空請求記錄"""
+    FakeFmp.reset()
+    return FakeFmp.quote_url(fmp_server)
+
+
+@pytest.fixture(scope='module', params=DASHBOARD_SOURCES)
+def loaded_dashboard(request):
+    """每個儀表板源文件的 (dashboard, 原始文件大小, 外殼內容)"""
+    return load_dashboard(request.param)
+
+
+@pytest.fixture
+def dashboard(loaded_dashboard):
+    return loaded_dashboard[0]
+
+
+@pytest.fixture
+def original_size(loaded_dashboard):
+    return loaded_dashboard[1]
+
+
+@pytest.fixture
+def shell_body(loaded_dashboard):
+    return loaded_dashboard[2]
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Dashboard Assets
+儀表板靜態資源 - 把單文件儀表板拆分為外殼 HTML 和帶哈希的 JS / CSS
+
+- 內聯的 <style> 和 <script> 提取為 dashboard.<哈希>.css / .js，精簡後預先壓縮（gzip，安裝了 brotli 時另有 br）
+- 資源文件名包含內容哈希，以 immutable 長緩存發送；外殼 HTML 很小，每次重新驗證（ETag）
+- 外部字體樣式表改為非阻塞加載，JS 使用 defer，首次渲染只需要外殼和 CSS
+- 源文件修改時間變化時自動重新構建（本地開發修改 HTML 後刷新即可）
+- 外殼可內嵌當前快照的初始狀態（<script type="application/json">），首次渲染不需要再請求數據；
+  每個數據版本渲染並壓縮一次，按版本緩存
+
+精簡只刪除註釋和多餘空白，保留換行（不依賴分號自動插入規則），不改寫代碼。
+
+用法: python dashboard_assets.py [源文件] [--out 輸出目錄]  # 輸出靜態文件並顯示大小
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_PREFIX = '/assets/'
+HASH_LENGTH = 12
+GZIP_LEVEL = 9  # 構建時壓縮一次，使用最高壓縮率
+BROTLI_QUALITY = 11
+STATE_GZIP_LEVEL = 6  # 內嵌狀態的外殼每個數據版本壓縮一次，使用較快的級別
+STATE_BROTLI_QUALITY = 5
+STATE_CACHE_SIZE = 8  # 緩存最近幾個（數據版本, 賬戶）的外殼
+STATE_ELEMENT_ID = 'initial-state'
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SHELL_CACHE_CONTROL = 'no-cache'
+
+CONTENT_TYPES = {
+    '.js': 'application/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.html': 'text/html; charset=utf-8'
+}
+
+STYLE_PATTERN = re.compile(r'<style>(.*?)</style>\s*', re.S)
+SCRIPT_PATTERN = re.compile(r'<script>(.*?)</script>\s*', re.S)
+EXTERNAL_STYLESHEET = re.compile(r'<link href="(https?://[^"]+)" rel="stylesheet">')
+HTML_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.S)
+
+# 儀表板不使用的字段（發布數據文件和內嵌初始狀態時省略）
+DASHBOARD_UNUSED_KEYS = ('errors', 'account_pnl', 'snapshot_version', 'source', 'upload_source')
+DASHBOARD_UNUSED_POSITION_KEYS = ('historical_data',)
+SUMMARY_KEYS = ('calculations', 'expiry_timeline', 'margin')
+
+# 這些字符或關鍵字之後的 / 是正則表達式的開始，而不是除號
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete',
+                  'void', 'throw', 'instanceof', 'yield', 'await')
+
+
+def minify_css(css):
+    """刪除註釋和多餘空白（字符串原樣保留）"""
+    out = []
+    i, n = 0, len(css)
+    while i < n:
+        c = css[i]
+        if c in '"\'':
+            end = i + 1
+            while end < n and css[end] != c:
+                end += 2 if css[end] == '\\' else 1
+            out.append(css[i:end + 1])
+            i = end + 1
+        elif css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif c.isspace():
+            while i < n and css[i].isspace():
+                i += 1
+            out.append(' ')
+        else:
+            out.append(c)
+            i += 1
+    text = ''.join(out)
+    text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+    text = re.sub(r': ', ':', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """刪除註釋、行首縮進、行尾空白和空行
+
+    字符串、模板字符串（包括嵌套的 ${...}）和正則表達式原樣保留。
+    """
+    out = []
+    braces = []  # 每個未關閉的 ${ 內部的 { 深度
+    i, n = 0, len(js)
+    line_start = True
+
+    def last_significant():
+        for chunk in reversed(out):
+            stripped = chunk.rstrip()
+            if stripped:
+                return stripped
+        return ''
+
+    def regex_allowed():
+        previous = last_significant()
+        if not previous:
+            return True
+        if previous[-1] in REGEX_PRECEDERS:
+            return True
+        word = re.search(r'[A-Za-z_$][\w$]*$', previous)
+        return bool(word) and word.group(0) in REGEX_KEYWORDS
+
+    def skip_template(start):
+        """從 ` 之後開始，返回模板結束（`）或 ${ 之後的位置，以及是否進入了 ${"""
+        j = start
+        while j < n:
+            if js[j] == '\\':
+                j += 2
+            elif js[j] == '`':
+                return j + 1, False
+            elif js.startswith('${', j):
+                return j + 2, True
+            else:
+                j += 1
+        return n, False
+
+    while i < n:
+        c = js[i]
+        if c == '\n':
+            # 行尾空白和空行
+            while out and out[-1] in (' ', '\t'):
+                out.pop()
+            if out and out[-1] != '\n':
+                out.append('\n')
+            line_start = True
+            i += 1
+            continue
+        if c in ' \t\r':
+            if not line_start and out and out[-1] not in (' ', '\n'):
+                out.append(' ')
+            i += 1
+            continue
+        line_start = False
+
+        if c in '"\'':
+            end = i + 1
+            while end < n and js[end] != c and js[end] != '\n':
+                end += 2 if js[end] == '\\' else 1
+            out.append(js[i:end + 1])
+            i = end + 1
+        elif c == '`':
+            end, opened = skip_template(i + 1)
+            out.append(js[i:end])
+            if opened:
+                braces.append(0)
+            i = end
+        elif c == '}' and braces and braces[-1] == 0:
+            # ${...} 結束，繼續模板字符串
+            braces.pop()
+            end, opened = skip_template(i + 1)
+            out.append(js[i:end])
+            if opened:
+                braces.append(0)
+            i = end
+        elif c in '{}':
+            if braces:
+                braces[-1] += 1 if c == '{' else -1
+            out.append(c)
+            i += 1
+        elif js.startswith('//', i):
+            end = js.find('\n', i)
+            i = n if end < 0 else end
+        elif js.startswith('/*', i):
+            end = js.find('*/', i + 2)
+            comment = js[i:n if end < 0 else end + 2]
+            i = n if end < 0 else end + 2
+            out.append('\n' if '\n' in comment else ' ')
+        elif c == '/' and regex_allowed():
+            end, in_class = i + 1, False
+            while end < n and js[end] != '\n':
+                if js[end] == '\\':
+                    end += 2
+                    continue
+                if js[end] == '[':
+                    in_class = True
+                elif js[end] == ']':
+                    in_class = False
+                elif js[end] == '/' and not in_class:
+                    break
+                end += 1
+            end += 1
+            while end < n and (js[end].isalpha()):
+                end += 1  # 標誌
+            out.append(js[i:end])
+            i = end
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def minify_html(html):
+    """刪除註釋和縮進（保留一個空白字符，渲染結果不變）"""
+    html = HTML_COMMENT.sub('', html)
+    return re.sub(r'\n\s+', '\n', html).strip() + '\n'
+
+
+def visible_fields(portfolio_data):
+    """只保留儀表板使用的字段"""
+    data = {k: v for k, v in portfolio_data.items() if k not in DASHBOARD_UNUSED_KEYS}
+    data['positions'] = [
+        {k: v for k, v in pos.items() if k not in DASHBOARD_UNUSED_POSITION_KEYS}
+        for pos in portfolio_data.get('positions', [])
+    ]
+    return data
+
+
+def initial_state(portfolio_data, summary=None, status=None, account=None):
+    """頁面內嵌的初始狀態：持倉（可見字段）、服務器計算的匯總和連接狀態"""
+    return {
+        'account': account,
+        'portfolio': visible_fields(portfolio_data),
+        'summary': {k: summary[k] for k in SUMMARY_KEYS if k in summary} if summary else None,
+        'status': status
+    }
+
+
+def state_script(state):
+    """把狀態編碼為不執行的 JSON 腳本塊（轉義 </ 和 <!--，內容不會提前結束腳本）"""
+    body = json.dumps(state, ensure_ascii=False, separators=(',', ':'), default=str)
+    body = body.replace('</', '<\\/').replace('<!--', '<\\u0021--')
+    return f'<script id="{STATE_ELEMENT_ID}" type="application/json">{body}</script>\n'
+
+
+class Asset:
+    """一個構建好的資源及其預壓縮版本"""
+
+    def __init__(self, name, body, cache_control, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+        self.name = name
+        self.body = body
+        self.content_type = CONTENT_TYPES[Path(name).suffix]
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:HASH_LENGTH] + '"'
+        self.encoded = {'gzip': gzip.compress(body, compresslevel=gzip_level, mtime=0)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(body, quality=brotli_quality)
+
+    def sizes(self):
+        return dict({'identity': len(self.body)}, **{k: len(v) for k, v in self.encoded.items()})
+
+
+def build(html):
+    """把儀表板 HTML 拆分為外殼和資源，返回 (外殼 Asset, {資源名: Asset})"""
+    css = minify_css('\n'.join(STYLE_PATTERN.findall(html))).encode('utf-8')
+    js = minify_js('\n;\n'.join(SCRIPT_PATTERN.findall(html))).encode('utf-8')
+    assets = {}
+    for stem, suffix, body in (('dashboard', '.css', css), ('dashboard', '.js', js)):
+        digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        name = f'{stem}.{digest}{suffix}'
+        assets[name] = Asset(name, body, IMMUTABLE_CACHE_CONTROL)
+    css_name, js_name = list(assets)
+
+    shell = STYLE_PATTERN.sub('', html)
+    shell = SCRIPT_PATTERN.sub('', shell)
+    # 外部字體 / 圖標樣式表不阻塞首次渲染
+    shell = EXTERNAL_STYLESHEET.sub(
+        lambda m: (f'<link href="{m.group(1)}" rel="stylesheet" media="print" onload="this.media=\'all\'">'
+                   f'<noscript><link href="{m.group(1)}" rel="stylesheet"></noscript>'),
+        shell
+    )
+    shell = shell.replace('</head>', (
+        f'<link rel="stylesheet" href="{ASSET_PREFIX}{css_name}">\n'
+        f'<script defer src="{ASSET_PREFIX}{js_name}"></script>\n'
+        '</head>'
+    ), 1)
+    shell = minify_html(shell).encode('utf-8')
+    return Asset('index.html', shell, SHELL_CACHE_CONTROL), assets
+
+
+def accepted_encodings(accept_encoding):
+    """Accept-Encoding 中可接受的編碼（忽略 q=0）"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        if token and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            accepted.add(token.lower())
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(',')]
+    return '*' in candidates or any(c.removeprefix('W/') == etag for c in candidates)
+
+
+def respond(asset, accept_encoding=None, if_none_match=None):
+    """返回 (狀態碼, 響應頭, 響應體)，按 Accept-Encoding 選擇預壓縮版本"""
+    headers = {
+        'Content-Type': asset.content_type,
+        'Cache-Control': asset.cache_control,
+        'ETag': asset.etag,
+        'Vary': 'Accept-Encoding'
+    }
+    if etag_matches(if_none_match, asset.etag):
+        return 304, headers, b''
+    body = asset.body
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ('br', 'gzip'):
+        if encoding in accepted and encoding in asset.encoded:
+            body = asset.encoded[encoding]
+            headers['Content-Encoding'] = encoding
+            break
+    headers['Content-Length'] = str(len(body))
+    return 200, headers, body
+
+
+class DashboardAssets:
+    """按源文件構建並緩存外殼和資源"""
+
+    def __init__(self, source):
+        self.source = Path(source)
+        self.shell_asset = None
+        self.assets = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._with_state = OrderedDict()  # (外殼 ETag, 狀態標記) -> 內嵌狀態的外殼
+
+    def _current(self):
+        mtime = self.source.stat().st_mtime
+        with self._lock:
+            if mtime != self._mtime:
+                shell, assets = build(self.source.read_text(encoding='utf-8'))
+                # 保留舊資源：已加載舊外殼的頁面仍能取到對應的 JS / CSS
+                self.assets = dict(self.assets, **assets)
+                self.shell_asset = shell
+                self._mtime = mtime
+                logger.info(f"Dashboard assets built from {self.source}: "
+                            f"{', '.join(f'{name} {a.sizes()}' for name, a in assets.items())}")
+            return self.shell_asset
+
+    def shell(self, accept_encoding=None, if_none_match=None, state=None, state_tag=None):
+        """外殼響應；提供 state 時內嵌初始狀態
+
+        state 可以是狀態字典或返回狀態的函數（只在緩存未命中時調用，返回 None 時不內嵌），
+        state_tag 標識狀態的版本（如數據版本 + 賬戶），相同標記的外殼只渲染一次。
+        """
+        shell = self._current()
+        if state is None:
+            return respond(shell, accept_encoding, if_none_match)
+        return respond(self._shell_with_state(shell, state, state_tag), accept_encoding, if_none_match)
+
+    def _shell_with_state(self, shell, state, state_tag):
+        key = (shell.etag, state_tag)
+        with self._lock:
+            cached = self._with_state.get(key) if state_tag is not None else None
+            if cached is not None:
+                self._with_state.move_to_end(key)
+                return cached
+
+        if callable(state):
+            state = state()
+        if state is None:
+            return shell
+        html = shell.body.decode('utf-8').replace('</head>', state_script(state) + '</head>', 1)
+        rendered = Asset('index.html', html.encode('utf-8'), SHELL_CACHE_CONTROL,
+                         gzip_level=STATE_GZIP_LEVEL, brotli_quality=STATE_BROTLI_QUALITY)
+        if state_tag is not None:
+            with self._lock:
+                self._with_state[key] = rendered
+                while len(self._with_state) > STATE_CACHE_SIZE:
+                    self._with_state.popitem(last=False)
+        return rendered
+
+    def asset(self, name, accept_encoding=None, if_none_match=None):
+        """資源響應，名稱不存在時返回 None"""
+        self._current()
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        return respond(asset, accept_encoding, if_none_match)
+
+
+def write(source, out_dir):
+    """把構建結果寫入目錄（供靜態託管使用），返回 [(文件名, 各編碼大小)]"""
+    shell, assets = build(Path(source).read_text(encoding='utf-8'))
+    out = Path(out_dir)
+    (out / ASSET_PREFIX.strip('/')).mkdir(parents=True, exist_ok=True)
+    results = []
+    for asset, path in [(shell, out / 'index.html')] + [
+            (a, out / ASSET_PREFIX.strip('/') / name) for name, a in assets.items()]:
+        path.write_bytes(asset.body)
+        for encoding, body in asset.encoded.items():
+            path.with_name(path.name + ('.gz' if encoding == 'gzip' else '.br')).write_bytes(body)
+        results.append((asset.name, asset.sizes()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='構建儀表板靜態資源')
+    parser.add_argument('source', nargs='?', default='static/dashboard_new.html')
+    parser.add_argument('--out', default='static/build')
+    args = parser.parse_args()
+
+    original = Path(args.source).read_bytes()
+    print("=" * 72)
+    print(f"儀表板資源構建 - {args.source} ({len(original):,} bytes, "
+          f"gzip {len(gzip.compress(original, GZIP_LEVEL)):,} bytes)")
+    print("=" * 72)
+    print(f"{'文件':<32} {'原始':>10} {'gzip':>10} {'br':>10}")
+    for name, sizes in write(args.source, args.out):
+        br = f"{sizes['br']:,}" if 'br' in sizes else '-'
+        print(f"{name:<32} {sizes['identity']:>10,} {sizes['gzip']:>10,} {br:>10}")
+    if brotli is None:
+        print("-" * 72)
+        print("未安裝 brotli，只生成 gzip 版本")
+    print(f"輸出目錄: {args.out}")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Expiry Timeline
+到期日曆和轉倉計劃 - 每個快照預先計算一次的接貨風險時間線
+
+輸出為按日期對齊的數組（列式結構），儀表板可以直接繪圖，無需遍歷持倉：
+- assignment_capital: 當天到期的賣出 Put 的接貨資金（行權價 × 數量 × 乘數）
+- itm_assignment_capital: 其中當前已價內的部分
+- premium_remaining: 仍未到期的賣出期權剩餘時間價值
+- theta: 當天的時間價值衰減
+- cumulative_cash_need: 到當天為止累計的接貨資金
+"""
+
+import math
+from datetime import date, timedelta
+
+from calc_engine import underlying_of
+
+TIMELINE_CURRENCIES = ('USD', 'HKD')
+ROLL_WINDOW_DAYS = 7        # 轉倉候選：7 天內到期
+ROLL_DISTANCE_PERCENT = 5   # 且價內或距離行權價 5% 以內
+
+
+def _expiry_date(expiry):
+    try:
+        return date(int(expiry[:4]), int(expiry[4:6]), int(expiry[6:8]))
+    except (TypeError, ValueError):
+        return None
+
+
+def _intrinsic(right, strike, underlying_price):
+    if underlying_price <= 0:
+        return 0.0
+    if right == 'P':
+        return max(strike - underlying_price, 0.0)
+    return max(underlying_price - strike, 0.0)
+
+
+def _empty_series(days):
+    return {
+        'assignment_capital': [0.0] * days,
+        'itm_assignment_capital': [0.0] * days,
+        'premium_remaining': [0.0] * days,
+        'theta': [0.0] * days,
+        'cumulative_cash_need': [0.0] * days
+    }
+
+
+def build_timeline(records, underlying_prices=None, today=None):
+    """由持倉記錄建立到期時間線
+
+    records: derive_position 生成的持倉記錄；underlying_prices: {底層股票: {'price'}}。
+    時間價值按平方根時間衰減估算：value(t) = 當前時間價值 × sqrt(剩餘天數 / 當前剩餘天數)。
+    """
+    today = today or date.today()
+    underlying_prices = underlying_prices or {}
+
+    # 只取賣出期權，並預先算好每個持倉在時間線上需要的數值
+    legs = []
+    last_day = 0
+    for pos in records:
+        if pos.get('secType') != 'OPT' or pos.get('position', 0) >= 0:
+            continue
+        currency = pos.get('currency')
+        expiry_date = _expiry_date(pos.get('expiry'))
+        if currency not in TIMELINE_CURRENCIES or expiry_date is None:
+            continue
+        days_left = (expiry_date - today).days
+        if days_left < 0:
+            continue
+
+        contracts = abs(pos['position'])
+        multiplier = float(pos.get('multiplier') or 100)
+        strike = pos.get('strike', 0)
+        right = pos.get('right')
+        underlying = underlying_of(pos)
+        underlying_price = (underlying_prices.get(underlying) or {}).get('price') or 0
+        option_price = pos.get('current_price') or pos.get('avg_cost') or 0
+        time_value = max(option_price - _intrinsic(right, strike, underlying_price), 0.0)
+
+        legs.append({
+            'currency': currency,
+            'day': days_left,
+            'symbol': underlying,
+            'local_symbol': pos.get('localSymbol'),
+            'expiry': pos.get('expiry'),
+            'right': right,
+            'strike': strike,
+            'position': pos['position'],
+            'underlying_price': underlying_price,
+            'assignment': strike * contracts * multiplier if right == 'P' else 0.0,
+            'itm': underlying_price > 0 and _intrinsic(right, strike, underlying_price) > 0,
+            'time_value': time_value * contracts * multiplier
+        })
+        last_day = max(last_day, days_left)
+
+    days = last_day + 1 if legs else 0
+    series = {ccy: _empty_series(days) for ccy in TIMELINE_CURRENCIES}
+
+    # 先按（貨幣, 到期日）合併時間價值，衰減曲線只需按到期日數量計算
+    time_value_by_day = {}
+    for leg in legs:
+        s = series[leg['currency']]
+        day = leg['day']
+        s['assignment_capital'][day] += leg['assignment']
+        if leg['itm']:
+            s['itm_assignment_capital'][day] += leg['assignment']
+        key = (leg['currency'], day)
+        time_value_by_day[key] = time_value_by_day.get(key, 0.0) + leg['time_value']
+
+    for (currency, day), time_value in time_value_by_day.items():
+        remaining = series[currency]['premium_remaining']
+        if day == 0:
+            remaining[0] += time_value
+            continue
+        for d in range(day):
+            remaining[d] += time_value * math.sqrt((day - d) / day)
+
+    for s in series.values():
+        running = 0.0
+        for d in range(days):
+            running += s['assignment_capital'][d]
+            s['cumulative_cash_need'][d] = running
+            following = s['premium_remaining'][d + 1] if d + 1 < days else 0.0
+            s['theta'][d] = s['premium_remaining'][d] - following
+
+    dates = [(today + timedelta(days=d)).isoformat() for d in range(days)]
+    return {
+        'start': today.isoformat(),
+        'dates': dates,
+        'currencies': {ccy: {k: [round(v, 2) for v in values] for k, values in s.items()}
+                       for ccy, s in series.items()},
+        'expiries': _expiry_calendar(legs),
+        'roll_candidates': _roll_candidates(legs)
+    }
+
+
+def _expiry_calendar(legs):
+    """每個到期日一行的列式日曆"""
+    by_expiry = {}
+    for leg in legs:
+        key = (leg['day'], leg['currency'])
+        entry = by_expiry.get(key)
+        if entry is None:
+            entry = by_expiry[key] = {'expiry': leg['expiry'], 'contracts': 0,
+                                      'capital': 0.0, 'itm_capital': 0.0}
+        entry['contracts'] += abs(leg['position'])
+        entry['capital'] += leg['assignment']
+        if leg['itm']:
+            entry['itm_capital'] += leg['assignment']
+
+    calendar = {'day': [], 'expiry': [], 'currency': [], 'contracts': [], 'capital': [], 'itm_capital': []}
+    for (day, currency), entry in sorted(by_expiry.items()):
+        calendar['day'].append(day)
+        calendar['expiry'].append(entry['expiry'])
+        calendar['currency'].append(currency)
+        calendar['contracts'].append(entry['contracts'])
+        calendar['capital'].append(round(entry['capital'], 2))
+        calendar['itm_capital'].append(round(entry['itm_capital'], 2))
+    return calendar
+
+
+def _roll_candidates(legs):
+    """即將到期且價內或接近行權價的持倉（轉倉候選）"""
+    candidates = []
+    for leg in legs:
+        if leg['day'] > ROLL_WINDOW_DAYS or leg['underlying_price'] <= 0 or not leg['strike']:
+            continue
+        distance = (leg['underlying_price'] - leg['strike']) / leg['strike'] * 100
+        if leg['right'] == 'C':
+            distance = -distance
+        if distance <= ROLL_DISTANCE_PERCENT:
+            candidates.append({
+                'symbol': leg['symbol'],
+                'local_symbol': leg['local_symbol'],
+                'expiry': leg['expiry'],
+                'right': leg['right'],
+                'strike': leg['strike'],
+                'position': leg['position'],
+                'days_to_expiry': leg['day'],
+                'distance_percent': round(distance, 2),
+                'itm': leg['itm']
+            })
+    candidates.sort(key=lambda c: (c['days_to_expiry'], c['distance_percent']))
+    return candidates
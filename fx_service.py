@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - FX Service
+匯率服務 - 從 IB 獲取匯率並緩存，所有匯總金額都通過這裡換算
+"""
+
+import threading
+import time
+
+# IB 未提供匯率時使用的後備匯率（每單位貨幣兌換多少 HKD）
+FALLBACK_RATES_HKD = {
+    'HKD': 1.0,
+    'USD': 7.8,
+}
+DEFAULT_MAX_AGE = 15 * 60  # 超過 15 分鐘未更新視為過期
+
+
+class FxService:
+    """匯率服務
+
+    匯率按收到時的報價方式原樣保存：quotes[(ccy, quote_ccy)] = 1 單位 ccy 等於多少 quote_ccy
+    （IB updateAccountValue 的 ExchangeRate 以賬戶基礎貨幣報價，IDEALPRO 報價以貨幣對報價）。
+    讀取時才換算到當前基礎貨幣，切換基礎貨幣不修改已保存的匯率。
+    """
+
+    def __init__(self, base_currency='HKD', max_age=DEFAULT_MAX_AGE):
+        self.base_currency = base_currency
+        self.max_age = max_age
+        self._quotes = {}  # (ccy, quote_ccy) -> {'rate', 'updated', 'source'}
+        self._base_known = False  # 是否已收到賬戶的 Currency
+        self._pending = []  # 收到 Currency 之前的 ExchangeRate 回調
+        self._table = None  # 換算到基礎貨幣的匯率表（按需重建）
+        self._lock = threading.Lock()
+
+    def set_base_currency(self, currency):
+        """設置基礎貨幣（來自賬戶的 Currency），之前暫存的 ExchangeRate 以它為報價貨幣"""
+        if not currency or currency == 'BASE':
+            return
+        with self._lock:
+            self.base_currency = currency
+            self._base_known = True
+            pending, self._pending = self._pending, []
+            self._table = None
+        for ccy, rate, timestamp in pending:
+            self.update_rate(ccy, rate, 'account_values', timestamp, quote_currency=currency)
+
+    def update_rate(self, currency, rate, source='ib', timestamp=None, quote_currency=None):
+        """更新單個匯率（1 單位 currency 等於 rate quote_currency，默認為當前基礎貨幣）
+
+        timestamp 為 None 時使用當前時間；0 表示更新時間未知（視為過期）。
+        """
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            return False
+        quote_currency = quote_currency or self.base_currency
+        if not currency or currency == 'BASE' or currency == quote_currency or rate <= 0:
+            return False
+        with self._lock:
+            self._quotes[(currency, quote_currency)] = {
+                'rate': rate,
+                'updated': time.time() if timestamp is None else timestamp,
+                'source': source
+            }
+            self._table = None
+        return True
+
+    def update_from_account_value(self, key, value, currency):
+        """處理 updateAccountValue 回調：Currency 設置基礎貨幣，ExchangeRate 為每個貨幣兌基礎貨幣的匯率
+
+        ExchangeRate 可能在 Currency 之前到達，此時還不知道它的報價貨幣，先暫存。
+        """
+        if key == 'Currency':
+            self.set_base_currency(value)
+            return True
+        if key != 'ExchangeRate':
+            return False
+        with self._lock:
+            if not self._base_known:
+                self._pending.append((currency, value, time.time()))
+                return True
+        return self.update_rate(currency, value, source='account_values')
+
+    def update_from_pair(self, symbol, currency, price, source='idealpro'):
+        """從 IDEALPRO CASH 報價更新匯率（1 symbol = price currency）"""
+        return self.update_rate(symbol, price, source, quote_currency=currency)
+
+    def _rates(self):
+        """各貨幣兌當前基礎貨幣的匯率表：{ccy: {'rate', 'updated', 'source'}}（在鎖內調用）
+
+        從基礎貨幣出發沿已保存的匯率（正向或反向）換算，經過的匯率中最舊的更新時間作為結果的更新時間；
+        沒有實時匯率的貨幣使用後備匯率（source 為 fallback）。
+        """
+        if self._table is not None:
+            return self._table
+        base = self.base_currency
+        table = {base: {'rate': 1.0, 'updated': time.time(), 'source': 'base'}}
+        queue = [base]
+        while queue:
+            known = queue.pop(0)
+            value = table[known]
+            for (ccy, quote), entry in self._quotes.items():
+                if quote == known and ccy not in table:
+                    other, rate = ccy, entry['rate'] * value['rate']
+                elif ccy == known and quote not in table:
+                    other, rate = quote, value['rate'] / entry['rate']
+                else:
+                    continue
+                table[other] = {'rate': rate, 'updated': min(entry['updated'], value['updated']),
+                                'source': entry['source']}
+                queue.append(other)
+
+        # 後備匯率：以匯率表中第一個也在後備表中的貨幣（優先基礎貨幣）換算 1 HKD 的價值
+        anchor = next((ccy for ccy in table if ccy in FALLBACK_RATES_HKD), None)
+        hkd_value = table[anchor]['rate'] / FALLBACK_RATES_HKD[anchor] if anchor else 1.0
+        for ccy, hkd in FALLBACK_RATES_HKD.items():
+            if ccy not in table:
+                table[ccy] = {'rate': hkd * hkd_value, 'updated': 0, 'source': 'fallback'}
+        self._table = table
+        return table
+
+    def rate(self, from_ccy, to_ccy):
+        """from_ccy 兌 to_ccy 的匯率"""
+        if from_ccy == to_ccy:
+            return 1.0
+        with self._lock:
+            rates = self._rates()
+            src = rates.get(from_ccy)
+            dst = rates.get(to_ccy)
+        if not src or not dst:
+            raise KeyError(f"No FX rate for {from_ccy}/{to_ccy}")
+        return src['rate'] / dst['rate']
+
+    def convert(self, amount, from_ccy, to_ccy):
+        """換算單個金額"""
+        return amount * self.rate(from_ccy, to_ccy)
+
+    def rate_table(self, to_ccy, currencies):
+        """一次性建立多個貨幣兌 to_ccy 的換算係數"""
+        with self._lock:
+            rates = self._rates()
+            target = rates.get(to_ccy)
+            if not target:
+                raise KeyError(f"No FX rate for {to_ccy}")
+            table = {}
+            for ccy in currencies:
+                entry = rates.get(ccy)
+                if entry is None:
+                    raise KeyError(f"No FX rate for {ccy}/{to_ccy}")
+                table[ccy] = entry['rate'] / target['rate']
+            return table
+
+    def convert_totals(self, amounts, targets=('USD', 'HKD')):
+        """將各貨幣金額一次性換算並加總到多個目標貨幣
+
+        amounts: {ccy: amount}，返回 {target: total}。
+        缺少匯率的貨幣會被忽略並記錄在 'missing' 中。
+        """
+        with self._lock:
+            known = set(self._rates())
+        currencies = [ccy for ccy in amounts if ccy in known]
+        missing = [ccy for ccy in amounts if ccy not in known]
+        result = {}
+        for target in targets:
+            table = self.rate_table(target, currencies)
+            result[target] = sum(amounts[ccy] * table[ccy] for ccy in currencies)
+        if missing:
+            result['missing'] = missing
+        return result
+
+    def is_stale(self, currency, now=None):
+        """匯率是否過期（後備匯率永遠視為過期）"""
+        if currency == self.base_currency:
+            return False
+        with self._lock:
+            entry = self._rates().get(currency)
+        if not entry or entry['source'] == 'fallback':
+            return True
+        return (now or time.time()) - entry['updated'] > self.max_age
+
+    def to_dict(self):
+        """匯率快照（換算到基礎貨幣後保存到數據文件）"""
+        now = time.time()
+        with self._lock:
+            rates = {ccy: dict(entry) for ccy, entry in self._rates().items()}
+        for ccy, entry in rates.items():
+            entry['age_seconds'] = round(now - entry['updated'], 1) if entry['updated'] else None
+            entry['stale'] = self.is_stale(ccy, now)
+        return {'base_currency': self.base_currency, 'rates': rates}
+
+    @classmethod
+    def from_dict(cls, data):
+        """從數據文件中的匯率快照恢復"""
+        fx = cls()
+        if not data:
+            return fx
+        fx.set_base_currency(data.get('base_currency'))
+        for ccy, entry in (data.get('rates') or {}).items():
+            if entry.get('source') in ('fallback', 'base'):
+                continue
+            # 沒有更新時間的匯率記為 0（視為過期），直到重新收到實時匯率
+            fx.update_rate(ccy, entry.get('rate'), entry.get('source', 'ib'), entry.get('updated') or 0)
+        return fx
+
+
+# IDEALPRO 貨幣對的報價方向（排在前面的貨幣作為 symbol）
+PAIR_PRIORITY = ['EUR', 'GBP', 'AUD', 'NZD', 'USD', 'CAD', 'CHF', 'CNH', 'JPY', 'SGD', 'HKD']
+
+
+def fx_pair(currency, base_currency):
+    """返回 IDEALPRO 貨幣對 (symbol, currency)，例如 ('USD', 'HKD')"""
+    def rank(ccy):
+        return PAIR_PRIORITY.index(ccy) if ccy in PAIR_PRIORITY else len(PAIR_PRIORITY)
+    if rank(currency) <= rank(base_currency):
+        return currency, base_currency
+    return base_currency, currency
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - HTTP Client
+共享 HTTP 客戶端 - FMP 報價和雲端上傳共用的連接池
+
+- 一個 requests.Session：keep-alive 和連接池，同一主機的請求復用 TCP/TLS 連接
+- 每個主機的並發上限（BoundedSemaphore）
+- 統一的超時和重試（只對 GET/HEAD 自動重試，POST 由調用方決定）
+- 每個主機的請求數、錯誤數、延遲和連接復用統計
+"""
+
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (5, 10)  # (連接, 讀取) 秒
+DEFAULT_HOST_LIMIT = 4
+DEFAULT_RETRIES = 2
+POOL_MAXSIZE = 8
+LATENCY_SAMPLES = 200
+
+
+class HostStats:
+    """單個主機的請求統計"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_status = None
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, elapsed_ms, status=None, error=False):
+        self.requests += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.samples.append(elapsed_ms)
+        if error:
+            self.errors += 1
+        else:
+            self.last_status = status
+
+    def to_dict(self):
+        samples = sorted(self.samples)
+
+        def percentile(p):
+            return round(samples[min(int(len(samples) * p), len(samples) - 1)], 1) if samples else None
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'avg_ms': round(self.total_ms / self.requests, 1) if self.requests else None,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(self.max_ms, 1),
+            'last_status': self.last_status
+        }
+
+
+class HttpClient:
+    """共享 HTTP 客戶端"""
+
+    def __init__(self, host_limits=None, default_limit=DEFAULT_HOST_LIMIT,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+        self.timeout = timeout
+        self.host_limits = dict(host_limits or {})
+        self.default_limit = default_limit
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._semaphores = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _host_state(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                limit = self.host_limits.get(host, self.default_limit)
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(limit)
+                self._stats[host] = HostStats()
+            return semaphore, self._stats[host]
+
+    def request(self, method, url, **kwargs):
+        """發送請求（受主機並發上限約束），記錄延遲"""
+        host = urlsplit(url).netloc
+        semaphore, stats = self._host_state(host)
+        kwargs.setdefault('timeout', self.timeout)
+        with semaphore:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException:
+                with self._lock:
+                    stats.record((time.perf_counter() - start) * 1000, error=True)
+                raise
+            with self._lock:
+                stats.record((time.perf_counter() - start) * 1000, response.status_code,
+                             error=response.status_code >= 500)
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """每個主機的請求統計和連接復用情況"""
+        result = {}
+        with self._lock:
+            hosts = {host: stats.to_dict() for host, stats in self._stats.items()}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            entry = hosts.get(host)
+            if entry is None:
+                continue
+            entry['connections_opened'] = entry.get('connections_opened', 0) + pool.num_connections
+            entry['pool_requests'] = entry.get('pool_requests', 0) + pool.num_requests
+        for host, entry in hosts.items():
+            opened = entry.get('connections_opened', 0)
+            pool_requests = entry.get('pool_requests', 0)
+            entry['connection_reuse_rate'] = round(1 - opened / pool_requests, 3) if pool_requests else None
+            result[host] = entry
+        return result
+
+    def close(self):
+        self.session.close()
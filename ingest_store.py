@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Ingest Store
+Railway 接收端的數據存儲 - 完整上傳寫入數據文件，差量上傳追加到日誌文件
+
+- 內存中保留最新文檔，讀取 API 不再解析文件
+- 差量只追加一行日誌，寫入量與變化量成正比
+- 日誌累積到一定數量後合併回完整數據文件
+- 啟動時載入數據文件並重放日誌
+- 差量不包含衍生字段，應用差量後由 derive 回調重新計算
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from portfolio_delta import apply_delta
+
+logger = logging.getLogger(__name__)
+
+COMPACT_EVERY = 50  # 每 50 個差量合併一次
+
+
+class VersionMismatch(Exception):
+    """差量的 base_version 與服務器當前版本不一致"""
+
+    def __init__(self, expected, received):
+        super().__init__(f"Version mismatch: server {expected}, delta base {received}")
+        self.expected = expected
+        self.received = received
+
+
+class IngestStore:
+    """上傳數據存儲（帶差量日誌）"""
+
+    def __init__(self, data_file, compact_every=COMPACT_EVERY, derive=None):
+        self.data_file = Path(data_file)
+        self.derive = derive  # derive(document) -> 重新計算了衍生字段的文檔
+        self.journal_file = self.data_file.with_suffix('.journal')
+        self.compact_every = compact_every
+        self.document = None
+        self.version = 0
+        self.journal_count = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """載入數據文件並重放日誌"""
+        if self.data_file.exists():
+            try:
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    self.document = json.load(f)
+                self.version = self.document.get('ingest_version', 0)
+            except Exception as e:
+                logger.error(f"Error loading data file: {e}")
+
+        if self.document is not None and self.journal_file.exists():
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # 最後一行寫入不完整
+                    if entry['version'] <= self.version:
+                        continue
+                    self.document = apply_delta(self.document, entry['delta'])
+                    self.version = entry['version']
+                    self.journal_count += 1
+            if self.journal_count and self.derive is not None:
+                self.document = self.derive(self.document)
+            logger.info(f"Replayed journal to version {self.version} ({self.journal_count} deltas)")
+
+    def reload(self):
+        """重新載入數據文件和日誌（其他進程寫入了新版本）"""
+        with self._lock:
+            self.document = None
+            self.version = 0
+            self.journal_count = 0
+            self._load()
+
+    def get(self):
+        """返回最新文檔（沒有數據時返回 None），調用方不應修改"""
+        return self.document
+
+    def replace(self, document):
+        """完整上傳：替換文檔並寫入數據文件，清空日誌"""
+        start = time.perf_counter()
+        with self._lock:
+            self.version += 1
+            document['ingest_version'] = self.version
+            self.document = document
+            self._write_document()
+            return self.version, (time.perf_counter() - start) * 1000
+
+    def apply(self, delta):
+        """差量上傳：應用到內存文檔並追加日誌"""
+        start = time.perf_counter()
+        with self._lock:
+            if self.document is None or delta.get('base_version') != self.version:
+                raise VersionMismatch(self.version, delta.get('base_version'))
+
+            version = self.version + 1
+            delta = dict(delta, fields=dict(delta.get('fields') or {}, ingest_version=version))
+            document = apply_delta(self.document, delta)
+            self.document = self.derive(document) if self.derive is not None else document
+            self.version = version
+
+            if self.journal_count + 1 >= self.compact_every:
+                self._write_document()
+            else:
+                with open(self.journal_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'version': version, 'delta': delta}, ensure_ascii=False) + '\n')
+                self.journal_count += 1
+            return self.version, (time.perf_counter() - start) * 1000
+
+    def _write_document(self):
+        """原子寫入完整數據文件並清空日誌"""
+        temp_file = str(self.data_file) + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.document, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, self.data_file)
+        if self.journal_file.exists():
+            self.journal_file.unlink()
+        self.journal_count = 0
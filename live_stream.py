@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Live Stream
+實時推送 - IB 回調產生的行情、希臘值和盈虧更新廣播給儀表板
+
+- IB 回調線程只把字段合併到待發送字典（按 conId），不做 I/O
+- 後台線程每 interval 秒把待發送的更新合併為一個事件，
+  同一合約在一個周期內的多次 tick 只推送最後的值
+- tick 也會改變匯總（calculations 的總計）：每 summary_interval 秒最多
+  廣播一次 summary 事件，最後一批 tick 之後的匯總在下一個周期補發
+- 事件保存在有限長度的環形緩衝中，SSE 客戶端按序號讀取，
+  落後太多（事件已被覆蓋）時收到 resync 事件，重新載入完整數據
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.25  # 每個合約最多每 250ms 推送一次
+DEFAULT_HISTORY = 256
+DEFAULT_SUMMARY_INTERVAL = 2.0  # summary 事件最多每 2 秒一次
+
+
+class LiveUpdates:
+    """實時更新廣播"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, history=DEFAULT_HISTORY, enrich=None,
+                 summarize=None, summary_interval=DEFAULT_SUMMARY_INTERVAL):
+        self.interval = interval
+        self.enrich = enrich  # enrich(updates) 在發送前加入衍生字段（在後台線程中調用）
+        self.summarize = summarize  # summarize() 返回 summary 事件的內容，None 表示不發送
+        self.summary_interval = summary_interval
+        self._summary_due = False
+        self._summary_at = 0.0
+        self.seq = 0
+        self._pending = {}  # conId -> {field: value}
+        self._events = deque(maxlen=history)  # (seq, event_type, payload)
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        """註冊事件回調 listener(seq, event_type, payload)，在後台線程中調用"""
+        self._listeners.append(listener)
+
+    def publish(self, con_id, fields):
+        """合併一個合約的字段更新（IB 回調線程調用，只做字典合併）"""
+        with self._cond:
+            entry = self._pending.get(con_id)
+            if entry is None:
+                self._pending[con_id] = dict(fields)
+            else:
+                entry.update(fields)
+
+    def publish_event(self, event_type, payload):
+        """立即廣播一個事件（快照版本、連接狀態）"""
+        with self._cond:
+            seq = self._append(event_type, payload)
+        self._notify(seq, event_type, payload)
+        return seq
+
+    def _append(self, event_type, payload):
+        self.seq += 1
+        self._events.append((self.seq, event_type, payload))
+        self._cond.notify_all()
+        return self.seq
+
+    def _notify(self, seq, event_type, payload):
+        for listener in self._listeners:
+            try:
+                listener(seq, event_type, payload)
+            except Exception as e:
+                logger.error(f"Live update listener failed: {e}")
+
+    def flush(self):
+        """把待發送的更新合併為一個 ticks 事件"""
+        with self._cond:
+            if not self._pending:
+                return None
+            updates, self._pending = self._pending, {}
+        if self.enrich is not None:
+            try:
+                self.enrich(updates)
+            except Exception as e:
+                logger.error(f"Enriching live updates failed: {e}")
+        payload = {'updates': updates, 'ts': time.time()}
+        with self._cond:
+            seq = self._append('ticks', payload)
+            self._summary_due = self.summarize is not None
+        self._notify(seq, 'ticks', payload)
+        return seq
+
+    def flush_summary(self):
+        """上一次 summary 之後推送過 tick 且已過 summary_interval 時廣播 summary 事件"""
+        now = time.monotonic()
+        with self._cond:
+            if not self._summary_due or now - self._summary_at < self.summary_interval:
+                return None
+            self._summary_due = False
+            self._summary_at = now
+        payload = self.summarize()
+        if payload is None:
+            return None
+        return self.publish_event('summary', payload)
+
+    def events_after(self, seq, timeout=None):
+        """返回序號大於 seq 的事件，沒有新事件時最多等待 timeout 秒
+
+        seq 之後的事件已被覆蓋時返回一個 resync 事件。
+        """
+        with self._cond:
+            if seq > self.seq:
+                # 序號來自重啟前的進程
+                return [(self.seq, 'resync', {'seq': self.seq})]
+            if self.seq == seq:
+                self._cond.wait_for(lambda: self.seq > seq or self._stop.is_set(), timeout)
+            if self.seq <= seq:
+                return []
+            if seq < self._events[0][0] - 1:
+                return [(self.seq, 'resync', {'seq': self.seq})]
+            return [event for event in self._events if event[0] > seq]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+                self.flush_summary()
+            except Exception as e:
+                logger.error(f"Live update flush failed: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='live-updates', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=2)
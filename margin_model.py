@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Margin Model
+保證金估算 - Reg-T 和組合保證金（Portfolio Margin）風格的本地估算
+
+從已保存的快照預先計算每個底層股票的情景損益，
+新增假設持倉時只需計算該持倉本身，每個候選行權價為微秒級。
+估算結果僅供篩選參考，最終以 IB whatIfOrder 返回為準。
+"""
+
+import logging
+
+from calc_engine import underlying_of
+from fx_service import FxService
+
+logger = logging.getLogger(__name__)
+
+# Reg-T 期權保證金參數（IB / CBOE 規則）
+REG_T_UNDERLYING_PCT = 0.20
+REG_T_MINIMUM_PCT = 0.10
+REG_T_STOCK_INITIAL_PCT = 0.50
+
+# 組合保證金情景：股票/ETF 上下 15%，共 11 個價格點
+PM_SHOCKS = [i / 100 for i in range(-15, 16, 3)]
+PM_MINIMUM_PER_CONTRACT = 37.5  # 每張合約最低 0.375 × 100
+
+
+def reg_t_short_option(right, strike, underlying_price, premium, quantity, multiplier=100):
+    """Reg-T 裸賣期權保證金
+
+    Put: max(20% × 底層 − 價外金額 + 權利金, 10% × 行權價 + 權利金)
+    Call: max(20% × 底層 − 價外金額 + 權利金, 10% × 底層 + 權利金)
+    """
+    if right == 'P':
+        out_of_money = max(underlying_price - strike, 0)
+        minimum = REG_T_MINIMUM_PCT * strike + premium
+    else:
+        out_of_money = max(strike - underlying_price, 0)
+        minimum = REG_T_MINIMUM_PCT * underlying_price + premium
+    standard = REG_T_UNDERLYING_PCT * underlying_price - out_of_money + premium
+    return max(standard, minimum) * abs(quantity) * multiplier
+
+
+def option_value_at(right, strike, underlying_price, shocked_price, option_price):
+    """情景價格下的期權價值：內在價值加上保留的時間價值"""
+    if right == 'P':
+        intrinsic_now = max(strike - underlying_price, 0)
+        intrinsic = max(strike - shocked_price, 0)
+    else:
+        intrinsic_now = max(underlying_price - strike, 0)
+        intrinsic = max(shocked_price - strike, 0)
+    time_value = max(option_price - intrinsic_now, 0)
+    return intrinsic + time_value
+
+
+def scenario_pnl(leg, underlying_price, shocks=PM_SHOCKS):
+    """單個持倉在每個情景下的損益（USD）"""
+    quantity = leg['quantity']
+    multiplier = leg.get('multiplier', 100)
+    if leg['sec_type'] == 'STK':
+        return [quantity * underlying_price * shock for shock in shocks]
+
+    price = leg['price']
+    return [
+        (option_value_at(leg['right'], leg['strike'], underlying_price,
+                         underlying_price * (1 + shock), price) - price) * quantity * multiplier
+        for shock in shocks
+    ]
+
+
+def _leg_from_position(pos):
+    """把快照中的持倉轉換為保證金計算用的腿"""
+    leg = {
+        'sec_type': pos.get('secType'),
+        'quantity': pos.get('position', 0),
+        'currency': pos.get('currency', 'USD'),
+        'underlying': underlying_of(pos),
+    }
+    if leg['sec_type'] == 'OPT':
+        leg.update({
+            'right': pos.get('right'),
+            'strike': pos.get('strike', 0),
+            'price': pos.get('current_price') or pos.get('avg_cost', 0),
+            'multiplier': float(pos.get('multiplier') or 100),
+        })
+    return leg
+
+
+class MarginModel:
+    """保證金模型 - 從一個持倉快照預先計算，供大量候選行權價查詢"""
+
+    def __init__(self, portfolio_data, fx=None, shocks=PM_SHOCKS):
+        self.shocks = shocks
+        self.fx = fx or FxService.from_dict(portfolio_data.get('fx_rates'))
+        self.version = portfolio_data.get('snapshot_version') or portfolio_data.get('timestamp')
+        self.underlying_prices = {
+            symbol: quote.get('price') or 0
+            for symbol, quote in (portfolio_data.get('underlying_prices') or {}).items()
+        }
+
+        self.reg_t_total = 0.0
+        self.scenarios = {}  # underlying -> 每個情景的損益
+        self.contracts = {}  # underlying -> 期權合約數
+        self.unpriced = []   # 沒有底層價格、無法估算的持倉
+        self.non_usd = []    # 非 USD 持倉（港股等），不計入估算
+
+        for pos in portfolio_data.get('positions', []):
+            if pos.get('currency', 'USD') != 'USD':
+                self.non_usd.append(pos.get('localSymbol') or pos.get('symbol'))
+                continue  # 只估算美股賬戶部分
+            leg = _leg_from_position(pos)
+            underlying_price = self.underlying_prices.get(leg['underlying']) or 0
+            if leg['sec_type'] == 'STK':
+                underlying_price = underlying_price or pos.get('current_price') or 0
+            if underlying_price <= 0:
+                self.unpriced.append(pos.get('localSymbol') or pos.get('symbol'))
+                continue
+            self._add_leg(leg, underlying_price)
+
+        self.available_funds_usd = self._account_value_usd(portfolio_data, 'AvailableFunds')
+        self.buying_power_usd = self._account_value_usd(portfolio_data, 'BuyingPower')
+
+    def _account_value_usd(self, portfolio_data, tag):
+        """賬戶摘要字段換算為 USD；沒有匯率或數值無效時返回 None（與沒有該字段相同）"""
+        entry = (portfolio_data.get('account_summary') or {}).get(tag) or {}
+        if not entry.get('value'):
+            return None
+        currency = entry.get('currency') or self.fx.base_currency
+        if currency == 'BASE':
+            currency = self.fx.base_currency
+        try:
+            return self.fx.convert(float(entry['value']), currency, 'USD')
+        except (KeyError, ValueError) as e:
+            logger.warning(f"無法換算 {tag} 為 USD: {e}")
+            return None
+
+    def _add_leg(self, leg, underlying_price):
+        self.reg_t_total += self._reg_t_leg(leg, underlying_price)
+        pnl = scenario_pnl(leg, underlying_price, self.shocks)
+        current = self.scenarios.get(leg['underlying'])
+        self.scenarios[leg['underlying']] = pnl if current is None else [a + b for a, b in zip(current, pnl)]
+        if leg['sec_type'] == 'OPT':
+            self.contracts[leg['underlying']] = self.contracts.get(leg['underlying'], 0) + abs(leg['quantity'])
+
+    def _reg_t_leg(self, leg, underlying_price):
+        """單個持倉的 Reg-T 初始保證金"""
+        if leg['sec_type'] == 'STK':
+            if leg['quantity'] > 0:
+                return leg['quantity'] * underlying_price * REG_T_STOCK_INITIAL_PCT
+            return abs(leg['quantity']) * underlying_price * (1 + REG_T_STOCK_INITIAL_PCT)
+        if leg['quantity'] > 0:
+            return 0.0  # 買入期權已全額支付權利金
+        return reg_t_short_option(leg['right'], leg['strike'], underlying_price,
+                                  leg['price'], leg['quantity'], leg.get('multiplier', 100))
+
+    def _pm_requirement(self, pnl, contracts):
+        worst_loss = max(0.0, -min(pnl)) if pnl else 0.0
+        return max(worst_loss, contracts * PM_MINIMUM_PER_CONTRACT)
+
+    @property
+    def pm_total(self):
+        """當前持倉的組合保證金估算（各底層股票最壞情景損失之和）"""
+        return sum(self._pm_requirement(pnl, self.contracts.get(u, 0))
+                   for u, pnl in self.scenarios.items())
+
+    def current(self):
+        """當前持倉的保證金估算"""
+        return {
+            'version': self.version,
+            'reg_t_requirement': self.reg_t_total,
+            'portfolio_margin_requirement': self.pm_total,
+            'available_funds_usd': self.available_funds_usd,
+            'buying_power_usd': self.buying_power_usd,
+            'unpriced_positions': self.unpriced,
+            'non_usd_positions': self.non_usd
+        }
+
+    def what_if(self, symbol, strike, premium, quantity=-1, right='P', underlying_price=None):
+        """估算新增一個期權持倉（預設賣出 1 張 Put）後的保證金變化"""
+        underlying_price = underlying_price or self.underlying_prices.get(symbol) or 0
+        if underlying_price <= 0:
+            return {'symbol': symbol, 'strike': strike, 'error': 'No underlying price'}
+
+        leg = {
+            'sec_type': 'OPT', 'underlying': symbol, 'right': right, 'strike': strike,
+            'price': premium, 'quantity': quantity, 'multiplier': 100
+        }
+        reg_t_change = self._reg_t_leg(leg, underlying_price)
+
+        existing = self.scenarios.get(symbol)
+        contracts = self.contracts.get(symbol, 0)
+        added = scenario_pnl(leg, underlying_price, self.shocks)
+        combined = added if existing is None else [a + b for a, b in zip(existing, added)]
+        before = self._pm_requirement(existing, contracts) if existing is not None else 0.0
+        pm_change = self._pm_requirement(combined, contracts + abs(quantity)) - before
+
+        result = {
+            'symbol': symbol,
+            'strike': strike,
+            'right': right,
+            'quantity': quantity,
+            'premium': premium,
+            'underlying_price': underlying_price,
+            'reg_t_change': reg_t_change,
+            'portfolio_margin_change': pm_change,
+            'capital_required': (strike - premium) * abs(quantity) * 100 if right == 'P' else None,
+        }
+        if self.available_funds_usd is not None:
+            result['available_funds_after_reg_t'] = self.available_funds_usd - reg_t_change
+            result['available_funds_after_pm'] = self.available_funds_usd - pm_change
+        return result
+
+    def screen(self, candidates):
+        """批量估算候選持倉；無效的候選返回帶 error 的結果，不影響其他候選
+
+        有效候選的結果包含轉換後的 symbol、strike、right、quantity、premium 和 expiry（如有），
+        調用方提交 IB whatIf 訂單時直接使用，不需要再次解析請求。
+        """
+        results = []
+        for c in candidates:
+            try:
+                symbol, strike = c['symbol'], float(c['strike'])
+                premium = float(c.get('premium') or 0)
+                quantity = int(c['quantity']) if c.get('quantity') is not None else -1
+                right = c.get('right') or 'P'
+                expiry = str(c['expiry']) if c.get('expiry') else None
+                underlying_price = float(c['underlying_price']) if c.get('underlying_price') else None
+                if not symbol or strike <= 0 or not quantity or right not in ('P', 'C'):
+                    raise ValueError('symbol, strike > 0, quantity != 0 and right P/C required')
+                if expiry is not None and not (len(expiry) == 8 and expiry.isdigit()):
+                    raise ValueError('expiry must be YYYYMMDD')
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                results.append({
+                    'symbol': c.get('symbol') if isinstance(c, dict) else None,
+                    'strike': c.get('strike') if isinstance(c, dict) else None,
+                    'error': f'Invalid candidate: {e}'
+                })
+                continue
+            result = self.what_if(symbol, strike, premium, quantity, right, underlying_price)
+            if expiry is not None:
+                result['expiry'] = expiry
+            results.append(result)
+        return results
+
+
+def compare_with_what_if(estimate, order_state):
+    """比較本地估算與 IB whatIfOrder 返回的 initMarginChange"""
+    try:
+        ib_change = float(order_state.get('initMarginChange'))
+    except (TypeError, ValueError):
+        return None
+    local = estimate.get('reg_t_change') or 0
+    return {
+        'ib_init_margin_change': ib_change,
+        'local_reg_t_change': local,
+        'local_pm_change': estimate.get('portfolio_margin_change'),
+        'difference': local - ib_change,
+        'difference_percent': (local - ib_change) / ib_change * 100 if ib_change else None
+    }
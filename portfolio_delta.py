@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Portfolio Delta
+持倉數據差量 - 本地上傳端和 Railway 接收端共用
+
+差量只包含相對於服務器已確認版本有變化的部分：
+- positions_upsert / positions_removed: 按 (賬戶, conId) 新增、修改或刪除的持倉
+- account_summary / account_summary_removed: 有變化的賬戶摘要字段
+- fields / fields_removed: 其他有變化的頂層字段
+
+由持倉計算得出的字段（DERIVED_FIELDS）任何價格變化都會改變，且大小與持倉數量成正比，
+不放入差量；接收端應用差量後由持倉重新計算（portfolio_summary.with_derived_fields）。
+"""
+
+# 由持倉計算得出的頂層字段
+DERIVED_FIELDS = ('summary', 'options_by_expiry', 'calculations', 'expiry_timeline')
+
+
+def delta_key(pos):
+    """持倉在差量中的鍵（JSON 中只能使用字符串）：賬戶 + 合約，同一合約在不同賬戶中是不同的持倉"""
+    con_id = pos.get('conId')
+    if con_id:
+        return f"{pos.get('account')}|{con_id}"
+    return '|'.join(str(pos.get(k)) for k in ('account', 'symbol', 'secType', 'expiry', 'right', 'strike'))
+
+
+def _diff_mapping(previous, current):
+    """返回 (有變化的項, 被刪除的鍵)"""
+    changed = {k: v for k, v in current.items() if k not in previous or previous[k] != v}
+    removed = [k for k in previous if k not in current]
+    return changed, removed
+
+
+def build_delta(previous, current, base_version):
+    """計算 current 相對於 previous（服務器已確認的文檔）的差量"""
+    previous_positions = {delta_key(p): p for p in previous.get('positions', [])}
+    current_positions = {delta_key(p): p for p in current.get('positions', [])}
+    upsert, removed = _diff_mapping(previous_positions, current_positions)
+
+    summary_changed, summary_removed = _diff_mapping(
+        previous.get('account_summary') or {}, current.get('account_summary') or {}
+    )
+
+    skip = ('positions', 'account_summary') + DERIVED_FIELDS
+    fields, fields_removed = _diff_mapping(
+        {k: v for k, v in previous.items() if k not in skip},
+        {k: v for k, v in current.items() if k not in skip}
+    )
+
+    order = list(current_positions)
+    return {
+        'base_version': base_version,
+        'order': order if order != list(previous_positions) else None,  # 持倉順序有變化時才發送
+        'positions_upsert': list(upsert.values()),
+        'positions_removed': removed,
+        'account_summary': summary_changed,
+        'account_summary_removed': summary_removed,
+        'fields': fields,
+        'fields_removed': fields_removed
+    }
+
+
+def is_empty(delta):
+    """差量是否沒有任何變化"""
+    return not (delta['positions_upsert'] or delta['positions_removed'] or
+                delta['account_summary'] or delta['account_summary_removed'] or
+                delta['fields'] or delta['fields_removed'])
+
+
+def apply_delta(document, delta):
+    """把差量應用到文檔上，返回新文檔（不修改原文檔）"""
+    positions = {delta_key(p): p for p in document.get('positions', [])}
+    for key in delta.get('positions_removed', []):
+        positions.pop(key, None)
+    for pos in delta.get('positions_upsert', []):
+        positions[delta_key(pos)] = pos
+
+    order = delta.get('order')
+    if order is not None:
+        ordered = [positions[key] for key in order if key in positions]
+        if len(ordered) == len(positions):
+            positions = {delta_key(p): p for p in ordered}
+
+    account_summary = dict(document.get('account_summary') or {})
+    for tag in delta.get('account_summary_removed', []):
+        account_summary.pop(tag, None)
+    account_summary.update(delta.get('account_summary', {}))
+
+    result = {k: v for k, v in document.items() if k not in delta.get('fields_removed', [])}
+    result.update(delta.get('fields', {}))
+    result['positions'] = list(positions.values())
+    result['account_summary'] = account_summary
+    return result
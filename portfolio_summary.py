@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Portfolio Summary
+服務器端匯總 - 每次接收數據後計算一次並緩存，供 /api/summary 直接返回
+
+包含 calculate_cloud_data 的匯總和到期分組、到期時間線以及保證金估算，
+瀏覽器和手機無需再遍歷持倉計算。
+"""
+
+import threading
+import time
+from datetime import date, datetime
+
+import calc_engine
+import expiry_timeline
+import margin_model
+
+
+def build_summary(portfolio_data):
+    """從一份完整的持倉文檔計算匯總"""
+    start = time.perf_counter()
+    calculations = calc_engine.calculate_cloud_data(portfolio_data, recompute=True)
+    timeline = expiry_timeline.build_timeline(
+        portfolio_data.get('positions', []), portfolio_data.get('underlying_prices')
+    )
+    margin = margin_model.MarginModel(portfolio_data).current()
+    return {
+        'last_update': portfolio_data.get('last_update'),
+        'summary': portfolio_data.get('summary'),
+        'calculations': calculations,
+        'expiry_timeline': timeline,
+        'margin': margin,
+        'computed_at': datetime.now().isoformat(),
+        'compute_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+def with_derived_fields(portfolio_data):
+    """返回重新計算了衍生字段的文檔（應用差量後調用，差量不包含這些字段）"""
+    document = dict(portfolio_data)
+    document.update(calc_engine.derived_fields(document))
+    document['expiry_timeline'] = expiry_timeline.build_timeline(
+        document.get('positions', []), document.get('underlying_prices')
+    )
+    return document
+
+
+class SummaryCache:
+    """按數據版本緩存的匯總，同一版本只計算一次（跨日後到期天數變化，重新計算）"""
+
+    def __init__(self):
+        self.version = None
+        self.data = None
+        self._lock = threading.Lock()
+
+    def get(self, portfolio_data, version):
+        """返回指定版本的匯總，版本變化時重新計算"""
+        if portfolio_data is None:
+            return None
+        key = (version, date.today())
+        with self._lock:
+            if self.version != key or self.data is None:
+                self.data = dict(build_summary(portfolio_data), version=version)
+                self.version = key
+            return self.data
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Quote Cache
+股票報價緩存 - /api/stock-prices 和底層股票價格共用，上游（FMP）請求數只與股票數量有關
+
+- 每個股票單獨記錄獲取時間：TTL 內直接從內存返回
+- 過期但未超過 STALE 時間時先返回舊報價，同時在後台刷新（stale-while-revalidate）
+- 合併並發請求（singleflight）：同一股票正在獲取時，其他請求等待同一次結果，不重複請求上游
+- 上游沒有返回的股票（無效代碼）同樣記錄，TTL 內不再請求
+- 後台刷新線程覆蓋當前持倉中的股票（watch），在 TTL 到期前刷新，客戶端讀到的總是新報價
+- FMP 的批次並發請求（並發數有上限），整次獲取有截止時間；失敗或超時的批次不覆蓋已緩存的報價
+- 快照保存只讀取緩存（peek，帶報價的已過時間），不等待網絡；新報價到達後通知監聽器
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30  # 秒
+DEFAULT_STALE = 900  # 超過此時間的報價不再返回，需要等待上游
+DEFAULT_WAIT = 15  # 等待其他請求正在進行的獲取的最長時間
+REFRESH_AHEAD = 0.8  # 後台刷新在 TTL 的這個比例時進行
+
+FMP_QUOTE_URL = 'https://financialmodelingprep.com/api/v3/quote'
+FMP_BATCH_SIZE = 50  # FMP API 批量限制
+FMP_TIMEOUT = 10  # 單個請求的超時
+FMP_PARALLEL = 4  # 同時進行的批次數（與 HttpClient 對 FMP 主機的並發上限一致）
+FMP_DEADLINE = 15  # 一次獲取（所有批次）的截止時間
+
+
+class PartialQuotes(Exception):
+    """部分批次失敗：quotes 為成功獲取的報價，failed 為失敗批次中的股票"""
+
+    def __init__(self, quotes, failed):
+        super().__init__(f"{len(failed)} symbols failed")
+        self.quotes = quotes
+        self.failed = failed
+
+
+def quote_fields(quote):
+    """儀表板和到期時間線使用的報價字段"""
+    return {
+        'price': quote.get('price', 0),
+        'changesPercentage': quote.get('changesPercentage', 0),
+        'dayHigh': quote.get('dayHigh', 0),
+        'dayLow': quote.get('dayLow', 0),
+        'previousClose': quote.get('previousClose', 0),
+        'timestamp': quote.get('timestamp', 0)
+    }
+
+
+class FmpQuotes:
+    """FMP 批量報價接口：批次並發請求，整次獲取有截止時間"""
+
+    def __init__(self, http_client, api_key, base_url=FMP_QUOTE_URL, batch_size=FMP_BATCH_SIZE,
+                 timeout=FMP_TIMEOUT, parallel=FMP_PARALLEL, deadline=FMP_DEADLINE):
+        self.http_client = http_client
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.deadline = deadline
+        self._pool = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='fmp-quotes')
+
+    def _fetch_batch(self, batch, deadline):
+        """獲取一個批次，返回 {股票: 報價}；請求失敗時拋出異常"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("deadline passed before request")
+        url = f"{self.base_url}/{','.join(batch)}?apikey={self.api_key}"
+        response = self.http_client.get(url, timeout=min(self.timeout, remaining))
+        if response.status_code != 200:
+            raise RuntimeError(f"FMP API 錯誤: {response.status_code}")
+        quotes = {}
+        for quote in response.json():
+            symbol = quote.get('symbol')
+            if symbol:
+                quotes[symbol] = quote_fields(quote)
+        return quotes
+
+    def fetch(self, symbols):
+        """獲取報價，返回按請求順序排列的 {股票: 報價}
+
+        有批次失敗或在截止時間前沒有完成時拋出 PartialQuotes（帶上成功的報價）。
+        """
+        symbols = list(symbols)
+        batches = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        if not batches:
+            return {}
+        deadline = time.monotonic() + self.deadline
+        futures = [self._pool.submit(self._fetch_batch, batch, deadline) for batch in batches]
+        wait_futures(futures, timeout=max(0, deadline - time.monotonic()))
+
+        prices, failed = {}, []
+        for batch, future in zip(batches, futures):
+            if not future.done():
+                future.cancel()  # 還沒開始的批次不再發送；已開始的由請求超時結束
+                logger.error(f"FMP 批次超時（{len(batch)} 個股票）")
+                failed.extend(batch)
+                continue
+            try:
+                quotes = future.result()
+            except Exception as e:
+                logger.error(f"獲取批量報價錯誤: {e}")
+                failed.extend(batch)
+                continue
+            # 按請求順序排列，FMP 返回的順序不固定
+            for symbol in batch:
+                if symbol in quotes:
+                    prices[symbol] = quotes.pop(symbol)
+            prices.update(quotes)
+        logger.info(f"FMP 返回 {len(prices)}/{len(symbols)} 個報價（{len(batches)} 個批次，失敗 {len(failed)} 個股票）")
+        if failed:
+            raise PartialQuotes(prices, failed)
+        return prices
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _Flight:
+    """一次正在進行的上游獲取"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class QuoteCache:
+    """按股票緩存報價，合併並發獲取，後台刷新持倉中的股票"""
+
+    def __init__(self, fetch, ttl=DEFAULT_TTL, stale=DEFAULT_STALE, wait=DEFAULT_WAIT):
+        self.fetch = fetch  # fetch(symbols) -> {symbol: quote}
+        self.ttl = ttl
+        self.stale = max(stale, ttl)
+        self.wait = wait
+        self._entries = {}  # symbol -> (quote 或 None, 獲取時間 monotonic)
+        self._inflight = {}  # symbol -> _Flight
+        self._watched = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'upstream_calls': 0,
+            'upstream_symbols': 0,
+            'upstream_errors': 0,  # 獲取失敗的股票數
+            'background_refreshes': 0
+        }
+
+    def get_many(self, symbols):
+        """返回 {股票: 報價}（上游沒有的股票不包含在內）
+
+        新鮮或可用的舊報價直接返回；只有沒有可用報價的股票需要等待上游。
+        """
+        symbols = list(dict.fromkeys(s for s in symbols if s))
+        now = time.monotonic()
+        result, stale, missing = {}, [], []
+        with self._lock:
+            for symbol in symbols:
+                entry = self._entries.get(symbol)
+                age = now - entry[1] if entry else None
+                if entry is not None and age <= self.ttl:
+                    self.stats['hits'] += 1
+                elif entry is not None and age <= self.stale and entry[0] is not None:
+                    self.stats['stale_hits'] += 1
+                    stale.append(symbol)
+                else:
+                    self.stats['misses'] += 1
+                    missing.append(symbol)
+                    continue
+                if entry[0] is not None:
+                    result[symbol] = entry[0]
+
+        if stale:
+            self._refresh(stale, wait=False)
+        if missing:
+            self._refresh(missing, wait=True)
+            with self._lock:
+                for symbol in missing:
+                    entry = self._entries.get(symbol)
+                    if entry is not None and entry[0] is not None:
+                        result[symbol] = entry[0]
+        return result
+
+    def peek(self, symbols):
+        """只讀取緩存，不請求上游：返回 {股票: (報價, 已過秒數)}，沒有報價的股票不包含在內"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for symbol in symbols:
+                entry = self._entries.get(symbol)
+                if entry is not None and entry[0] is not None:
+                    result[symbol] = (entry[0], now - entry[1])
+            return result
+
+    def add_listener(self, callback):
+        """新報價到達後調用 callback({股票: 報價})（在獲取報價的線程中）"""
+        self._listeners.append(callback)
+
+    def _claim(self, symbols):
+        """認領沒有正在獲取的股票，返回 (自己獲取的股票, 自己的 _Flight, 需要等待的其他 _Flight)"""
+        with self._lock:
+            own = [s for s in symbols if s not in self._inflight]
+            flight = _Flight() if own else None
+            for symbol in own:
+                self._inflight[symbol] = flight
+            others = {self._inflight[s] for s in symbols if self._inflight[s] is not flight}
+            self.stats['coalesced'] += len(symbols) - len(own)
+            return own, flight, others
+
+    def _refresh(self, symbols, wait):
+        own, flight, others = self._claim(symbols)
+        if own and wait:
+            self._fetch(own, flight)
+        elif own:
+            threading.Thread(target=self._fetch, args=(own, flight), daemon=True, name='quote-refresh').start()
+        if wait:
+            deadline = time.monotonic() + self.wait
+            for other in others:
+                other.done.wait(max(0, deadline - time.monotonic()))
+
+    def _fetch(self, symbols, flight):
+        failed = ()
+        try:
+            quotes = self.fetch(symbols)
+        except PartialQuotes as e:
+            quotes, failed = e.quotes, set(e.failed)
+        except Exception as e:
+            logger.error(f"Quote fetch error: {e}")
+            quotes, failed = {}, set(symbols)
+        now = time.monotonic()
+        with self._lock:
+            for symbol in symbols:
+                # 獲取失敗的股票保留原有報價，下次請求時重試；上游確實沒有的股票記為 None
+                if symbol not in failed:
+                    self._entries[symbol] = (quotes.get(symbol), now)
+                if self._inflight.get(symbol) is flight:
+                    del self._inflight[symbol]
+            self.stats['upstream_calls'] += 1
+            self.stats['upstream_symbols'] += len(symbols)
+            self.stats['upstream_errors'] += len(failed)
+        flight.done.set()
+
+        if quotes:
+            for callback in self._listeners:
+                try:
+                    callback(quotes)
+                except Exception as e:
+                    logger.error(f"Quote listener error: {e}")
+
+    def watch(self, symbols):
+        """設置後台刷新覆蓋的股票（當前持倉），新增的股票立即刷新"""
+        symbols = set(s for s in symbols if s)
+        with self._lock:
+            added = symbols - self._watched
+            self._watched = symbols
+        if added:
+            self._wake.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='quote-refresher')
+        self._thread.start()
+        logger.info("Quote refresher started")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_due()
+            except Exception as e:
+                logger.error(f"Quote refresher error: {e}")
+            self._wake.wait(self.ttl * (1 - REFRESH_AHEAD))
+            self._wake.clear()
+
+    def refresh_due(self):
+        """刷新持倉中即將過期或沒有報價的股票（一次上游獲取），返回刷新的股票數"""
+        now = time.monotonic()
+        with self._lock:
+            due = [s for s in self._watched
+                   if s not in self._entries or now - self._entries[s][1] >= self.ttl * REFRESH_AHEAD]
+            # 不在持倉中、且已超過 STALE 時間的報價不會再被使用
+            for symbol in [s for s, (_, at) in self._entries.items()
+                           if s not in self._watched and now - at > self.stale]:
+                del self._entries[symbol]
+        if due:
+            with self._lock:
+                self.stats['background_refreshes'] += 1
+            own, flight, _ = self._claim(sorted(due))
+            if own:
+                self._fetch(own, flight)
+        return len(due)
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            fresh = sum(1 for quote, at in self._entries.values() if quote is not None and now - at <= self.ttl)
+            return dict(self.stats, symbols=len(self._entries), fresh=fresh, watched=len(self._watched),
+                        inflight=len(self._inflight), ttl=self.ttl,
+                        running=bool(self._thread and self._thread.is_alive()))
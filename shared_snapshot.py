@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Shared Snapshot
+跨進程共享快照 - 多個 gunicorn worker 讀取同一份最新數據
+
+- 每個段（如 portfolio.<賬戶>）由一個很小的 mmap 控制文件和不可變的數據文件組成，
+  目錄默認在 /dev/shm（共享內存 tmpfs），數據不經過磁盤
+- 控制文件保存版本號和數據長度，用序號鎖（seqlock）更新：讀取方只讀幾個字節的共享內存，
+  不加鎖、不做系統調用即可知道是否有新版本
+- 數據文件按版本命名，寫入後不再修改；worker 直接用 sendfile 發送文件，不解析 JSON。
+  新版本發布後保留最近幾個舊文件，剛讀到舊版本號的請求仍可打開；已打開的文件刪除後也可讀完
+- 寫入方持有控制文件的 flock（同時持有進程內的線程鎖），同一段同時只有一個寫入方。
+  flock 使用非阻塞模式並在重試之間讓出（gevent worker 中阻塞的系統調用會停住整個進程的 greenlet）
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    from gevent import sleep as cooperative_sleep  # gevent worker 中只讓出當前 greenlet
+except ImportError:
+    from time import sleep as cooperative_sleep
+
+CONTROL_FORMAT = '<QQQ'  # seq（奇數表示正在寫入）, version, length
+CONTROL_SIZE = 4096
+KEEP_FILES = 3  # 保留最近幾個版本的數據文件
+SHM_ROOT = Path('/dev/shm')
+LOCK_RETRY_MIN = 0.001  # 等待其他進程釋放 flock 的重試間隔（秒，指數增長）
+LOCK_RETRY_MAX = 0.05
+
+
+def default_directory(data_file):
+    """按數據文件的絕對路徑得到共享目錄，同一部署的 worker 共用，不同部署互不干擾"""
+    digest = hashlib.sha1(str(Path(data_file).resolve()).encode('utf-8')).hexdigest()[:12]
+    root = SHM_ROOT if SHM_ROOT.is_dir() else Path(tempfile.gettempdir())
+    return root / f'ib-portfolio-{digest}'
+
+
+class SharedSegment:
+    """一個共享快照段"""
+
+    def __init__(self, directory, name):
+        self.directory = Path(directory)
+        self.name = name
+        self._thread_lock = threading.Lock()
+        self._fd = os.open(self.directory / f'{name}.ctl', os.O_RDWR | os.O_CREAT, 0o644)
+        with self._exclusive():
+            if os.fstat(self._fd).st_size < CONTROL_SIZE:
+                os.ftruncate(self._fd, CONTROL_SIZE)
+        self._control = mmap.mmap(self._fd, CONTROL_SIZE)
+
+    @contextmanager
+    def _exclusive(self):
+        # flock 只在進程之間互斥，同一進程的線程共用文件描述符，需要再加線程鎖
+        with self._thread_lock:
+            delay = LOCK_RETRY_MIN
+            while True:
+                try:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    cooperative_sleep(delay)
+                    delay = min(delay * 2, LOCK_RETRY_MAX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def lock(self):
+        """寫入鎖（跨進程），讀取-修改-發布需要在鎖內完成"""
+        return self._exclusive()
+
+    def _read_control(self):
+        while True:
+            seq, version, length = struct.unpack_from(CONTROL_FORMAT, self._control)
+            if seq % 2:
+                cooperative_sleep(0)  # 寫入中，讓出後重試
+                continue
+            if struct.unpack_from('<Q', self._control)[0] == seq:
+                return version, length
+
+    @property
+    def version(self):
+        """已發布的最新版本（0 表示尚未發布）"""
+        return self._read_control()[0]
+
+    def path_for(self, version):
+        return self.directory / f'{self.name}@{version}.json'
+
+    def current(self):
+        """返回 (版本, 數據文件路徑)，尚未發布時返回 (0, None)"""
+        version, _ = self._read_control()
+        return version, (self.path_for(version) if version else None)
+
+    def publish(self, body, version):
+        """發布一個版本（在 lock() 內調用）：先寫好數據文件，再更新控制文件"""
+        path = self.path_for(version)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f'.{self.name}@')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+        seq = struct.unpack_from('<Q', self._control)[0]
+        struct.pack_into('<Q', self._control, 0, seq + 1)
+        struct.pack_into('<QQ', self._control, 8, version, len(body))
+        struct.pack_into('<Q', self._control, 0, seq + 2)
+        self._prune(version)
+
+    def _prune(self, version):
+        files = sorted(self.directory.glob(f'{self.name}@*.json'),
+                       key=lambda p: int(p.stem.rsplit('@', 1)[1]))
+        for path in files[:-KEEP_FILES]:
+            if path != self.path_for(version):
+                path.unlink(missing_ok=True)
+
+    def close(self):
+        self._control.close()
+        os.close(self._fd)
+
+
+class SharedSnapshots:
+    """共享目錄中的所有段"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def segment(self, name):
+        with self._lock:
+            segment = self._segments.get(name)
+            if segment is None:
+                segment = self._segments[name] = SharedSegment(self.directory, name)
+            return segment
+
+    def exists(self, name):
+        return name in self._segments or (self.directory / f'{name}.ctl').exists()
+
+    def names(self, prefix=''):
+        """目錄中已存在的段名（包括其他進程創建的）"""
+        return sorted(p.stem for p in self.directory.glob(f'{prefix}*.ctl'))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Snapshot Store
+快照存儲 - 數據文件的唯一讀寫入口
+
+保存時原子寫入文件並保留已解析的數據，API 和雲端上傳直接讀取內存中的快照，
+只有文件被外部程序修改（修改時間變化）時才重新解析。
+保存成功後通知已註冊的監聽器（例如雲端同步）。
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """持倉數據快照存儲"""
+
+    def __init__(self, data_file):
+        self.data_file = Path(data_file)
+        self.version = 0  # 每次保存或重新載入後遞增
+        self._data = None
+        self._mtime = None
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    def add_listener(self, listener):
+        """註冊保存成功後的回調 listener(portfolio_data, version)"""
+        self._listeners.append(listener)
+
+    def save(self, portfolio_data):
+        """原子寫入數據文件並更新內存快照"""
+        with self._lock:
+            temp_file = str(self.data_file) + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(portfolio_data, f, indent=2, ensure_ascii=False)
+            os.replace(temp_file, self.data_file)
+            self._data = portfolio_data
+            self._mtime = self.data_file.stat().st_mtime
+            self.version += 1
+            version = self.version
+
+        for listener in self._listeners:
+            try:
+                listener(portfolio_data, version)
+            except Exception as e:
+                logger.error(f"Snapshot listener failed: {e}")
+        return version
+
+    def get(self):
+        """返回最新的已解析快照（沒有數據文件時返回 None），調用方不應修改"""
+        with self._lock:
+            try:
+                mtime = self.data_file.stat().st_mtime
+            except FileNotFoundError:
+                self._data = None
+                self._mtime = None
+                return None
+            if self._data is None or mtime != self._mtime:
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+                self._mtime = mtime
+                self.version += 1
+            return self._data
+
+    def exists(self):
+        return self.data_file.exists()
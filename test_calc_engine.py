@@ -0,0 +1,83 @@
+"""
+測試增量計算引擎：大量 tick 之後增量維護的匯總與從頭重新計算一致
+不需要 TWS 連接
+"""
+
+import random
+
+import calc_engine
+
+
+def option(symbol, strike, con_id):
+    return {
+        'account': 'U1234567', 'symbol': symbol, 'secType': 'OPT', 'currency': 'USD',
+        'expiry': '20991217', 'right': 'P', 'strike': strike, 'position': -3,
+        'avgCost': 123.45, 'multiplier': '100', 'conId': con_id
+    }
+
+
+def stock(symbol, con_id):
+    return {
+        'account': 'U1234567', 'symbol': symbol, 'secType': 'STK', 'currency': 'USD',
+        'position': 1000, 'avgCost': 98.7654, 'conId': con_id
+    }
+
+
+def make_engine(count=40):
+    engine = calc_engine.CalcEngine()
+    for i in range(count):
+        pos = option(f'S{i}', 100.0 + i * 0.5, i) if i % 2 else stock(f'S{i}', i)
+        engine.set_position(i, pos)
+    engine.set_underlying_prices({f'S{i}': {'price': 100.0 + i} for i in range(count)})
+    engine.refresh()
+    return engine
+
+
+def tick(engine, rng, count=40):
+    key = rng.randrange(count)
+    engine.market_data[key] = {'last': rng.uniform(0.01, 1e5) if rng.random() < 0.5 else rng.uniform(0.01, 1)}
+    engine.touch(key)
+    engine.refresh()
+
+
+def rebuilt_totals(engine):
+    rebuilt = calc_engine.Aggregates.build((engine.records[key], engine.rows[key]) for key in engine.records)
+    return rebuilt.totals
+
+
+def max_error(engine):
+    expected = rebuilt_totals(engine)
+    return max(abs(engine.aggregates.totals[key] - value) for key, value in expected.items())
+
+
+def test_incremental_matches_rebuild(monkeypatch):
+    """20000 次增量更新後，匯總與從頭重新計算的結果一致（定期重建消除累積誤差）"""
+    monkeypatch.setattr(calc_engine, 'AGGREGATE_REBUILD_EVERY', 2000)
+    engine = make_engine()
+    rng = random.Random(7)
+    for _ in range(20000):
+        tick(engine, rng)
+    assert engine.aggregates.applied < 2000  # 最近一次重建後的增量次數
+    assert max_error(engine) < 1e-6
+
+    cached = engine.snapshot()['calculations']
+    assert engine.snapshot()['calculations']['us_options'] is cached['us_options']  # 持倉未變化時重用
+    assert engine.snapshot({'NetLiquidation': {'value': '1000', 'currency': 'USD'}})[
+        'calculations']['summary']['net_liquidation_usd'] == 1000
+
+
+def test_rebuild_removes_drift(monkeypatch):
+    """不重建時累積誤差會留在匯總中；重建後移除全部持倉的總計回到 0"""
+    monkeypatch.setattr(calc_engine, 'AGGREGATE_REBUILD_EVERY', 10 ** 9)
+    engine = make_engine()
+    rng = random.Random(7)
+    for _ in range(5000):
+        tick(engine, rng)
+    assert max_error(engine) > 0
+
+    monkeypatch.setattr(calc_engine, 'AGGREGATE_REBUILD_EVERY', 1)
+    for key in list(engine.positions):
+        del engine.positions[key]
+        engine.touch(key)
+    engine.refresh()
+    assert all(value == 0 for value in engine.aggregates.totals.values())
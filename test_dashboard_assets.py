@@ -0,0 +1,127 @@
+"""
+測試儀表板靜態資源：外殼和資源的大小、緩存頭、壓縮協商和 ETag
+不需要啟動服務器（測試 app_production / app_asgi / app.py 共用的響應邏輯）
+dashboard、original_size、shell_body 由 conftest.py 的 fixture 提供，每個源文件一次
+"""
+
+import gzip
+import json
+import re
+
+from dashboard_assets import ASSET_PREFIX, IMMUTABLE_CACHE_CONTROL, STATE_ELEMENT_ID, initial_state
+
+# 大小上限（字節）：外殼應能在一個往返內到達（初始擁塞窗口約 14 KB）
+MAX_SHELL_BYTES = 16 * 1024
+MAX_SHELL_GZIP_BYTES = 4 * 1024
+
+
+def asset_names(shell_body):
+    return re.findall(rf'{ASSET_PREFIX}(dashboard\.[0-9a-f]+\.(?:css|js))', shell_body.decode('utf-8'))
+
+
+def test_shell(dashboard, original_size):
+    """外殼：很小、每次重新驗證、gzip 協商、ETag 返回 304"""
+    status, headers, body = dashboard.shell()
+    assert status == 200
+    assert headers['Cache-Control'] == 'no-cache', headers
+    assert headers['Content-Type'].startswith('text/html')
+    assert 'Content-Encoding' not in headers
+    assert len(body) <= MAX_SHELL_BYTES, f"shell {len(body)} bytes"
+    assert len(body) < original_size / 5
+    assert b'<style>' not in body and b'<script>' not in body
+
+    status, headers, gz = dashboard.shell('gzip, deflate, br')
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert int(headers['Content-Length']) == len(gz) <= MAX_SHELL_GZIP_BYTES
+    assert gzip.decompress(gz) == body
+
+    status, _, empty = dashboard.shell('gzip', headers['ETag'])
+    assert status == 304 and empty == b''
+    status, headers, _ = dashboard.shell('gzip;q=0')
+    assert 'Content-Encoding' not in headers
+
+
+def test_assets(dashboard, shell_body):
+    """資源：帶哈希的文件名、immutable 長緩存、預壓縮"""
+    names = asset_names(shell_body)
+    assert sorted(n.rsplit('.', 1)[1] for n in names) == ['css', 'js'], names
+    for name in names:
+        status, headers, body = dashboard.asset(name)
+        assert status == 200
+        assert headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+        assert headers['ETag'].strip('"') in name
+
+        status, gz_headers, gz = dashboard.asset(name, 'gzip')
+        assert gz_headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(gz) == body
+        assert dashboard.asset(name, 'gzip', gz_headers['ETag'])[0] == 304
+
+    assert dashboard.asset('dashboard.000000000000.js') is None
+    assert dashboard.asset('../app.py') is None
+
+
+def test_handlers_present(dashboard, shell_body):
+    """外殼中 onclick 調用的函數都在 JS 資源中定義"""
+    js_name = next(n for n in asset_names(shell_body) if n.endswith('.js'))
+    js = dashboard.asset(js_name)[2].decode('utf-8')
+    handlers = set(re.findall(r'on(?:click|change)="(\w+)\(', shell_body.decode('utf-8')))
+    missing = [h for h in handlers if not re.search(rf'(function\s+{h}\b|\b{h}\s*=)', js)]
+    assert not missing, missing
+
+
+def sample_state():
+    portfolio = {
+        'last_update': '2025-01-02T10:00:00',
+        'source': 'tws',
+        'errors': ['x'],
+        'positions': [
+            {'symbol': 'AAPL', 'position': 100, 'historical_data': [1, 2, 3]},
+            {'symbol': '</script><script>alert(1)</script>', 'note': '<!-- x -->', 'position': 1}
+        ]
+    }
+    summary = {'version': 3, 'computed_at': 'now', 'calculations': {'summary': {'usd_to_hkd': 7.8}},
+               'expiry_timeline': [], 'margin': {'total': 1}}
+    return initial_state(portfolio, summary, status={'tws_connected': True})
+
+
+def test_initial_state(dashboard, shell_body):
+    """內嵌初始狀態：可見字段、轉義、按標記緩存、ETag 與普通外殼不同"""
+    state = sample_state()
+    calls = []
+
+    def build_state():
+        calls.append(1)
+        return state
+
+    status, headers, body = dashboard.shell(state=build_state, state_tag='v3')
+    assert status == 200 and headers['Cache-Control'] == 'no-cache'
+    html = body.decode('utf-8')
+    match = re.search(rf'<script id="{STATE_ELEMENT_ID}" type="application/json">(.*?)</script>', html, re.S)
+    assert match, 'initial state missing'
+    assert html.index(match.group(0)) < html.index('</head>')
+    assert '</script><script>alert' not in html and '<!-- x' not in html
+    parsed = json.loads(match.group(1))
+    assert parsed == json.loads(json.dumps(state)), parsed
+    assert 'errors' not in parsed['portfolio'] and 'source' not in parsed['portfolio']
+    assert 'historical_data' not in parsed['portfolio']['positions'][0]
+    assert set(parsed['summary']) == {'calculations', 'expiry_timeline', 'margin'}
+    assert body.replace(match.group(0).encode('utf-8') + b'\n', b'') == shell_body
+    assert headers['ETag'] != dashboard.shell()[1]['ETag']
+
+    _, gz_headers, gz = dashboard.shell('gzip', state=build_state, state_tag='v3')
+    assert gzip.decompress(gz) == body and len(calls) == 1
+    assert dashboard.shell('gzip', gz_headers['ETag'], state=build_state, state_tag='v3')[0] == 304
+    dashboard.shell(state=build_state, state_tag='v4')
+    assert len(calls) == 2
+    assert dashboard.shell(state=lambda: None, state_tag='empty')[2] == shell_body
+
+
+def test_first_load_smaller(dashboard, shell_body):
+    """首次加載（外殼 + 資源，gzip）小於原始單文件 gzip，再次訪問只需驗證外殼"""
+    shell_gzip = len(dashboard.shell('gzip')[2])
+    assets_gzip = sum(len(dashboard.asset(name, 'gzip')[2]) for name in asset_names(shell_body))
+    with open(dashboard.source, 'rb') as f:
+        original_gzip = len(gzip.compress(f.read(), 9))
+    assert shell_gzip + assets_gzip < original_gzip
+    assert shell_gzip < original_gzip / 5
@@ -0,0 +1,68 @@
+"""
+測試到期時間線：按到期日分桶的接貨資金、價內部分、累計資金需求和轉倉候選，以及多賬戶合併視圖
+不需要 TWS 連接
+"""
+
+from datetime import date
+
+from account_registry import ConsolidatedView
+from expiry_timeline import build_timeline
+
+TODAY = date(2099, 12, 1)
+
+
+def short_option(symbol, expiry, strike, right='P', position=-1, currency='USD', price=2.0):
+    return {
+        'symbol': symbol, 'secType': 'OPT', 'currency': currency, 'expiry': expiry,
+        'right': right, 'strike': strike, 'position': position, 'multiplier': '100',
+        'current_price': price, 'conId': hash((symbol, expiry, strike, right)) & 0xffffff
+    }
+
+
+def test_bucketing():
+    """同一到期日的接貨資金合併到同一天，價內部分和累計資金需求分開統計"""
+    positions = [
+        short_option('SPY', '20991203', 500.0, position=-2),   # 價內（SPY 490）
+        short_option('SPY', '20991203', 480.0),                # 價外
+        short_option('QQQ', '20991208', 400.0),
+        short_option('QQQ', '20991208', 420.0, right='C'),     # Call 沒有接貨資金
+        short_option('700', '20991203', 300.0, currency='HKD'),
+        dict(short_option('SPY', '20991203', 450.0), position=1),  # 買入的期權不計入
+    ]
+    prices = {'SPY': {'price': 490.0}, 'QQQ': {'price': 430.0}, '700': {'price': 320.0}}
+    timeline = build_timeline(positions, prices, today=TODAY)
+
+    assert timeline['dates'][0] == '2099-12-01' and len(timeline['dates']) == 8
+    usd = timeline['currencies']['USD']
+    assert usd['assignment_capital'][2] == 500.0 * 200 + 480.0 * 100
+    assert usd['itm_assignment_capital'][2] == 500.0 * 200
+    assert usd['assignment_capital'][7] == 400.0 * 100
+    assert usd['cumulative_cash_need'][-1] == 500.0 * 200 + 480.0 * 100 + 400.0 * 100
+    assert timeline['currencies']['HKD']['assignment_capital'][2] == 300.0 * 100
+
+    calendar = timeline['expiries']
+    assert list(zip(calendar['day'], calendar['currency'], calendar['contracts'])) == [
+        (2, 'HKD', 1), (2, 'USD', 3), (7, 'USD', 2)
+    ]
+    assert [(c['symbol'], c['strike']) for c in timeline['roll_candidates']] == [
+        ('SPY', 500.0), ('SPY', 480.0), ('QQQ', 420.0)
+    ]
+
+
+def test_consolidated_timeline():
+    """合併視圖由所有賬戶的持倉和合併後的底層股票價格建立時間線"""
+    view = ConsolidatedView()
+    view.update_account('first', {
+        'positions': [short_option('SPY', '20991217', 500.0, position=-2)],
+        'underlying_prices': {'SPY': {'price': 510.0}}
+    }, 1)
+    view.update_account('second', {
+        'positions': [short_option('SPY', '20991217', 500.0), short_option('QQQ', '20991217', 400.0)],
+        'underlying_prices': {'SPY': {'price': 490.0}, 'QQQ': {'price': 410.0}}
+    }, 1)
+    snapshot = view.snapshot()
+    assert snapshot['underlying_prices']['SPY']['price'] == 490.0  # 最近更新的賬戶
+    timeline = snapshot['expiry_timeline']
+    assert timeline['expiries']['contracts'] == [4]
+    assert timeline['expiries']['capital'] == [500.0 * 300 + 400.0 * 100]
+    assert timeline['expiries']['itm_capital'] == [500.0 * 300]
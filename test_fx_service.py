@@ -0,0 +1,57 @@
+"""
+測試匯率服務：ExchangeRate 先於賬戶 Currency 到達、切換基礎貨幣
+不需要 TWS 連接
+"""
+
+from fx_service import FxService
+
+
+def assert_close(actual, expected):
+    assert abs(actual - expected) < 1e-9, f"{actual} != {expected}"
+
+
+def test_rates_before_currency():
+    """ExchangeRate 在 Currency 之前到達時暫存，收到 Currency 後以它為報價貨幣"""
+    fx = FxService()  # 臨時基礎貨幣 HKD
+    fx.update_from_account_value('ExchangeRate', '1.00', 'USD')
+    fx.update_from_account_value('ExchangeRate', '0.128', 'HKD')
+    fx.update_from_account_value('ExchangeRate', '1.08', 'EUR')
+    assert fx.rate('USD', 'HKD') == 7.8  # 仍使用後備匯率
+    fx.update_from_account_value('Currency', 'USD', 'USD')
+    assert fx.base_currency == 'USD'
+    assert_close(fx.rate('HKD', 'USD'), 0.128)
+    assert_close(fx.rate('EUR', 'USD'), 1.08)
+    assert not fx.is_stale('HKD') and not fx.is_stale('EUR')
+
+
+def test_switch_base_without_rate():
+    """切換到沒有直接匯率的基礎貨幣時經已有匯率換算，不修改已保存的匯率"""
+    fx = FxService()
+    fx.update_from_account_value('Currency', 'HKD', 'HKD')
+    fx.update_from_account_value('ExchangeRate', '7.8', 'USD')
+    fx.update_from_account_value('ExchangeRate', '8.4', 'EUR')
+    fx.set_base_currency('EUR')
+    assert_close(fx.rate('USD', 'EUR'), 7.8 / 8.4)
+    assert_close(fx.rate('HKD', 'EUR'), 1 / 8.4)
+    fx.set_base_currency('HKD')
+    assert_close(fx.rate('USD', 'HKD'), 7.8)
+    restored = FxService.from_dict(fx.to_dict())
+    assert_close(restored.rate('EUR', 'USD'), 8.4 / 7.8)
+
+
+def test_restored_rates_without_timestamp_are_stale():
+    """數據文件中沒有更新時間的匯率恢復後視為過期，重新收到匯率後不再過期"""
+    fx = FxService.from_dict({
+        'base_currency': 'HKD',
+        'rates': {
+            'USD': {'rate': 7.8, 'updated': None, 'source': 'account_values'},
+            'EUR': {'rate': 8.4, 'source': 'account_values'},
+            'JPY': {'rate': 0.05, 'updated': 1000.0, 'source': 'idealpro'}
+        }
+    })
+    assert_close(fx.rate('USD', 'HKD'), 7.8)
+    assert fx.is_stale('USD') and fx.is_stale('EUR') and fx.is_stale('JPY')
+    assert fx.to_dict()['rates']['USD']['age_seconds'] is None
+    fx.update_from_account_value('Currency', 'HKD', 'HKD')
+    fx.update_from_account_value('ExchangeRate', '7.81', 'USD')
+    assert not fx.is_stale('USD')
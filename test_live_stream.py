@@ -0,0 +1,40 @@
+"""
+測試實時推送：tick 合併為事件、tick 之後按間隔補發 summary 事件、SSE 消息格式
+不需要 TWS 連接
+"""
+
+import json
+
+from live_stream import LiveUpdates
+from ws_hub import sse_message
+
+
+def test_summary_follows_ticks():
+    """推送 tick 後發送 summary，間隔內的後續 tick 延後到下一個周期"""
+    totals = {'us_options': {'total_pnl': 0}}
+    updates = LiveUpdates(summarize=lambda: {'calculations': dict(totals)}, summary_interval=0)
+    assert updates.flush_summary() is None  # 沒有 tick 時不發送
+
+    updates.publish(123456, {'last': 3.0})
+    updates.flush()
+    totals['us_options'] = {'total_pnl': 50}
+    updates.flush_summary()
+    events = updates.events_after(0)
+    assert [event[1] for event in events] == ['ticks', 'summary']
+    assert events[1][2]['calculations']['us_options']['total_pnl'] == 50
+    assert updates.flush_summary() is None
+
+    updates.summary_interval = 60
+    updates.publish(123456, {'last': 3.1})
+    updates.flush()
+    assert updates.flush_summary() is None  # 等待下一個周期
+    updates.summary_interval = 0
+    assert updates.flush_summary() == updates.seq
+
+
+def test_sse_message_with_id():
+    """本地服務器的 SSE 消息帶事件 id，Railway 的消息不帶"""
+    message = sse_message({'type': 'summary', 'calculations': {}}, 7)
+    assert message.startswith('id: 7\nevent: summary\ndata: ')
+    assert json.loads(message.split('data: ', 1)[1]) == {'type': 'summary', 'calculations': {}}
+    assert sse_message({'type': 'hello'}).startswith('event: hello\n')
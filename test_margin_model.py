@@ -0,0 +1,60 @@
+"""
+測試保證金估算：候選持倉的驗證和轉換、只估算 USD 持倉的限制
+不需要 TWS 連接
+"""
+
+import pytest
+
+from margin_model import MarginModel, reg_t_short_option
+
+
+def portfolio():
+    return {
+        'underlying_prices': {'SPY': {'price': 500.0}, '700': {'price': 320.0}},
+        'positions': [
+            {'symbol': 'SPY', 'secType': 'OPT', 'currency': 'USD', 'right': 'P', 'strike': 480.0,
+             'position': -1, 'current_price': 2.0, 'multiplier': '100', 'expiry': '20991217'},
+            {'symbol': '700', 'localSymbol': 'TCH 991230 300.00 P', 'secType': 'OPT', 'currency': 'HKD',
+             'right': 'P', 'strike': 300.0, 'position': -10, 'current_price': 5.0, 'multiplier': '100',
+             'expiry': '20991230'}
+        ],
+        'account_summary': {'AvailableFunds': {'value': '100000', 'currency': 'USD'}}
+    }
+
+
+def test_screen_validates_candidates():
+    """無效的候選返回 error，不影響其他候選；空的 premium / right / quantity 使用預設值"""
+    model = MarginModel(portfolio())
+    results = model.screen([
+        {'symbol': 'SPY', 'strike': '470', 'premium': None, 'quantity': None, 'right': None,
+         'expiry': 20991217},
+        {'symbol': 'SPY'},
+        {'symbol': 'SPY', 'strike': 470, 'quantity': 0},
+        {'symbol': 'SPY', 'strike': 470, 'right': 'X'},
+        {'symbol': 'SPY', 'strike': 470, 'expiry': '2099-12-17'},
+        {'symbol': 'QQQ', 'strike': 400},
+        'SPY 470 P'
+    ])
+    valid = results[0]
+    assert (valid['strike'], valid['premium'], valid['quantity'], valid['right'], valid['expiry']) == (
+        470.0, 0.0, -1, 'P', '20991217'
+    )
+    assert valid['reg_t_change'] == reg_t_short_option('P', 470.0, 500.0, 0.0, -1)
+    assert valid['available_funds_after_reg_t'] == 100000 - valid['reg_t_change']
+    assert [r['error'].split(':')[0] for r in results[1:]] == ['Invalid candidate'] * 4 + [
+        'No underlying price', 'Invalid candidate'
+    ]
+
+
+def test_only_usd_positions_are_estimated():
+    """非 USD 持倉不計入保證金，在 non_usd_positions 中列出"""
+    data = portfolio()
+    model = MarginModel(data)
+    current = model.current()
+    assert current['reg_t_requirement'] == pytest.approx(reg_t_short_option('P', 480.0, 500.0, 2.0, -1))
+    assert current['non_usd_positions'] == ['TCH 991230 300.00 P']
+    assert current['unpriced_positions'] == []
+    assert '700' not in model.scenarios
+
+    data['positions'] = data['positions'][:1]
+    assert MarginModel(data).current()['reg_t_requirement'] == current['reg_t_requirement']
@@ -0,0 +1,117 @@
+"""
+測試多賬戶持有同一合約：計算引擎、雲端計算、差量和合併視圖都按 (賬戶, conId) 區分持倉
+不需要 TWS 連接
+"""
+
+import tempfile
+from pathlib import Path
+
+import calc_engine
+from account_registry import ConsolidatedView
+from ingest_store import IngestStore
+from portfolio_delta import DERIVED_FIELDS, apply_delta, build_delta
+from portfolio_summary import with_derived_fields
+
+ACCOUNTS = ('U1234567', 'U7654321')
+CAPITAL_PER_ACCOUNT = (500 - 3.0) * 2 * 100  # 每個賬戶賣出 2 張行權價 500 的 SPY Put，權利金 3.00
+
+
+def spy_put(account):
+    return {
+        'account': account,
+        'account_id': calc_engine.account_alias(account),
+        'symbol': 'SPY',
+        'secType': 'OPT',
+        'currency': 'USD',
+        'expiry': '20991217',
+        'right': 'P',
+        'strike': 500.0,
+        'position': -2,
+        'avgCost': 300.0,
+        'multiplier': '100',
+        'conId': 123456
+    }
+
+
+def engine_snapshot():
+    engine = calc_engine.CalcEngine()
+    for account in ACCOUNTS:
+        engine.set_position((account, 'SPY_20991217_P_500.0'), spy_put(account),
+                            quote_key='SPY_20991217_P_500.0')
+    engine.set_underlying_prices({'SPY': {'price': 550.0}})
+    snapshot = engine.snapshot()
+    return {
+        'positions': calc_engine.public_positions(snapshot['positions']),
+        'underlying_prices': {'SPY': {'price': 550.0}},
+        'calculations': snapshot['calculations']
+    }
+
+
+def test_engine_and_public_positions():
+    """引擎保留真實賬戶，保存的持倉使用不同的賬戶別名"""
+    data = engine_snapshot()
+    assert len(data['positions']) == 2
+    assert [p['account'] for p in data['positions']] == ['U****567', 'U****321']
+    assert data['calculations']['us_options']['max_capital_required'] == 2 * CAPITAL_PER_ACCOUNT
+
+
+def test_cloud_calculation():
+    """雲端重新計算不合併不同賬戶的同一合約"""
+    calculations = calc_engine.calculate_cloud_data(engine_snapshot(), recompute=True)
+    assert len(calculations['us_options']['positions']) == 2
+    assert calculations['us_options']['max_capital_required'] == 2 * CAPITAL_PER_ACCOUNT
+
+
+def test_delta():
+    """差量按賬戶 + conId 區分，只修改其中一個賬戶的持倉"""
+    previous = engine_snapshot()
+    current = dict(previous, positions=[dict(previous['positions'][0], position=-3), previous['positions'][1]])
+    delta = build_delta(previous, current, 1)
+    assert len(delta['positions_upsert']) == 1 and not delta['positions_removed']
+    assert not set(DERIVED_FIELDS) & set(delta['fields'])  # 衍生字段由接收端重新計算
+    applied = apply_delta(previous, delta)
+    assert [p['position'] for p in applied['positions']] == [-3, -2]
+    assert apply_delta({}, build_delta({}, previous, 0))['positions'] == previous['positions']
+
+
+def test_ingest_recomputes_derived():
+    """接收端應用差量後由持倉重新計算衍生字段"""
+    previous = engine_snapshot()
+    current = dict(previous, positions=[dict(previous['positions'][0], position=-3), previous['positions'][1]])
+    with tempfile.TemporaryDirectory() as tmp:
+        store = IngestStore(Path(tmp) / 'portfolio.json', derive=with_derived_fields)
+        store.replace(dict(previous))
+        store.apply(build_delta(previous, current, store.version))
+        capital = store.get()['calculations']['us_options']['max_capital_required']
+        assert capital == CAPITAL_PER_ACCOUNT * 5 / 2, capital
+        assert store.get()['summary']['total_positions'] == 2
+        reloaded = IngestStore(Path(tmp) / 'portfolio.json', derive=with_derived_fields)
+        assert reloaded.get()['calculations'] == store.get()['calculations']
+
+
+def test_consolidated_view():
+    """合併視圖保留同一文檔中不同賬戶的持倉"""
+    view = ConsolidatedView()
+    view.update_account('default', engine_snapshot(), 1)
+    snapshot = view.snapshot()
+    assert len(snapshot['positions']) == 2
+    assert snapshot['calculations']['us_options']['max_capital_required'] == 2 * CAPITAL_PER_ACCOUNT
+
+
+def test_position_index_strikes_and_rights():
+    """同一底層和到期日、不同行權價或方向的持倉各自保留，更新和移除只影響自己"""
+    put = spy_put(ACCOUNTS[0])
+    lower_put = dict(put, strike=480.0, conId=123457)
+    call = dict(put, right='C', strike=600.0, conId=123458)
+    index = calc_engine.PositionIndex([put, lower_put, call])
+    assert index.find('SPY', '20991217') == [put, lower_put, call]
+
+    moved = dict(lower_put, position=-5)
+    key = index.add(moved)
+    assert index.find('SPY', '20991217') == [put, call, moved]
+    assert index.by_underlying['SPY'] == [put, call, moved]
+
+    index.remove(calc_engine.position_key(put))
+    assert index.find('SPY', '20991217') == [call, moved]
+    assert index.by_expiry['20991217'] == [call, moved]
+    assert index.get(key) is moved and len(index) == 2
@@ -0,0 +1,85 @@
+"""
+測試 FMP 報價獲取：批次並發、結果順序、部分失敗、截止時間和報價緩存
+使用本地的假 FMP 服務器（conftest.py 的 base_url），不需要 API key，不訪問外網
+"""
+
+import threading
+import time
+
+import pytest
+
+from http_client import HttpClient
+from quote_cache import FmpQuotes, PartialQuotes, QuoteCache
+from testing_helpers import FakeFmp
+
+BATCH_SIZE = 50
+PARALLEL = 4
+
+
+def make_quotes(base_url, **kwargs):
+    # 不自動重試，失敗的批次立即返回
+    return FmpQuotes(HttpClient(retries=0), 'test', base_url=base_url, batch_size=BATCH_SIZE,
+                     parallel=PARALLEL, **kwargs)
+
+
+def test_concurrent_order(base_url):
+    """230 個股票分 5 個批次並發請求，結果按請求順序排列"""
+    symbols = [f'S{i:03d}' for i in range(230)]
+    prices = make_quotes(base_url).fetch(symbols)
+    assert list(prices) == symbols
+    assert len(FakeFmp.requests) == 5
+    assert 1 < FakeFmp.max_active <= PARALLEL
+
+
+def test_partial_failure(base_url):
+    """一個批次失敗時返回其他批次的報價，並列出失敗的股票"""
+    symbols = [f'S{i:03d}' for i in range(120)]
+    symbols[60] = 'FAIL'
+    with pytest.raises(PartialQuotes) as error:
+        make_quotes(base_url).fetch(symbols)
+    assert error.value.failed == symbols[50:100]
+    assert list(error.value.quotes) == symbols[:50] + symbols[100:]
+
+
+def test_deadline(base_url):
+    """慢批次超過截止時間時不等待它，其他批次照常返回"""
+    symbols = [f'S{i:03d}' for i in range(150)]
+    symbols[10] = 'SLOW'
+    start = time.perf_counter()
+    with pytest.raises(PartialQuotes) as error:
+        make_quotes(base_url, deadline=1).fetch(symbols)
+    assert time.perf_counter() - start < FakeFmp.SLOW_SECONDS - 1
+    assert error.value.failed == symbols[:50]
+    assert list(error.value.quotes) == symbols[50:]
+
+
+def test_cache_coalescing(base_url):
+    """20 個並發請求相同的 120 個股票，上游只請求一次（3 個批次）"""
+    symbols = [f'S{i:03d}' for i in range(120)] + ['NONE1']
+    cache = QuoteCache(make_quotes(base_url).fetch, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_many(symbols))) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(FakeFmp.requests) == 3
+    assert all(len(r) == 120 and 'NONE1' not in r for r in results)
+    cache.get_many(symbols)
+    assert len(FakeFmp.requests) == 3  # 上游沒有的股票也在 TTL 內緩存
+
+
+def test_cache_keeps_quotes_on_failure(base_url):
+    """上游失敗時保留已緩存的報價（舊報價可用），恢復後刷新"""
+    cache = QuoteCache(make_quotes(base_url).fetch, ttl=0.2, stale=60)
+    first = cache.get_many(['AAPL', 'MSFT'])
+    FakeFmp.failing = True
+    time.sleep(0.3)
+    cache.watch(['AAPL', 'MSFT'])
+    cache.refresh_due()
+    assert cache.get_many(['AAPL', 'MSFT']) == first
+    time.sleep(0.2)  # 等待後台刷新（仍然失敗）完成
+    FakeFmp.failing = False
+    FakeFmp.generation = 2
+    cache.refresh_due()
+    assert cache.get_many(['AAPL'])['AAPL']['price'] == first['AAPL']['price'] * 2
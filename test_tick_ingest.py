@@ -0,0 +1,61 @@
+"""
+測試 tick 接收：批量寫入行情數據、市場關閉時以平均成本作為參考收盤價
+不需要 TWS 連接
+"""
+
+import calc_engine
+from tick_ingest import TickIngest
+
+QUOTE_KEY = 'SPY_20991217_P_500.0'
+
+
+def spy_put():
+    return {
+        'account': 'U1234567',
+        'symbol': 'SPY',
+        'secType': 'OPT',
+        'currency': 'USD',
+        'expiry': '20991217',
+        'right': 'P',
+        'strike': 500.0,
+        'position': -2,
+        'avgCost': 300.0,  # IB 返回每張合約的成本
+        'multiplier': '100',
+        'conId': 123456
+    }
+
+
+def make_ingest():
+    engine = calc_engine.CalcEngine()
+    engine.set_position(('U1234567', QUOTE_KEY), spy_put(), quote_key=QUOTE_KEY)
+    updates = []
+    ingest = TickIngest(engine, {1: QUOTE_KEY}, on_update=lambda key, fields: updates.append((key, fields)))
+    return engine, ingest, updates
+
+
+def test_batch_merges_updates():
+    """同一批中同一合約的字段合併後只推送一次"""
+    engine, ingest, updates = make_ingest()
+    ingest.put(1, 'bid', 2.9)
+    ingest.put(1, 'ask', 3.1)
+    ingest.put(1, 'last', 3.0)
+    assert ingest.flush() == 3
+    assert updates == [(QUOTE_KEY, {'bid': 2.9, 'ask': 3.1, 'last': 3.0})]
+    assert engine.market_data[QUOTE_KEY]['currentPrice'] == 3.0
+
+
+def test_closed_market_uses_avg_cost():
+    """bid 為 -1（市場關閉）時，以持倉的 avgCost 換算為單位價格作為收盤價"""
+    engine, ingest, _ = make_ingest()
+    ingest.put(1, 'bid', -1)
+    ingest.flush()
+    assert engine.market_data[QUOTE_KEY]['close'] == 3.0
+
+
+def test_closed_market_keeps_close():
+    """已有收盤價時不覆蓋"""
+    engine, ingest, _ = make_ingest()
+    ingest.put(1, 'close', 2.5)
+    ingest.put(1, 'bid', -1)
+    ingest.flush()
+    assert engine.market_data[QUOTE_KEY]['close'] == 2.5
@@ -0,0 +1,67 @@
+"""
+測試 WebSocket 廣播：同一個鍵的更新合併、積壓時丟棄並 resync、發送循環由事件喚醒
+不需要網絡連接
+"""
+
+import json
+import queue
+import threading
+
+import ws_hub
+from ws_hub import WebSocketHub
+
+
+def item(key, **fields):
+    return {'key': key, 'id': key, 'account': 'U1234567', 'underlying': 'SPY', 'fields': fields}
+
+
+class FakeSocket:
+    """阻塞的 receive()，close() 後拋出異常（與 simple-websocket 相同）"""
+
+    def __init__(self):
+        self.incoming = queue.Queue()
+        self.sent = queue.Queue()
+
+    def receive(self):
+        message = self.incoming.get()
+        if message is None:
+            raise ConnectionError('closed')
+        return message
+
+    def send(self, data):
+        self.sent.put(json.loads(data))
+
+    def close(self):
+        self.incoming.put(None)
+
+
+def test_coalesced_and_dropped():
+    """合併計入 coalesced，只有積壓清空的更新計入 dropped"""
+    hub = WebSocketHub()
+    client = hub.register()
+    client.offer([item('a', last=1.0), item('a', last=1.1), item('b', bid=2.0)])
+    updates = client.take(0)[0]
+    assert updates['items']['a']['fields'] == {'last': 1.1}
+    assert (updates['coalesced'], updates['dropped']) == (1, 0)
+
+    client.offer([item(f'k{i}', last=i) for i in range(ws_hub.MAX_PENDING_KEYS + 1)])
+    assert [m['type'] for m in client.take(0)] == ['resync']
+    assert hub.stats()['dropped'] == ws_hub.MAX_PENDING_KEYS + 1
+    assert hub.stats()['coalesced'] == 1
+
+
+def test_serve_wakes_on_publish():
+    """發送循環在發布後立即發送（不等待輪詢間隔），連接關閉後註銷"""
+    hub = WebSocketHub()
+    ws = FakeSocket()
+    thread = threading.Thread(target=hub.serve, args=(ws,), daemon=True)
+    thread.start()
+    assert ws.sent.get(timeout=1)['type'] == 'hello'
+
+    hub.publish([item('spy', last=1.0)])
+    updates = ws.sent.get(timeout=1)
+    assert list(updates['items']) == ['spy']
+
+    ws.close()
+    thread.join(timeout=1)
+    assert not thread.is_alive() and len(hub) == 0
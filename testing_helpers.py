@@ -0,0 +1,94 @@
+"""
+測試共用的工具：本地 HTTP 服務器、假 FMP 報價接口和儀表板資源載入
+（pytest fixture 見 conftest.py）
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from dashboard_assets import DashboardAssets
+
+DASHBOARD_SOURCES = ['static/dashboard_new.html', 'dashboard_new.html']
+
+
+@contextmanager
+def local_server(handler):
+    """在 127.0.0.1 的隨機端口上運行 handler，退出時關閉"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class FakeFmp(BaseHTTPRequestHandler):
+    """假的 /api/v3/quote/<股票,...> 接口
+
+    - 包含 FAIL 的批次返回 500，包含 SLOW 的批次等待 SLOW_SECONDS
+    - 第一個批次（S000 開頭）最慢，最後完成；報價倒序返回
+    - 以 NONE 開頭的股票不返回報價（無效代碼）
+    """
+    requests = []
+    active = 0
+    max_active = 0
+    generation = 1
+    failing = False
+    SLOW_SECONDS = 3
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.requests = []
+            cls.active = cls.max_active = 0
+            cls.generation = 1
+            cls.failing = False
+
+    @staticmethod
+    def quote_url(server):
+        return f'http://127.0.0.1:{server.server_port}/api/v3/quote'
+
+    def do_GET(self):
+        symbols = unquote(urlsplit(self.path).path.rsplit('/', 1)[1]).split(',')
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append(symbols)
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            if 'SLOW' in symbols:
+                time.sleep(cls.SLOW_SECONDS)
+            else:
+                time.sleep(0.3 if symbols[0] == 'S000' else 0.05)
+            if cls.failing or 'FAIL' in symbols:
+                self.send_response(500)
+                self.end_headers()
+                return
+            quotes = [{'symbol': s, 'price': float(len(s)) * cls.generation, 'previousClose': 1.0}
+                      for s in reversed(symbols) if not s.startswith('NONE')]
+            body = json.dumps(quotes).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_dashboard(source):
+    """返回 (dashboard, 原始文件大小, 外殼內容)"""
+    dashboard = DashboardAssets(source)
+    with open(source, 'rb') as f:
+        original_size = len(f.read())
+    return dashboard, original_size, dashboard.shell()[2]
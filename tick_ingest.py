@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Tick Ingest
+行情 tick 接收 - EReader 線程只入隊，後台線程批量寫入行情數據
+
+- IB 回調（tickPrice / tickSize / tickGeneric / tickOptionComputation）只查表得到字段名，
+  把 (reqId, 字段, 值, 時間戳) 元組追加到隊列，不做字典合併、計算標記或日誌
+- 隊列為 collections.deque：單個生產者 append、單個消費者 popleft 在 CPython 中是原子操作，
+  入隊不需要加鎖，不會被應用線程阻塞
+- 應用線程每次取出最多 batch_size 個 tick 寫入行情字典，同一批中每個合約只標記一次
+  計算引擎、只推送一次合併後的字段
+- tick 日誌採樣：每 LOG_INTERVAL 秒輸出一行統計，逐個 tick 的日誌只在 DEBUG 級別按比例輸出
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import calc_engine
+
+logger = logging.getLogger(__name__)
+
+# tickType -> 字段名（回調中查表，不再每次創建字典）
+PRICE_FIELDS = {
+    1: 'bid',
+    2: 'ask',
+    4: 'last',
+    6: 'high',
+    7: 'low',
+    9: 'close',
+    14: 'open',
+    37: 'markPrice',
+    68: 'histVolatility',
+    72: 'indexFuturePremium'
+}
+
+SIZE_FIELDS = {
+    0: 'bidSize',
+    3: 'askSize',
+    5: 'lastSize',
+    8: 'volume',
+    21: 'avgVolume',
+    27: 'callOpenInterest',
+    28: 'putOpenInterest',
+    86: 'shortableShares'
+}
+
+GENERIC_FIELDS = {
+    23: 'optionHistoricalVolatility',
+    24: 'optionImpliedVolatility',
+    31: 'indexFuturePremium',
+    49: 'halted',
+    54: 'tradeCount',
+    55: 'tradeRate',
+    56: 'volumeRate',
+    58: 'rtHistoricalVolatility'
+}
+
+GREEK_FIELDS = {
+    10: 'bidGreeks',
+    11: 'askGreeks',
+    12: 'lastGreeks',
+    13: 'modelGreeks'
+}
+
+# 希臘值 tick 的值為元組，順序與 tickOptionComputation 的參數一致
+GREEK_NAMES = ('impliedVolatility', 'delta', 'optionPrice', 'pvDividend',
+               'gamma', 'vega', 'theta', 'underlyingPrice')
+LIVE_GREEK_NAMES = ('delta', 'gamma', 'theta', 'vega', 'impliedVolatility', 'underlyingPrice')
+
+PUSHED_FIELDS = frozenset(PRICE_FIELDS.values())  # 推送給儀表板的行情字段
+CURRENT_PRICE_FIELDS = frozenset(('last', 'close'))
+GREEK_FIELD_NAMES = frozenset(GREEK_FIELDS.values())
+
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_INTERVAL = 0.02  # 隊列為空時的等待間隔
+LOG_INTERVAL = 10  # 統計日誌間隔（秒）
+DEBUG_SAMPLE = 100  # DEBUG 級別每 N 個 tick 輸出一個
+
+
+class TickIngest:
+    """tick 隊列和批量應用線程"""
+
+    def __init__(self, engine, req_id_map, on_update=None,
+                 batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_INTERVAL):
+        self.engine = engine
+        self.req_id_map = req_id_map  # reqId -> 合約鍵（與客戶端共用）
+        self.on_update = on_update  # on_update(合約鍵, 字段) 推送一批中合併後的字段
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = deque()
+        self._apply_lock = threading.Lock()  # 只在消費端使用（應用線程和 flush()）
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.received = 0
+        self.applied = 0
+        self.batches = 0
+        self.max_lag_ms = 0.0
+        self._logged_at = time.monotonic()
+        self._logged_applied = 0
+
+    def put(self, req_id, field, value):
+        """入隊一個 tick（EReader 線程調用）"""
+        self._queue.append((req_id, field, value, time.monotonic()))
+        self.received += 1
+
+    def __len__(self):
+        return len(self._queue)
+
+    def flush(self):
+        """應用隊列中已有的全部 tick，返回應用的數量（保存快照前調用）"""
+        total = 0
+        while True:
+            count = self.drain()
+            if not count:
+                return total
+            total += count
+
+    def drain(self):
+        """取出最多 batch_size 個 tick 並應用，返回取出的數量"""
+        with self._apply_lock:
+            queue = self._queue
+            batch = []
+            for _ in range(min(self.batch_size, len(queue))):
+                batch.append(queue.popleft())
+            if batch:
+                self.apply(batch)
+            return len(batch)
+
+    def apply(self, batch):
+        """把一批 tick 寫入行情數據，每個合約只標記和推送一次"""
+        market_data = self.engine.market_data
+        options_data = self.engine.options_data
+        req_id_map = self.req_id_map
+        touched = {}
+        updates = {}
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        for position, (req_id, field, value, ts) in enumerate(batch):
+            symbol = req_id_map.get(req_id)
+            if symbol is None:
+                continue  # 訂閱已取消
+            touched[symbol] = None
+
+            if field in GREEK_FIELD_NAMES:
+                greeks = dict(zip(GREEK_NAMES, value))
+                options_data.setdefault(symbol, {})[field] = greeks
+                if field == 'modelGreeks':
+                    fields = updates.setdefault(symbol, {})
+                    for name in LIVE_GREEK_NAMES:
+                        fields[name] = greeks[name]
+            else:
+                quote = market_data.get(symbol)
+                if quote is None:
+                    quote = market_data[symbol] = {}
+                quote[field] = value
+                if field in PUSHED_FIELDS:
+                    updates.setdefault(symbol, {})[field] = value
+                    # 如果獲得了last或close價格，也設置為當前價格
+                    if field in CURRENT_PRICE_FIELDS:
+                        quote['currentPrice'] = value
+                    elif field == 'bid' and value == -1:  # bid 為 -1 表示市場關閉
+                        self._close_from_avg_cost(symbol, quote)
+
+            if debug and (self.applied + position) % DEBUG_SAMPLE == 0:
+                logger.debug(f"Tick {symbol} {field}: {value}")
+
+        if touched:
+            self.engine.touch_many(touched)
+        if self.on_update is not None:
+            for symbol, fields in updates.items():
+                try:
+                    self.on_update(symbol, fields)
+                except Exception as e:
+                    logger.error(f"Tick update push failed for {symbol}: {e}")
+
+        self.applied += len(batch)
+        self.batches += 1
+        lag_ms = (time.monotonic() - batch[0][3]) * 1000
+        if lag_ms > self.max_lag_ms:
+            self.max_lag_ms = lag_ms
+
+    def _close_from_avg_cost(self, symbol, quote):
+        """期權沒有收盤價但有平均成本時，使用平均成本作為參考收盤價"""
+        holdings = self.engine.positions_for(symbol)
+        if holdings and holdings[0].get('secType') == 'OPT':
+            # IB 持倉只有 avgCost（每張合約的成本），轉換為與行情相同的單位價格
+            avg_cost = calc_engine.option_unit_cost(holdings[0]) if 'avgCost' in holdings[0] else 0
+            if avg_cost > 0 and 'close' not in quote:
+                quote['close'] = avg_cost
+                logger.info(f"Using avg cost as close price for {symbol}: {avg_cost}")
+
+    def _log_stats(self):
+        now = time.monotonic()
+        elapsed = now - self._logged_at
+        if elapsed < LOG_INTERVAL:
+            return
+        count = self.applied - self._logged_applied
+        if count:
+            logger.info(f"Ticks: {count} applied in {elapsed:.0f}s ({count / elapsed:.0f}/s), "
+                        f"queue {len(self._queue)}, max lag {self.max_lag_ms:.1f} ms")
+        self._logged_at = now
+        self._logged_applied = self.applied
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self.drain():
+                    self._stop.wait(self.interval)
+                self._log_stats()
+            except Exception as e:
+                logger.error(f"Applying ticks failed: {e}")
+                self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='tick-ingest', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'applied': self.applied,
+            'batches': self.batches,
+            'queued': len(self._queue),
+            'max_lag_ms': round(self.max_lag_ms, 1)
+        }
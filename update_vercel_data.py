@@ -1,19 +1,40 @@
 #!/usr/bin/env python3
 """
 更新 Vercel 部署的數據
-這個腳本將本地的 portfolio_data_enhanced.json 複製到前端項目並提交到 GitHub
+cloud_config.json 配置了 "publish" 時，把數據發布到對象存儲（見 vercel_publisher），前端無需重新構建；
+否則將本地的 portfolio_data_enhanced.json 複製到前端項目並提交到 GitHub
 """
 
 import json
 import shutil
 import subprocess
-import os
 from datetime import datetime
 from pathlib import Path
 
+import vercel_publisher
+
+def publish_vercel_data(publisher, source_file=None):
+    """發布模式：只上傳有變化的壓縮數據文件和 manifest"""
+    source_file = source_file or Path(__file__).parent / "portfolio_data_enhanced.json"
+    if not source_file.exists():
+        print("❌ 錯誤：找不到 portfolio_data_enhanced.json")
+        return False
+    with open(source_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    result = publisher.publish(data)
+    if result['success']:
+        print(f"✅ {result['message']} ({result.get('bytes_sent', 0)} bytes)")
+    else:
+        print(f"❌ {result['message']}")
+    return result['success']
+
 def update_vercel_data():
     """更新 Vercel 上的數據"""
     
+    publisher = vercel_publisher.load_publisher(config_file=Path(__file__).parent / "cloud_config.json")
+    if publisher is not None:
+        return publish_vercel_data(publisher)
+    
     # 文件路徑
     source_file = Path(__file__).parent / "portfolio_data_enhanced.json"
     target_dir = Path(__file__).parent / "ib-frontend-clean"
@@ -43,9 +64,6 @@ def update_vercel_data():
         
         print(f"✅ 數據已複製到: {target_file}")
         
-        # 切換到前端目錄
-        os.chdir(target_dir)
-        
         # Git 操作
         commands = [
             ["git", "add", "public/portfolio_data.json"],
@@ -54,7 +72,7 @@ def update_vercel_data():
         ]
         
         for cmd in commands:
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=str(target_dir))
             if result.returncode != 0:
                 print(f"❌ Git 命令失敗: {' '.join(cmd)}")
                 print(f"錯誤: {result.stderr}")
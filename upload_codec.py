@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Upload Codec
+上傳傳輸編碼 - 本地上傳端和 Railway 接收端共用
+
+- Content-Type: application/json 或 application/msgpack（需要 msgpack）
+- Content-Encoding: identity、gzip 或 zstd（需要 zstandard）
+服務器在響應中公佈支持的格式，上傳端據此選擇（內容協商）。
+"""
+
+import gzip
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = 'application/json'
+MSGPACK_TYPE = 'application/msgpack'
+MSGPACK_ALIASES = (MSGPACK_TYPE, 'application/x-msgpack')
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+MAX_DECODED_BYTES = 64 * 1024 * 1024  # 解壓後最大 64MB，防止壓縮炸彈
+
+
+class UnsupportedFormat(Exception):
+    """不支持的 Content-Type 或 Content-Encoding"""
+
+
+class PayloadTooLarge(Exception):
+    """解壓後超過大小限制"""
+
+
+def supported_formats():
+    """本進程支持的格式（服務器公佈給上傳端）"""
+    encodings = ['identity', 'gzip']
+    if zstandard is not None:
+        encodings.insert(0, 'zstd')
+    content_types = [JSON_TYPE]
+    if msgpack is not None:
+        content_types.insert(0, MSGPACK_TYPE)
+    return {'encodings': encodings, 'content_types': content_types}
+
+
+def encode(payload, encoding='identity', content_type=JSON_TYPE):
+    """編碼上傳數據，返回 (body, headers)"""
+    if content_type == MSGPACK_TYPE:
+        if msgpack is None:
+            raise UnsupportedFormat('msgpack is not installed')
+        raw = msgpack.packb(payload, use_bin_type=True)
+    elif content_type == JSON_TYPE:
+        raw = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    else:
+        raise UnsupportedFormat(f'Unsupported content type: {content_type}')
+
+    headers = {'Content-Type': content_type}
+    if encoding == 'gzip':
+        body = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    elif encoding == 'zstd':
+        if zstandard is None:
+            raise UnsupportedFormat('zstandard is not installed')
+        body = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    elif encoding in (None, 'identity'):
+        return raw, headers
+    else:
+        raise UnsupportedFormat(f'Unsupported content encoding: {encoding}')
+    headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+def _gunzip(body):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    raw = decompressor.decompress(body, MAX_DECODED_BYTES + 1)
+    if len(raw) > MAX_DECODED_BYTES or decompressor.unconsumed_tail:
+        raise PayloadTooLarge('Decoded payload exceeds limit')
+    return raw
+
+
+def _unzstd(body):
+    if zstandard is None:
+        raise UnsupportedFormat('zstandard is not installed')
+    reader = zstandard.ZstdDecompressor().stream_reader(body)
+    raw = reader.read(MAX_DECODED_BYTES + 1)
+    if len(raw) > MAX_DECODED_BYTES:
+        raise PayloadTooLarge('Decoded payload exceeds limit')
+    return raw
+
+
+def decode(body, content_encoding=None, content_type=None):
+    """按請求頭解碼上傳數據"""
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding == 'gzip':
+        raw = _gunzip(body)
+    elif encoding == 'zstd':
+        raw = _unzstd(body)
+    elif encoding == 'identity':
+        raw = body
+    else:
+        raise UnsupportedFormat(f'Unsupported content encoding: {encoding}')
+
+    mime = (content_type or JSON_TYPE).split(';')[0].strip().lower()
+    if mime in MSGPACK_ALIASES:
+        if msgpack is None:
+            raise UnsupportedFormat('msgpack is not installed')
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    if mime == JSON_TYPE:
+        return json.loads(raw)
+    raise UnsupportedFormat(f'Unsupported content type: {mime}')
+
+
+def negotiate(preferred_encodings, preferred_types, server_formats):
+    """在本地可用且服務器支持的格式中選擇第一個偏好的格式"""
+    local = supported_formats()
+    server = server_formats or {'encodings': ['identity'], 'content_types': [JSON_TYPE]}
+    encoding = next((e for e in preferred_encodings
+                     if e in local['encodings'] and e in server.get('encodings', [])), 'identity')
+    content_type = next((t for t in preferred_types
+                         if t in local['content_types'] and t in server.get('content_types', [])), JSON_TYPE)
+    return encoding, content_type
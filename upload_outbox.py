@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Upload Outbox
+上傳發件箱 - 待上傳快照的 SQLite 持久化隊列
+
+雲端不可用時快照保存在磁盤上，程序重啟後繼續發送。
+加入新快照時刪除所有更舊的待發送快照（只有最新的快照有意義），
+被替換快照的創建時間、重試次數和下次重試時間由新快照繼承：延遲從第一個未發送的快照開始計算，
+雲端不可用期間的新快照也按原來的退避時間重試。
+"""
+
+import gzip
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    snapshot_version INTEGER,
+    content_hash TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    payload BLOB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class UploadOutbox:
+    """持久化上傳隊列"""
+
+    def __init__(self, db_file):
+        self.db_file = str(db_file)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def enqueue(self, portfolio_data, snapshot_version, content_hash):
+        """加入一個快照並刪除所有更舊的待發送快照，返回被替換的快照數"""
+        payload = gzip.compress(json.dumps(portfolio_data, ensure_ascii=False).encode('utf-8'))
+        with self._lock, self._conn:
+            created_at, attempts, next_attempt_at, last_error = self._conn.execute(
+                'SELECT MIN(created_at), MAX(attempts), MAX(next_attempt_at), '
+                '(SELECT last_error FROM outbox ORDER BY id DESC LIMIT 1) FROM outbox'
+            ).fetchone()
+            removed = self._conn.execute('DELETE FROM outbox').rowcount
+            self._conn.execute(
+                'INSERT INTO outbox (snapshot_version, content_hash, created_at, payload, attempts, '
+                'next_attempt_at, last_error) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (snapshot_version, content_hash, created_at or time.time(), payload,
+                 attempts or 0, next_attempt_at or 0, last_error)
+            )
+        return removed
+
+    def next_entry(self):
+        """最新的待發送快照（不論是否到了重試時間），沒有時返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, snapshot_version, content_hash, created_at, payload, attempts, next_attempt_at '
+                'FROM outbox ORDER BY id DESC LIMIT 1'
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'snapshot_version': row[1],
+            'content_hash': row[2],
+            'created_at': row[3],
+            'payload': row[4],
+            'attempts': row[5],
+            'next_attempt_at': row[6]
+        }
+
+    @staticmethod
+    def load_payload(entry):
+        return json.loads(gzip.decompress(entry['payload']))
+
+    def mark_sent(self, entry):
+        """發送成功：刪除該快照及更舊的快照，記錄已上傳的內容哈希
+
+        發送期間加入的新快照繼承了發送中快照的重試狀態，成功後重置（延遲從這次確認開始計算）。
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM outbox WHERE id <= ?', (entry['id'],))
+            self._conn.execute(
+                'UPDATE outbox SET created_at = MAX(created_at, ?), attempts = 0, next_attempt_at = 0, '
+                'last_error = NULL', (time.time(),)
+            )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                ('last_sent_hash', entry['content_hash'])
+            )
+
+    def mark_failed(self, entry, error, retry_delay):
+        """發送失敗：增加重試次數並安排下次重試時間"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (time.time() + retry_delay, str(error)[:500], entry['id'])
+            )
+
+    def last_sent_hash(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'last_sent_hash'").fetchone()
+        return row[0] if row else None
+
+    def status(self):
+        """隊列深度和延遲（第一個未發送快照的等待秒數，替換時繼承）"""
+        with self._lock:
+            depth, oldest, attempts, last_error, next_attempt_at = self._conn.execute(
+                'SELECT COUNT(*), MIN(created_at), MAX(attempts), '
+                '(SELECT last_error FROM outbox ORDER BY id DESC LIMIT 1), MAX(next_attempt_at) FROM outbox'
+            ).fetchone()
+        now = time.time()
+        return {
+            'queue_depth': depth,
+            'lag_seconds': round(now - oldest, 1) if oldest else 0,
+            'attempts': attempts or 0,
+            'last_error': last_error,
+            'next_retry_in': round(max(next_attempt_at - now, 0), 1) if next_attempt_at else None
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - Vercel Publisher
+靜態數據發布 - 把快照發布到對象存儲 / HTTP 目標，前端無需重新構建
+
+- 只發布儀表板需要的字段，緊湊 JSON 後 gzip 壓縮
+- 內容尋址：數據文件名包含內容哈希（忽略時間戳等易變字段），內容未變化時不重新發送
+- 前端先讀取很小的 manifest.json（不緩存），再讀取它指向的數據文件（永久緩存）
+- 目標可替換：DirectoryTarget（本地目錄 / 測試替身）或 HttpTarget（PUT 到對象存儲）
+
+發布配置在 cloud_config.json 的 "publish" 字段，例如:
+    {"publish": {"target": "http", "base_url": "https://...", "token": "..."}}
+    {"publish": {"target": "directory", "path": "ib-frontend-clean/public"}}
+"""
+
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from cloud_sync import SYNC_CONFIG_FILE, content_hash
+from dashboard_assets import visible_fields
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_KEY = 'data/manifest.json'
+ARTIFACT_PREFIX = 'data/portfolio-'
+ARTIFACT_SUFFIX = '.json.gz'
+HASH_LENGTH = 20
+GZIP_LEVEL = 9  # 每次內容變化只壓縮一次，使用最高壓縮率
+KEEP_ARTIFACTS = 5  # 保留最近幾個數據文件（讀取舊 manifest 的客戶端仍可完成加載）
+
+ARTIFACT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MANIFEST_CACHE_CONTROL = 'no-cache, max-age=0'
+
+
+def build_artifact(portfolio_data):
+    """生成最小的數據文件，返回 (內容哈希, gzip 後的字節)"""
+    data = visible_fields(portfolio_data)
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    return content_hash(data)[:HASH_LENGTH], gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class DirectoryTarget:
+    """本地目錄目標（靜態文件目錄或測試替身）"""
+
+    def __init__(self, path):
+        self.root = Path(path)
+
+    def exists(self, key):
+        return (self.root / key).exists()
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None):
+        """原子寫入：先寫臨時文件再替換，讀取方不會看到寫了一半的文件"""
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def prune(self, keep_keys):
+        """刪除不在保留列表中的舊數據文件"""
+        keep = {self.root / key for key in keep_keys}
+        for path in (self.root / MANIFEST_KEY).parent.glob(f'{Path(ARTIFACT_PREFIX).name}*{ARTIFACT_SUFFIX}'):
+            if path not in keep:
+                path.unlink()
+
+
+class HttpTarget:
+    """HTTP 對象存儲目標：PUT {base_url}/{key}，HEAD 檢查是否已存在
+
+    適用於接受 PUT 的對象存儲網關（如 Vercel Blob、R2/S3 預簽名網關）；
+    舊數據文件的清理由存儲的生命週期規則負責。
+    """
+
+    def __init__(self, base_url, http, token=None, headers=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.http = http  # 共享的 HttpClient
+        self.headers = dict(headers or {})
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+        self.timeout = timeout
+
+    def exists(self, key):
+        response = self.http.request('HEAD', f'{self.base_url}/{key}', headers=self.headers, timeout=self.timeout)
+        return response.status_code == 200
+
+    def put(self, key, body, content_type, content_encoding=None, cache_control=None):
+        headers = dict(self.headers, **{'Content-Type': content_type})
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        if cache_control:
+            headers['Cache-Control'] = cache_control
+        response = self.http.request('PUT', f'{self.base_url}/{key}', data=body,
+                                     headers=headers, timeout=self.timeout)
+        if response.status_code >= 300:
+            raise RuntimeError(f'PUT {key} failed: HTTP {response.status_code} {response.text[:200]}')
+
+
+class VercelPublisher:
+    """內容尋址的靜態數據發布"""
+
+    def __init__(self, target):
+        self.target = target
+        self.manifest_hash = None  # 目標上 manifest 當前指向的哈希
+        self.recent = []  # 最近發布的數據文件鍵
+        self.last_result = None
+
+    def publish(self, portfolio_data):
+        """發布一個快照，返回結構化結果"""
+        start = time.perf_counter()
+        try:
+            digest, body = build_artifact(portfolio_data)
+            key = f'{ARTIFACT_PREFIX}{digest}{ARTIFACT_SUFFIX}'
+            if digest == self.manifest_hash:
+                return self._finish({
+                    'success': True,
+                    'mode': 'unchanged',
+                    'message': '數據沒有變化，無需發布',
+                    'hash': digest,
+                    'bytes_sent': 0
+                })
+
+            bytes_sent = 0
+            if not self.target.exists(key):
+                self.target.put(key, body, 'application/json', 'gzip', ARTIFACT_CACHE_CONTROL)
+                bytes_sent += len(body)
+
+            manifest = json.dumps({
+                'hash': digest,
+                'path': key,
+                'encoding': 'gzip',
+                'bytes': len(body),
+                'last_update': portfolio_data.get('last_update'),
+                'published_at': datetime.now().isoformat()
+            }, ensure_ascii=False).encode('utf-8')
+            self.target.put(MANIFEST_KEY, manifest, 'application/json', None, MANIFEST_CACHE_CONTROL)
+            bytes_sent += len(manifest)
+            self.manifest_hash = digest
+
+            self.recent = ([key] + [k for k in self.recent if k != key])[:KEEP_ARTIFACTS]
+            if hasattr(self.target, 'prune'):
+                self.target.prune(self.recent)
+
+            elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+            logger.info(f"靜態數據已發布: {key} ({bytes_sent} bytes, {elapsed_ms} ms)")
+            return self._finish({
+                'success': True,
+                'mode': 'published',
+                'message': '數據已發布',
+                'hash': digest,
+                'path': key,
+                'bytes_sent': bytes_sent,
+                'elapsed_ms': elapsed_ms
+            })
+        except Exception as e:
+            logger.error(f"靜態數據發布失敗: {e}")
+            return self._finish({'success': False, 'message': f'發布失敗: {e}'})
+
+    def _finish(self, result):
+        result['timestamp'] = datetime.now().isoformat()
+        self.last_result = result
+        return result
+
+
+def load_publisher(http=None, config_file=SYNC_CONFIG_FILE):
+    """按 cloud_config.json 的 "publish" 配置創建發布器，未配置時返回 None"""
+    path = Path(config_file)
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            settings = json.load(f).get('publish') or {}
+    except Exception as e:
+        logger.error(f"載入發布配置失敗: {e}")
+        return None
+
+    kind = settings.get('target')
+    if kind == 'directory' and settings.get('path'):
+        return VercelPublisher(DirectoryTarget(settings['path']))
+    if kind == 'http' and settings.get('base_url'):
+        if http is None:
+            from http_client import HttpClient
+            http = HttpClient()
+        return VercelPublisher(HttpTarget(settings['base_url'], http, token=settings.get('token'),
+                                          headers=settings.get('headers'),
+                                          timeout=int(settings.get('timeout', 30))))
+    return None
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+IB Portfolio Monitor - WebSocket Hub
+WebSocket 廣播 - 每個客戶端訂閱自己關心的賬戶、底層股票和字段
+
+- publish() 只把更新合併到每個客戶端的待發送字典，不做任何 I/O，
+  不會被慢客戶端阻塞（tick / 上傳處理線程調用）
+- 每個連接有自己的發送循環：一次取走所有待發送的更新作為一條消息；
+  客戶端發送得慢時，同一個鍵的中間更新被後來的值覆蓋（計入 coalesced）
+- 待發送的鍵超過上限時清空並發送 resync，客戶端重新載入完整數據（清空的鍵計入 dropped）
+- 發送循環等待客戶端的喚醒事件，不輪詢；WebSocket 的接收在單獨的線程中進行
+
+客戶端消息:
+    {"type": "subscribe", "accounts": [...], "underlyings": [...], "fields": [...]}
+    （省略或為空表示全部）
+SSE（/api/stream）的訂閱通過查詢參數 accounts、underlyings、fields（逗號分隔）指定，
+消息與 WebSocket 相同。
+
+服務器消息:
+    {"type": "hello", "client_id": N}
+    {"type": "updates", "items": {key: {"id", "account", "underlying", "fields"}}, "dropped": N, "coalesced": N}
+    {"type": "<事件>", ...}（snapshot、status、resync）
+"""
+
+import itertools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING_KEYS = 5000
+SUBSCRIPTION_KEYS = ('accounts', 'underlyings', 'fields')
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+def sse_message(message, seq=None):
+    """把一條消息格式化為 Server-Sent Events 消息，事件名為消息的 type
+
+    提供 seq 時作為事件 id，瀏覽器斷線重連時以 Last-Event-ID 帶回。
+    """
+    data = json.dumps(message, ensure_ascii=False, default=str)
+    event_id = f"id: {seq}\n" if seq is not None else ''
+    return f"{event_id}event: {message['type']}\ndata: {data}\n\n"
+
+
+def parse_subscription(args):
+    """從查詢參數（逗號分隔）解析訂閱；account=all 或省略表示全部賬戶"""
+    subscription = {name: [v for v in (args.get(name) or '').split(',') if v] for name in SUBSCRIPTION_KEYS}
+    account = args.get('account')
+    if account and account != 'all' and not subscription['accounts']:
+        subscription['accounts'] = [account]
+    return subscription
+
+
+class HubClient:
+    """一個 WebSocket 連接的訂閱和待發送更新"""
+
+    def __init__(self, client_id, waker=None):
+        self.client_id = client_id
+        self.waker = waker  # 有新內容時額外調用（asyncio 服務器用來喚醒事件循環中的發送協程）
+        self.accounts = None
+        self.underlyings = None
+        self.fields = None
+        self.pending = {}  # key -> item
+        self.events = {}  # event_type -> payload（同類事件只保留最新的）
+        self.dropped = 0  # 因積壓過多被丟棄的更新
+        self.coalesced = 0  # 發送前被同一個鍵的新值合併的更新
+        self.sent = 0
+        self.connected_at = time.time()
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscription):
+        """更新訂閱，None 或空列表表示全部"""
+        with self.lock:
+            for name in SUBSCRIPTION_KEYS:
+                values = subscription.get(name)
+                setattr(self, name, set(values) if values else None)
+
+    def matches(self, account, underlying):
+        if self.accounts is not None and account not in self.accounts:
+            return False
+        if self.underlyings is not None and underlying not in self.underlyings:
+            return False
+        return True
+
+    def offer(self, items):
+        """合併匹配的更新，返回是否有新的待發送內容"""
+        with self.lock:
+            offered = False
+            for item in items:
+                if not self.matches(item.get('account'), item.get('underlying')):
+                    continue
+                fields = item['fields']
+                if self.fields is not None:
+                    fields = {k: v for k, v in fields.items() if k in self.fields}
+                    if not fields:
+                        continue
+                key = item['key']
+                queued = self.pending.get(key)
+                if queued is None:
+                    self.pending[key] = dict(item, fields=dict(fields))
+                else:
+                    queued['fields'].update(fields)
+                    self.coalesced += 1
+                offered = True
+            if len(self.pending) > MAX_PENDING_KEYS:
+                self.dropped += len(self.pending)
+                self.pending.clear()
+                self.events['resync'] = {'reason': 'backlog'}
+        if offered:
+            self._wake()
+        return offered
+
+    def offer_event(self, event_type, payload, account=None):
+        with self.lock:
+            if account is not None and self.accounts is not None and account not in self.accounts:
+                return
+            self.events[event_type] = payload
+        self._wake()
+
+    def _wake(self):
+        self.wake.set()
+        if self.waker is not None:
+            self.waker()
+
+    def take(self, timeout):
+        """等待並取走所有待發送內容，返回消息列表（timeout=0 時不等待）"""
+        if timeout:
+            self.wake.wait(timeout)
+        with self.lock:
+            self.wake.clear()
+            messages = []
+            if self.pending:
+                messages.append({
+                    'type': 'updates',
+                    'items': {key: {k: v for k, v in item.items() if k != 'key'}
+                              for key, item in self.pending.items()},
+                    'dropped': self.dropped,
+                    'coalesced': self.coalesced
+                })
+            # 事件在更新之後發送（客戶端收到 snapshot 時已經應用了該版本的變化）
+            messages.extend(dict(payload, type=event_type) for event_type, payload in self.events.items())
+            self.events = {}
+            self.pending = {}
+            self.sent += len(messages)
+        return messages
+
+
+class WebSocketHub:
+    """WebSocket 客戶端註冊和更新分發"""
+
+    def __init__(self):
+        self._clients = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def register(self, waker=None):
+        client = HubClient(next(self._ids), waker)
+        with self._lock:
+            self._clients[client.client_id] = client
+        logger.info(f"WebSocket client {client.client_id} connected ({len(self._clients)} total)")
+        return client
+
+    def unregister(self, client):
+        with self._lock:
+            self._clients.pop(client.client_id, None)
+        logger.info(f"WebSocket client {client.client_id} disconnected ({len(self._clients)} total)")
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _snapshot_clients(self):
+        with self._lock:
+            return list(self._clients.values())
+
+    def publish(self, items):
+        """分發更新：items 為 [{'key', 'id', 'account', 'underlying', 'fields'}, ...]"""
+        if not items:
+            return
+        self.published += len(items)
+        for client in self._snapshot_clients():
+            client.offer(items)
+
+    def publish_event(self, event_type, payload, account=None):
+        """分發事件；指定 account 時只發給訂閱了該賬戶（或全部賬戶）的客戶端"""
+        for client in self._snapshot_clients():
+            client.offer_event(event_type, payload, account)
+
+    def handle_message(self, client, message):
+        """處理客戶端消息（目前只有 subscribe）"""
+        try:
+            data = json.loads(message)
+        except (TypeError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('type') == 'subscribe':
+            client.subscribe(data)
+
+    def serve(self, ws):
+        """一個連接的收發循環
+
+        ws 需要提供 send(str) 和阻塞的 receive()（如 flask-sock / simple-websocket），
+        連接關閉時拋出異常。接收在單獨的線程中進行（gevent 下為 greenlet），
+        發送循環只在有新內容或連接關閉時被喚醒。
+        """
+        client = self.register()
+        closed = threading.Event()
+
+        def receive():
+            try:
+                while True:
+                    message = ws.receive()
+                    if message is not None:
+                        self.handle_message(client, message)
+            except Exception as e:
+                logger.debug(f"WebSocket client {client.client_id} closed: {e}")
+            finally:
+                closed.set()
+                client._wake()
+
+        try:
+            ws.send(json.dumps({'type': 'hello', 'client_id': client.client_id}))
+            threading.Thread(target=receive, name=f'ws-receive-{client.client_id}', daemon=True).start()
+            while not closed.is_set():
+                for outgoing in client.take(STREAM_KEEPALIVE_SECONDS):
+                    ws.send(json.dumps(outgoing, ensure_ascii=False, default=str))
+        except Exception as e:
+            logger.debug(f"WebSocket client {client.client_id} closed: {e}")
+        finally:
+            self.unregister(client)
+
+    def stream(self, subscription, keepalive=STREAM_KEEPALIVE_SECONDS):
+        """Server-Sent Events 生成器：消息與 WebSocket 相同，事件名為消息的 type
+
+        生成器被關閉（客戶端斷開後的下一次寫入）時註銷客戶端。
+        """
+        client = self.register()
+        client.subscribe(subscription)
+        try:
+            yield "retry: 3000\n"
+            yield sse_message({'type': 'hello', 'client_id': client.client_id})
+            while True:
+                messages = client.take(keepalive)
+                if not messages:
+                    yield ": keep-alive\n\n"
+                for outgoing in messages:
+                    yield sse_message(outgoing)
+        finally:
+            self.unregister(client)
+
+    def stats(self):
+        clients = self._snapshot_clients()
+        return {
+            'clients': len(clients),
+            'published': self.published,
+            'sent': sum(c.sent for c in clients),
+            'dropped': sum(c.dropped for c in clients),
+            'coalesced': sum(c.coalesced for c in clients),
+            'pending': sum(len(c.pending) for c in clients)
+        }